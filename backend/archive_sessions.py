@@ -0,0 +1,43 @@
+"""Move completed and long-untouched sessions into the compressed archive tier.
+
+Usage:
+    python archive_sessions.py [--older-than-days N]
+
+Completed sessions are always archived; other sessions are archived once
+they haven't been written for N days (default: settings.archive_after_days).
+Archived sessions stay listed and load transparently. Sessions a server
+worker is busy with (holding their lock) are skipped until the next run.
+"""
+
+import argparse
+from config import get_settings
+from session_manager import SessionManager
+
+
+def main() -> None:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Archive completed and stale sessions.")
+    parser.add_argument(
+        "--older-than-days",
+        type=float,
+        default=settings.archive_after_days,
+        help="Archive sessions untouched for this many days"
+    )
+    args = parser.parse_args()
+
+    manager = SessionManager()
+    try:
+        report = manager.archive_sessions(args.older_than_days)
+    finally:
+        manager.close()
+
+    print(
+        f"Archived {report.archived} sessions: "
+        f"{report.bytes_before} -> {report.bytes_after} bytes "
+        f"({report.bytes_saved} saved), "
+        f"skipped {report.skipped} in use"
+    )
+
+
+if __name__ == "__main__":
+    main()
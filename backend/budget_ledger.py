@@ -0,0 +1,181 @@
+"""Reservation-based accounting against a session's budget."""
+
+from typing import Callable, Optional
+import litellm
+from config import get_settings
+from models import BudgetInfo
+from models_config import get_model_by_id
+
+
+class BudgetExceeded(Exception):
+    """A call's worst-case cost doesn't fit in what is left of the budget."""
+
+
+def model_prices(model: str) -> Optional[tuple[float, float]]:
+    """Get a model's input and output price per token, or None if it has no known price.
+
+    The registry's prices are used where the model is listed, LiteLLM's otherwise.
+    """
+    model_config = get_model_by_id(model)
+    if model_config:
+        return model_config.input_per_1m / 1_000_000, model_config.output_per_1m / 1_000_000
+    try:
+        return litellm.cost_per_token(model=model, prompt_tokens=1, completion_tokens=1)
+    except Exception:
+        return None
+
+
+def count_prompt_tokens(params: dict) -> int:
+    """Count the tokens in a call's messages, approximately if the model has no tokenizer."""
+    try:
+        return litellm.token_counter(model=params["model"], messages=params["messages"])
+    except Exception:
+        return sum(len(str(m.get("content", ""))) for m in params["messages"]) // 4
+
+
+def estimate_cost(params: dict, extra_prompt_tokens: int = 0) -> float:
+    """Estimate the most a completion call can cost.
+
+    That's its prompt plus the most it may generate (``max_tokens`` or
+    ``max_completion_tokens``, or ``budget_default_output_tokens`` for
+    uncapped calls). Returns 0.0 for models with no known price.
+    """
+    # Check the price first; counting tokens is the slow part
+    prices = model_prices(params["model"])
+    if prices is None:
+        return 0.0
+
+    input_price, output_price = prices
+    output_tokens = (
+        params.get("max_completion_tokens")
+        or params.get("max_tokens")
+        or get_settings().budget_default_output_tokens
+    )
+    return (count_prompt_tokens(params) + extra_prompt_tokens) * input_price + output_tokens * output_price
+
+
+def affordable_output_tokens(params: dict, amount: float) -> Optional[int]:
+    """Get how many tokens a call could generate for ``amount``, once its prompt is paid for.
+
+    Returns None for models with no known price.
+    """
+    prices = model_prices(params["model"])
+    if prices is None:
+        return None
+
+    input_price, output_price = prices
+    if output_price <= 0:
+        return None
+    return max(0, int((amount - count_prompt_tokens(params) * input_price) / output_price))
+
+
+class GenerationCutOff(Exception):
+    """A streamed generation was stopped because going on would overspend the budget."""
+
+
+class SpendMeter:
+    """Tallies what a streamed generation has cost so far, stopping it at a limit.
+
+    Output is counted as it arrives, a token per four characters (and at
+    least one per chunk, as providers stream about a token at a time).
+    ``feed`` raises ``GenerationCutOff`` once the running cost goes over
+    ``limit()``; the text so far is kept. Models with no known price
+    aren't metered.
+    """
+
+    def __init__(self, params: dict, limit: Callable[[], float]):
+        self.prices = model_prices(params["model"])
+        self.prompt_tokens = count_prompt_tokens(params) if self.prices else 0
+        self.output_tokens = 0
+        self.limit = limit
+        self._parts: list[str] = []
+
+    @property
+    def text(self) -> str:
+        """The text generated so far."""
+        return "".join(self._parts)
+
+    @property
+    def cost(self) -> float:
+        """The estimated cost of the prompt and the output so far."""
+        if self.prices is None:
+            return 0.0
+        input_price, output_price = self.prices
+        return self.prompt_tokens * input_price + self.output_tokens * output_price
+
+    def feed(self, text: str) -> None:
+        """Count a chunk of output, raising ``GenerationCutOff`` if it takes the cost over the limit."""
+        self._parts.append(text)
+        self.output_tokens += max(1, -(-len(text) // 4))
+        if self.prices and self.cost > self.limit():
+            raise GenerationCutOff(f"Stopped after ~{self.output_tokens} tokens at ${self.cost:.4f}")
+
+
+class Reservation:
+    """Money held back from the budget for one call."""
+
+    def __init__(self, amount: float, purpose: str):
+        self.amount = amount
+        self.purpose = purpose
+        self.open = True
+
+
+class BudgetLedger:
+    """Holds a call's worst-case cost against the budget until its real cost is known.
+
+    Every call reserves its estimate before it is made and is refused if the
+    estimate doesn't fit next to what is spent and already reserved, so
+    concurrent calls can't jointly overshoot. Settling charges the actual
+    cost (which may come in above the estimate, e.g. after retries) and
+    frees the hold. Reserving and settling don't await, so on one event
+    loop they never interleave.
+    """
+
+    def __init__(self, budget: BudgetInfo):
+        self.budget = budget
+        self._holds: list[Reservation] = []
+        # Holds only live as long as the ledger; drop any left by an interrupted run
+        self.budget.reserved = 0.0
+
+    @property
+    def available(self) -> float:
+        """Budget neither spent nor reserved."""
+        return self.budget.total_budget - self.budget.used - self.budget.reserved
+
+    def reserve(self, amount: float, purpose: str) -> Reservation:
+        """Hold ``amount`` for a call, or raise ``BudgetExceeded`` if it doesn't fit."""
+        if amount > self.available:
+            self.budget.rejected_calls += 1
+            raise BudgetExceeded(
+                f"{purpose} may cost up to ${amount:.4f} but only ${max(self.available, 0.0):.4f} is left"
+            )
+        reservation = Reservation(amount, purpose)
+        self._holds.append(reservation)
+        self.budget.reserved += amount
+        return reservation
+
+    def headroom(self, reservation: Optional[Reservation]) -> float:
+        """What a call may spend in all: its own hold plus whatever nobody has claimed."""
+        held = reservation.amount if reservation is not None and reservation.open else 0.0
+        return held + self.available
+
+    def settle(self, reservation: Optional[Reservation], cost: float) -> None:
+        """Charge a call's actual cost and free what was held for it.
+
+        A reservation is only settled once: settling it again, or after it
+        was released, charges nothing.
+        """
+        if reservation is not None and not reservation.open:
+            return
+        self.release(reservation)
+        self.budget.used += cost
+        self.budget.remaining = self.budget.total_budget - self.budget.used
+
+    def release(self, reservation: Optional[Reservation]) -> None:
+        """Free a hold without charging anything (releasing twice is harmless)."""
+        if reservation is None or not reservation.open:
+            return
+        reservation.open = False
+        self._holds.remove(reservation)
+        # Re-add rather than subtract, so no rounding residue is left once all are freed
+        self.budget.reserved = sum(hold.amount for hold in self._holds)
@@ -0,0 +1,207 @@
+"""Disk-backed cache of LLM completions."""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+import litellm
+from config import get_settings
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_completions_last_used ON completions(last_used);
+"""
+
+# Completion params that don't change what the model answers
+_UNKEYED_PARAMS = {"api_key", "api_base", "client", "stream", "stream_options", "timeout"}
+
+
+def _normalize(value):
+    """Normalize text in a prompt so trivially different copies share a key."""
+    if isinstance(value, str):
+        return unicodedata.normalize("NFC", value).strip()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def cache_key(params: dict) -> str:
+    """Hash the model, messages and sampling params of a completion call.
+
+    Calls made with a user's API key are also keyed by a hash of it, so a
+    user only gets hits on completions their own key paid for; calls on the
+    server's keys (no ``api_key``) share entries with each other.
+    """
+    keyed = {k: v for k, v in params.items() if k not in _UNKEYED_PARAMS and v is not None}
+    if params.get("api_key"):
+        keyed["credential"] = hashlib.sha256(params["api_key"].encode("utf-8")).hexdigest()
+    blob = json.dumps(_normalize(keyed), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Completions by prompt, kept in SQLite with a TTL and LRU eviction.
+
+    Entries older than ``ttl`` seconds are treated as missing. Once there
+    are more than ``max_entries`` entries or ``max_bytes`` of responses, the
+    least recently used ones are evicted.
+    """
+
+    def __init__(self, db_path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 10000, max_bytes: int = 256 * 1024 * 1024):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_settings(cls) -> Optional["CompletionCache"]:
+        """Build the cache from the application settings, or None if it's disabled."""
+        settings = get_settings()
+        if not settings.completion_cache_enabled:
+            return None
+        return cls(
+            settings.completion_cache_path,
+            ttl=settings.completion_cache_ttl,
+            max_entries=settings.completion_cache_max_entries,
+            max_bytes=settings.completion_cache_max_bytes
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def get(self, params: dict) -> Optional[litellm.ModelResponse]:
+        """Get the cached response for a call, or None."""
+        key = cache_key(params)
+        conn = self._connect()
+        row = conn.execute("SELECT response, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                with conn:
+                    conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+
+        with conn:
+            conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return litellm.ModelResponse(**json.loads(row[0]))
+
+    def put(self, params: dict, response) -> bool:
+        """Cache a response; returns False if it can't be serialized."""
+        try:
+            data = json.dumps(response.model_dump(), default=str)
+        except Exception as e:
+            print(f"Could not cache completion: {e}")
+            return False
+
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO completions (key, model, response, size, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (cache_key(params), params["model"], data, len(data), now, now)
+            )
+            self._evict(conn, now)
+        return True
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Drop expired entries, then least recently used ones until within bounds."""
+        self.evictions += conn.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl,)).rowcount
+
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return
+
+        excess_entries = max(0, entries - self.max_entries)
+        excess_bytes = size - self.max_bytes
+        doomed = []
+        for key, entry_size in conn.execute("SELECT key, size FROM completions ORDER BY last_used"):
+            if len(doomed) >= excess_entries and excess_bytes <= 0:
+                break
+            doomed.append((key,))
+            excess_bytes -= entry_size
+        conn.executemany("DELETE FROM completions WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    async def aget(self, params: dict) -> Optional[litellm.ModelResponse]:
+        """Get a cached response without blocking the event loop."""
+        return await asyncio.to_thread(self.get, params)
+
+    async def aput(self, params: dict, response) -> bool:
+        """Cache a response without blocking the event loop."""
+        return await asyncio.to_thread(self.put, params, response)
+
+    def clear(self) -> None:
+        """Empty the cache."""
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM completions")
+
+    def stats(self) -> dict:
+        """Get counters for sizing the cache."""
+        entries, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+        ).fetchone()
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        """Close every connection opened by this cache."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+@lru_cache()
+def get_completion_cache() -> Optional[CompletionCache]:
+    """Get the application's completion cache, or None if it's disabled."""
+    return CompletionCache.from_settings()
@@ -1,7 +1,16 @@
 """Configuration management for Anjoman backend."""
 
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Optional
+
+
+class CallLimits(BaseModel):
+    """Limits on LLM calls to one provider or model; None means unlimited."""
+    concurrency: Optional[int] = None  # Calls in flight at once
+    rpm: Optional[int] = None  # Requests per minute
+    tpm: Optional[int] = None  # Tokens (prompt plus completion) per minute
 
 
 class Settings(BaseSettings):
@@ -18,6 +27,107 @@ class Settings(BaseSettings):
     sessions_dir: str = "../data/sessions"
     default_budget: float = 5.00
     
+    # Session storage backend: "file" (one file per session in sessions_dir)
+    # or "sqlite" (a single WAL-mode database at sqlite_path)
+    session_backend: str = "file"
+    sqlite_path: str = "../data/anjoman.db"
+    
+    # File backend format: "json" (one snapshot file per session) or
+    # "journal" (snapshot header plus append-only records)
+    session_storage_format: str = "json"
+    journal_compact_threshold: int = 200  # Records appended before compaction
+    session_io_workers: int = 4  # Threads for session I/O and (de)serialization
+    archive_after_days: float = 30  # Untouched sessions move to the compressed archive
+    
+    # In-memory session cache (0 entries disables it)
+    session_cache_size: int = 128
+    session_cache_max_bytes: int = 64 * 1024 * 1024
+    session_flush_interval: float = 2.0  # Seconds between write-behind flushes
+    
+    # Seconds between rescans of sessions_dir for session files changed
+    # outside the app (listing is served from the catalog in between)
+    session_catalog_refresh_interval: float = 60.0
+    
+    # Per-session lock files, shared by every worker process on this host
+    session_lock_dir: str = "../data/locks"
+    
+    # Pooled HTTP clients for LLM providers, one per provider and base URL
+    provider_max_connections: int = 100
+    provider_max_keepalive_connections: int = 20
+    provider_keepalive_expiry: float = 120.0  # Seconds an idle connection stays open
+    provider_timeout: float = 600.0  # Seconds per provider request
+    provider_base_urls: dict[str, str] = {}  # Per-provider API base URL overrides (e.g. a proxy)
+    provider_warmup: bool = True  # Connect to every provider at startup
+    provider_warmup_timeout: float = 5.0
+    
+    # LLM call scheduling: calls over a limit wait their turn instead of
+    # failing. Keys are provider names (e.g. "openai") or model ids, and
+    # values set any of concurrency, rpm and tpm
+    provider_limits: dict[str, CallLimits] = {}
+    model_limits: dict[str, CallLimits] = {}
+    default_provider_concurrency: int = 32  # For providers without a concurrency limit
+    
+    # Retries of transient LLM errors (429, 5xx, timeouts), with exponential
+    # backoff and jitter, and optional hedging: a duplicate request fired when
+    # a call runs longer than the llm_hedge_quantile of its model's latencies
+    llm_max_retries: int = 3
+    llm_retry_base_delay: float = 0.5  # Seconds, doubled for each retry
+    llm_retry_max_delay: float = 20.0
+    llm_hedging: bool = False
+    llm_hedge_quantile: float = 0.95
+    llm_hedge_min_samples: int = 20  # Latencies seen before a model is hedged
+    llm_hedge_min_delay: float = 0.5
+    
+    # Time limits on iterations, overridable per request. A Ray that misses
+    # its slot is marked timed out and the round goes on; Rays not reached
+    # by the deadline are skipped, leaving summary_time_reserve seconds of
+    # it for Dana to summarize whatever arrived
+    agent_timeout: float = 120.0
+    iteration_deadline: Optional[float] = None  # None means no overall deadline
+    summary_time_reserve: float = 30.0
+    
+    # Iterations run as background jobs on a pool of in-process workers, so
+    # they carry on if the client disconnects. Finished jobs (and their
+    # events) are kept for status requests and late stream attaches, up to
+    # iteration_job_history of them. Each keeps its last
+    # iteration_job_event_buffer events for clients resuming a stream
+    iteration_workers: int = 4
+    iteration_job_history: int = 100
+    iteration_job_event_buffer: int = 5000
+    
+    # Live events are also fanned out to everyone watching a session. Each
+    # viewer gets a queue of at most event_subscriber_queue events; when it's
+    # full, text deltas are dropped first, then the viewer is marked lagged
+    # and skips what's queued. Idle streams get a keepalive comment every
+    # event_keepalive_interval seconds
+    event_subscriber_queue: int = 1000
+    event_keepalive_interval: float = 15.0
+    
+    # Cache of LLM completions keyed by model, prompt and sampling params;
+    # hits cost nothing. Requests can bypass it with use_cache=false
+    completion_cache_enabled: bool = False
+    completion_cache_path: str = "../data/completion_cache.db"
+    completion_cache_ttl: float = 7 * 24 * 3600  # Seconds
+    completion_cache_max_entries: int = 10000
+    completion_cache_max_bytes: int = 256 * 1024 * 1024
+    
+    # Every LLM call reserves its worst-case cost from the session budget
+    # before it's made; calls with no output cap are assumed to generate this many tokens
+    budget_default_output_tokens: int = 2048
+    # A Ray's output cap shrinks to what the budget can still pay for, but
+    # it isn't called at all if that's fewer than this many tokens
+    budget_min_output_tokens: int = 100
+    
+    # Previous-iteration context in Ray prompts. The latest iterations are
+    # kept verbatim and older ones are rolled into a digest that folds every
+    # context_digest_fanout entries into one, so the context fits in
+    # min(context_max_tokens, context_window_share of the model's window)
+    context_max_tokens: int = 6000
+    context_window_share: float = 0.5
+    context_recent_iterations: int = 2
+    context_digest_fanout: int = 4
+    context_digest_entry_tokens: int = 150
+    
     # CORS
     cors_origins: list[str] = ["http://localhost:3000"]
     
@@ -0,0 +1,114 @@
+"""Token-budgeted context of previous iterations for Ray prompts.
+
+Once a session has more than ``context_recent_iterations`` iterations, the
+older ones are rolled into the session's digest as they complete: each
+becomes a short entry, and every ``context_digest_fanout`` entries of the
+same level are folded into one entry of the next level up. Like a binary
+counter, the digest then holds a handful of entries per level, with the
+oldest iterations the most condensed, and stays small however long the
+deliberation runs.
+"""
+
+import re
+from typing import Optional
+import litellm
+from config import get_settings
+from models import DigestEntry, Iteration, Session
+from models_config import get_context_window
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Count the tokens in some text, approximately for models LiteLLM has no tokenizer for."""
+    try:
+        return litellm.token_counter(model=model or "gpt-4o", text=text)
+    except Exception:
+        return len(text) // 4
+
+
+def clip(text: str, max_tokens: int) -> str:
+    """Shorten text to roughly ``max_tokens`` tokens, at a word boundary."""
+    max_chars = max(max_tokens, 1) * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0].rstrip(" ,;:") + "..."
+
+
+def _first_sentences(text: str, count: int = 2) -> str:
+    """Get the first few sentences of some text."""
+    sentences = re.split(r"(?<=[.!?])\s+", text.strip())
+    return " ".join(sentences[:count])
+
+
+def context_budget(model: str) -> int:
+    """Get how many tokens of previous-iteration context a model's prompt may hold."""
+    settings = get_settings()
+    return min(settings.context_max_tokens, int(get_context_window(model) * settings.context_window_share))
+
+
+def digest_iteration(iteration: Iteration, max_tokens: Optional[int] = None) -> DigestEntry:
+    """Condense one iteration to its summary's opening and disagreements."""
+    max_tokens = max_tokens or get_settings().context_digest_entry_tokens
+    parts = []
+    if iteration.user_guidance:
+        parts.append(f"Guidance: {clip(iteration.user_guidance, max_tokens // 4)}")
+    if iteration.summary:
+        parts.append(clip(_first_sentences(iteration.summary.summary), max_tokens // 2))
+        if iteration.summary.key_disagreements:
+            parts.append(f"Disagreed on: {'; '.join(iteration.summary.key_disagreements[:3])}.")
+    else:
+        parts.append("No summary.")
+
+    return DigestEntry(
+        first_iteration=iteration.iteration_number,
+        last_iteration=iteration.iteration_number,
+        text=clip(" ".join(parts), max_tokens)
+    )
+
+
+def fold_entries(entries: list[DigestEntry], max_tokens: Optional[int] = None) -> DigestEntry:
+    """Condense consecutive digest entries into one entry a level up."""
+    max_tokens = max_tokens or get_settings().context_digest_entry_tokens
+    share = max(max_tokens // len(entries), 1)
+    return DigestEntry(
+        first_iteration=entries[0].first_iteration,
+        last_iteration=entries[-1].last_iteration,
+        level=entries[0].level + 1,
+        text=" ".join(f"({entry_label(entry)}) {clip(entry.text, share)}" for entry in entries)
+    )
+
+
+def entry_label(entry: DigestEntry) -> str:
+    """Name the iterations a digest entry covers."""
+    if entry.first_iteration == entry.last_iteration:
+        return f"Iteration {entry.first_iteration}"
+    return f"Iterations {entry.first_iteration}-{entry.last_iteration}"
+
+
+def update_context_digest(session: Session) -> bool:
+    """Roll iterations that are no longer recent into the session's digest.
+
+    Only iterations not yet in the digest are condensed, so this is cheap
+    to call after every iteration. Returns whether the digest changed.
+    """
+    settings = get_settings()
+    digest = session.context_digest
+    if not session.iterations:
+        return False
+
+    cutoff = session.iterations[-1].iteration_number - settings.context_recent_iterations
+    changed = False
+    for iteration in session.iterations:
+        if not digest.through_iteration < iteration.iteration_number <= cutoff:
+            continue
+        digest.entries.append(digest_iteration(iteration, settings.context_digest_entry_tokens))
+        digest.through_iteration = iteration.iteration_number
+        changed = True
+
+        # Levels never increase towards the newest entry, so a full run of one level is always at the end
+        fanout = settings.context_digest_fanout
+        while len(digest.entries) >= fanout and len({e.level for e in digest.entries[-fanout:]}) == 1:
+            folded = fold_entries(digest.entries[-fanout:], settings.context_digest_entry_tokens)
+            digest.entries[-fanout:] = [folded]
+
+    return changed
+
@@ -0,0 +1,125 @@
+"""In-process publish/subscribe for live iteration events."""
+
+import asyncio
+from collections import deque
+from functools import lru_cache
+from typing import Optional
+from config import get_settings
+
+
+# Events a lagging subscriber can do without: the full text follows in the turn's response or summary
+DROPPABLE_EVENTS = ('agent_delta', 'summary_delta')
+
+
+class Subscription:
+    """One subscriber's bounded queue of events from a topic.
+
+    ``offer`` never blocks. When the queue is full, the oldest queued text
+    delta is dropped to make room. If there are none, the subscriber has
+    fallen too far behind: its queue is emptied, leaving a ``lagged``
+    event saying how many events it missed, and it carries on live from
+    the new event.
+    """
+
+    def __init__(self, topic: str, max_events: int):
+        self.topic = topic
+        self.max_events = max_events
+        self.dropped = 0
+        self.lagged = 0  # Times the queue was emptied
+        self._events: deque[tuple[Optional[str], dict]] = deque()
+        self._ready = asyncio.Event()
+
+    def offer(self, event_id: Optional[str], event: dict) -> None:
+        """Queue an event, dropping others if the queue is full."""
+        if len(self._events) >= self.max_events and not self._drop_delta():
+            # A lagged event not read yet is always first; fold it into the new one
+            earlier = self._events.popleft()[1]['missed'] if self._events[0][1]['type'] == 'lagged' else 0
+            self.dropped += len(self._events)
+            self.lagged += 1
+            missed = earlier + len(self._events)
+            self._events.clear()
+            self._events.append((None, {'type': 'lagged', 'missed': missed}))
+
+        self._events.append((event_id, event))
+        self._ready.set()
+
+    def _drop_delta(self) -> bool:
+        """Drop the oldest queued text delta, if there is one."""
+        for index, (_, event) in enumerate(self._events):
+            if event['type'] in DROPPABLE_EVENTS:
+                del self._events[index]
+                self.dropped += 1
+                return True
+        return False
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[tuple[Optional[str], dict]]:
+        """Wait for the next ``(event_id, event)``, or None if none came within ``timeout`` seconds."""
+        if not self._events:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._events.popleft()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+
+class EventBroker:
+    """Fans events out to everyone subscribed to their topic (e.g. a session ID).
+
+    Publishing only puts the event on each subscriber's bounded queue, so
+    it never waits and a slow subscriber can't hold up the publisher; see
+    ``Subscription`` for what happens when a queue fills up.
+    """
+
+    def __init__(self, max_events: Optional[int] = None):
+        self.max_events = max_events or get_settings().event_subscriber_queue
+        self._subscribers: dict[str, set[Subscription]] = {}
+        self.published = 0
+        self._dropped_by_departed = 0
+
+    def publish(self, topic: str, event_id: Optional[str], event: dict) -> None:
+        """Offer an event to every subscriber of a topic."""
+        self.published += 1
+        for subscription in self._subscribers.get(topic, ()):
+            subscription.offer(event_id, event)
+
+    def subscribe(self, topic: str) -> Subscription:
+        """Start receiving a topic's events. Call ``unsubscribe`` when done."""
+        subscription = Subscription(topic, self.max_events)
+        self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Stop a subscription (unsubscribing twice is harmless)."""
+        subscribers = self._subscribers.get(subscription.topic)
+        if subscribers is None or subscription not in subscribers:
+            return
+        subscribers.discard(subscription)
+        self._dropped_by_departed += subscription.dropped
+        if not subscribers:
+            del self._subscribers[subscription.topic]
+
+    def subscriber_count(self, topic: str) -> int:
+        """Get how many subscribers a topic has."""
+        return len(self._subscribers.get(topic, ()))
+
+    def stats(self) -> dict:
+        """Get topic, subscriber and dropped event counts."""
+        subscriptions = [s for subscribers in self._subscribers.values() for s in subscribers]
+        return {
+            "topics": len(self._subscribers),
+            "subscribers": len(subscriptions),
+            "published": self.published,
+            "queued": sum(len(s) for s in subscriptions),
+            "dropped": self._dropped_by_departed + sum(s.dropped for s in subscriptions),
+            "lagging_subscribers": sum(1 for s in subscriptions if s.lagged)
+        }
+
+
+@lru_cache()
+def get_event_broker() -> EventBroker:
+    """Get the application's shared event broker."""
+    return EventBroker()
@@ -0,0 +1,262 @@
+"""Iterations run as background jobs, independent of the requests that start them."""
+
+import asyncio
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from budget_ledger import BudgetExceeded
+from config import get_settings
+from event_broker import EventBroker, get_event_broker
+from models import ContinueSessionRequest, IterationJob, JobStatus, Session
+from orchestrator import Dana
+from session_manager import SessionManager
+
+
+# Events for a Ray turn that's over, one way or another
+TURN_EVENTS = ('agent_response', 'agent_error', 'agent_timeout')
+
+
+class _Job:
+    """A submitted iteration, with the latest events it has produced.
+
+    Events are numbered from 0 in the order they happen. Only the last
+    ``buffer`` of them are kept, so a follower that fell further behind
+    than that skips the ones that are gone.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        request: ContinueSessionRequest,
+        stream_tokens: bool,
+        buffer: int,
+        broker: EventBroker
+    ):
+        self.info = IterationJob(
+            job_id=f"job-{uuid.uuid4().hex[:12]}",
+            session_id=session.session_id,
+            created_at=datetime.now()
+        )
+        self.session = session
+        self.request = request
+        self.stream_tokens = stream_tokens
+        self.events: deque[dict] = deque(maxlen=buffer)
+        self.broker = broker
+        self.done = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    @property
+    def first_event_id(self) -> int:
+        """The number of the oldest event still kept."""
+        return self.info.events - len(self.events)
+
+    def publish(self, event: dict) -> None:
+        """Record an event, wake everyone following the job and pass it on to the session's watchers.
+
+        Watchers get it as ``<job_id>:<event number>``, so they can pick up
+        the job's own stream from there.
+        """
+        self.broker.publish(self.info.session_id, f"{self.info.job_id}:{self.info.events}", event)
+        self.events.append(event)
+        self.info.events += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def finish(self, status: JobStatus, error: Optional[str] = None) -> None:
+        """Mark the job as over."""
+        self.info.status = status
+        self.info.error = error
+        self.info.finished_at = datetime.now()
+        self.done.set()
+        self._changed.set()
+
+    async def follow(self, last_event_id: Optional[int] = None) -> AsyncIterator[tuple[Optional[int], dict]]:
+        """Yield ``(event_id, event)`` for events after ``last_event_id`` (all if None), then new ones until it's over.
+
+        If some of the events asked for are no longer kept, an
+        ``events_lost`` event (with no ID) comes first, saying how many.
+        """
+        next_id = 0 if last_event_id is None else last_event_id + 1
+        while True:
+            changed = self._changed
+            if next_id < self.first_event_id:
+                yield None, {'type': 'events_lost', 'missed': self.first_event_id - next_id}
+                next_id = self.first_event_id
+            while next_id < self.info.events:
+                yield next_id, self.events[next_id - self.first_event_id]
+                next_id += 1
+            if self.done.is_set():
+                return
+            await changed.wait()
+
+
+class IterationJobs:
+    """Runs iterations on a pool of in-process workers.
+
+    Submitting an iteration returns its job straight away; the job is
+    queued until one of ``iteration_workers`` workers picks it up, and then
+    runs to the end whatever happens to the request that submitted it or
+    to clients watching it. The session is saved after every Ray turn (with
+    the turns so far as its ``current_iteration``) and once the iteration
+    is complete. If the job fails or is cancelled, the turns so far are
+    kept as an iteration of their own, marked as interrupted. Jobs keep their latest ``iteration_job_event_buffer``
+    events, numbered, so clients can attach to a job's stream at any time
+    and get everything from the start, or resume after the last event
+    they saw. Events are also published to the event broker under the
+    session's ID, for anyone watching the session.
+
+    The caller locks the session before submitting (so a busy session is
+    rejected up front); the job releases the lock when it finishes.
+    """
+
+    def __init__(
+        self,
+        session_manager: SessionManager,
+        workers: Optional[int] = None,
+        history: Optional[int] = None,
+        event_buffer: Optional[int] = None,
+        broker: Optional[EventBroker] = None
+    ):
+        settings = get_settings()
+        self.session_manager = session_manager
+        self.worker_count = workers or settings.iteration_workers
+        self.history = history or settings.iteration_job_history
+        self.event_buffer = event_buffer or settings.iteration_job_event_buffer
+        self.broker = broker or get_event_broker()
+        self._jobs: OrderedDict[str, _Job] = OrderedDict()
+        self._latest: dict[str, str] = {}  # Session ID -> its latest job's ID
+        self._queue: asyncio.Queue[_Job] = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Start the workers. Must be called from the event loop."""
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._work()) for _ in range(self.worker_count)]
+
+    async def aclose(self) -> None:
+        """Stop the workers, cancelling running and queued jobs (their turns so far are saved)."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            job.finish(JobStatus.CANCELLED, "Server shut down before the job started")
+            await self.session_manager.arelease_session(job.info.session_id)
+
+    def submit(self, session: Session, request: ContinueSessionRequest, stream_tokens: bool = True) -> IterationJob:
+        """Queue an iteration of a locked session and return its job.
+
+        With ``stream_tokens``, the job's stream includes text as it's generated.
+        """
+        job = _Job(session, request, stream_tokens, self.event_buffer, self.broker)
+        self._jobs[job.info.job_id] = job
+        self._latest[session.session_id] = job.info.job_id
+        self._forget_old_jobs()
+        self._queue.put_nowait(job)
+        return job.info
+
+    def get(self, job_id: str) -> Optional[IterationJob]:
+        """Get a job's status, or None if there's no such job (or it's been forgotten)."""
+        job = self._jobs.get(job_id)
+        return job.info if job else None
+
+    def latest_for_session(self, session_id: str) -> Optional[IterationJob]:
+        """Get the most recent job for a session, e.g. to re-attach after a page reload."""
+        return self.get(self._latest.get(session_id, ""))
+
+    async def wait(self, job_id: str) -> IterationJob:
+        """Wait for a job to finish and return its final status."""
+        job = self._jobs[job_id]
+        await job.done.wait()
+        return job.info
+
+    def events(self, job_id: str, last_event_id: Optional[int] = None) -> AsyncIterator[tuple[Optional[int], dict]]:
+        """Follow a job's numbered events after ``last_event_id``, or from the start.
+
+        Raises KeyError for unknown jobs.
+        """
+        return self._jobs[job_id].follow(last_event_id)
+
+    def stats(self) -> dict:
+        """Get worker and job counts."""
+        statuses = [job.info.status for job in self._jobs.values()]
+        return {
+            "workers": len(self._workers),
+            "queued": self._queue.qsize(),
+            **{status.value: statuses.count(status) for status in JobStatus}
+        }
+
+    def _forget_old_jobs(self) -> None:
+        """Drop the oldest finished jobs beyond the history limit."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.done.is_set()]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            job = self._jobs.pop(job_id)
+            if self._latest.get(job.info.session_id) == job_id:
+                del self._latest[job.info.session_id]
+
+    async def _work(self) -> None:
+        """Worker loop: run queued jobs one at a time."""
+        while True:
+            job = await self._queue.get()
+            await self._run(job)
+
+    async def _run(self, job: _Job) -> None:
+        """Run a job's iteration, saving the session as turns land."""
+        settings = get_settings()
+        session, request = job.session, job.request
+        job.info.status = JobStatus.RUNNING
+        job.info.started_at = datetime.now()
+        status, error = JobStatus.FAILED, "Job stopped unexpectedly"
+        iterations_before = len(session.iterations)
+        try:
+            turn_mode = request.turn_mode or session.turn_mode
+            iteration = Dana.run_iteration(
+                session, request.user_guidance, request.api_keys, turn_mode,
+                stream_tokens=job.stream_tokens,
+                agent_timeout=request.agent_timeout or settings.agent_timeout,
+                deadline=request.iteration_deadline or settings.iteration_deadline,
+                use_cache=request.use_cache
+            )
+            async for event in iteration:
+                # A turn is saved before it's announced, so whoever hears of it can load it
+                if event['type'] in TURN_EVENTS:
+                    job.info.turns_completed += 1
+                    await self.session_manager.asave_session(session, flush=True)
+                job.publish(event)
+
+            if len(session.iterations) == iterations_before:
+                # Refused with a budget_exceeded event, leaving the session paused
+                raise BudgetExceeded("Budget exceeded: not enough left for the iteration's summary")
+
+            # Check if budget warning
+            if session.budget.is_warning and not session.budget.is_exceeded:
+                print(f"Budget warning: {session.budget.used:.2f} / {session.budget.total_budget:.2f}")
+
+            # Save session, writing it out now that the iteration is complete
+            await self.session_manager.asave_session(session, flush=True)
+            job.info.iteration = session.iterations[-1]
+            job.publish({'type': 'complete', 'session': session.model_dump(mode='json')})
+            status, error = JobStatus.COMPLETED, None
+
+        except asyncio.CancelledError:
+            status, error = JobStatus.CANCELLED, "Server shut down while the job was running"
+            Dana.keep_interrupted_iteration(session, error)  # Keep the turns so far
+            await self.session_manager.asave_session(session)
+            raise
+
+        except Exception as e:
+            print(f"Iteration job {job.info.job_id} failed: {e}")
+            Dana.keep_interrupted_iteration(session, str(e))  # Keep the turns so far
+            await self.session_manager.asave_session(session)
+            job.publish({'type': 'error', 'message': str(e)})
+            status, error = JobStatus.FAILED, str(e)
+
+        finally:
+            # Free the session before anyone waiting on the job hears it's over
+            try:
+                await self.session_manager.arelease_session(session.session_id)
+            finally:
+                job.finish(status, error)
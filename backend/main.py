@@ -1,28 +1,62 @@
 """Main FastAPI application for Anjoman backend."""
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Literal
 import json
 import asyncio
-import random
 
 from config import get_settings
 from models import (
     CreateSessionRequest, ContinueSessionRequest, Session,
-    SessionStatus, BudgetInfo, Iteration, SessionListItem, SessionProposal
+    SessionStatus, BudgetInfo, Iteration, SessionListItem, SessionProposal,
+    ArchiveReport, SessionQuery, SessionView, SearchHit, IterationJob, JobStatus
 )
 from session_manager import SessionManager
-from orchestrator import Dana, Ray
+from session_lock import SessionBusyError
+from iteration_jobs import IterationJobs
+from event_broker import get_event_broker
+from pagination import InvalidCursorError
+from search_index import build_match_query
+from orchestrator import Dana
+from providers import get_provider_clients
+from scheduler import get_scheduler
+from completion_cache import get_completion_cache
 from models_config import MODELS
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start up and shut down shared resources."""
+    session_manager.start()
+    iteration_jobs.start()
+    
+    # Connect to the providers in the background so startup isn't held up
+    provider_clients = get_provider_clients()
+    warmup = None
+    if settings.provider_warmup:
+        warmup = asyncio.create_task(provider_clients.warm_up(timeout=settings.provider_warmup_timeout))
+    
+    yield
+    
+    if warmup:
+        warmup.cancel()
+    await iteration_jobs.aclose()
+    await provider_clients.aclose()
+    await session_manager.aclose()
+    if get_completion_cache():
+        get_completion_cache().close()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Anjoman API",
     description="Structured Multi-LLM Deliberation Tool",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -33,10 +67,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Job-Id"],
 )
 
-# Initialize session manager
+# Initialize session manager and the workers that run iterations
 session_manager = SessionManager()
+iteration_jobs = IterationJobs(session_manager)
 
 
 @app.get("/")
@@ -57,7 +93,8 @@ async def propose_session(request: CreateSessionRequest):
         request.budget, 
         request.num_agents,
         request.model_preference,
-        request.api_keys
+        request.api_keys,
+        use_cache=request.use_cache
     )
 
 
@@ -87,173 +124,170 @@ async def create_session(request: CreateSessionRequest):
             used=0.0,
             remaining=request.budget
         ),
-        status=SessionStatus.ACTIVE
+        status=SessionStatus.ACTIVE,
+        turn_mode=request.turn_mode
     )
     
     # Save session
-    session_manager.save_session(session)
+    await session_manager.asave_session(session)
     
     return session
 
 
-@app.post("/sessions/{session_id}/iterate", response_model=Session)
-async def iterate_session(session_id: str, request: ContinueSessionRequest):
-    """Run one iteration of the discussion (non-streaming)."""
+def session_busy() -> HTTPException:
+    """The 409 for a request on a session another request has locked."""
+    return HTTPException(
+        status_code=409,
+        detail="Another request is already running on this session"
+    )
+
+
+async def acquire_session(session_id: str) -> Session:
+    """Lock a session for a request that modifies it.
     
-    # Load session
-    session = session_manager.load_session(session_id)
+    Raises 409 if another request is already working on the session, so a
+    double-submitted iteration isn't paid for twice.
+    """
+    try:
+        session = await session_manager.aacquire_session(session_id)
+    except SessionBusyError:
+        raise session_busy()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+
+async def submit_iteration(session_id: str, request: ContinueSessionRequest, stream_tokens: bool) -> IterationJob:
+    """Lock a session and queue an iteration of it as a background job.
     
-    # Check budget
-    if session.budget.is_exceeded:
-        session.status = SessionStatus.PAUSED
-        session_manager.save_session(session)
-        raise HTTPException(
-            status_code=400,
-            detail=f"Budget exceeded: ${session.budget.used:.2f} / ${session.budget.total_budget:.2f}"
-        )
-    
-    # Determine iteration number
-    iteration_number = len(session.iterations) + 1
-    
-    # Randomize agent order for this iteration
-    agents_order = session.agents.copy()
-    random.shuffle(agents_order)
-    
-    # Collect messages from each agent in randomized order
-    messages = []
-    for agent in agents_order:
-        # Check budget before each agent
-        if session.budget.used >= session.budget.total_budget:
-            break
-        
-        message = await Ray.speak(
-            agent=agent,
-            session=session,
-            iteration_number=iteration_number,
-            previous_messages=messages,
-            api_keys=request.api_keys
-        )
-        messages.append(message)
+    The job releases the lock when it finishes. Raises 400 (pausing the
+    session) if its budget is already spent, or too little is left for the
+    iteration's summary.
+    """
+    session = await acquire_session(session_id)
+    try:
+        # Check budget
+        if session.budget.is_exceeded or not Dana.can_afford_iteration(session, request.user_guidance, request.api_keys):
+            session.status = SessionStatus.PAUSED
+            await session_manager.asave_session(session)
+            raise HTTPException(
+                status_code=400,
+                detail=f"Budget exceeded: ${session.budget.used:.2f} / ${session.budget.total_budget:.2f}"
+            )
         
-        # Update budget
-        session.budget.used += message.cost
-        session.budget.remaining = session.budget.total_budget - session.budget.used
-    
-    # Create iteration object
-    iteration = Iteration(
-        iteration_number=iteration_number,
-        messages=messages,
-        summary=None,  # Will be filled by Dana
-        user_guidance=request.user_guidance
-    )
+        return iteration_jobs.submit(session, request, stream_tokens)
+    except BaseException:
+        await session_manager.arelease_session(session_id)
+        raise
+
+
+def job_event_stream(job_id: str, last_event_id: Optional[int] = None) -> StreamingResponse:
+    """Stream a job's events (Server-Sent Events) after ``last_event_id``, or from its first.
     
-    # Have Dana summarize
-    summary = await Dana.summarize_iteration(session, iteration, request.api_keys)
-    iteration.summary = summary
+    Each event carries its number as the SSE ``id``, which a reconnecting
+    client sends back as ``Last-Event-ID`` to pick up where it left off.
+    """
+    live_from = iteration_jobs.get(job_id).events
     
-    # Add iteration to session
-    session.iterations.append(iteration)
-    session.updated_at = datetime.now()
+    async def event_generator():
+        # Leaving early (e.g. the client disconnected) only stops the stream, not the job
+        async for event_id, event in iteration_jobs.events(job_id, last_event_id):
+            event_line = f"id: {event_id}\n" if event_id is not None else ""
+            yield f"{event_line}data: {json.dumps(event)}\n\n"
+            live = event_id is not None and event_id >= live_from
+            if live and event['type'] in ('agent_start', 'agent_response', 'agent_error', 'agent_timeout', 'summarizing'):
+                await asyncio.sleep(0.1)  # Small delay for UI (missed events are replayed at once)
     
-    # Check if budget warning
-    if session.budget.is_warning and not session.budget.is_exceeded:
-        print(f"Budget warning: {session.budget.used:.2f} / {session.budget.total_budget:.2f}")
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+@app.post("/sessions/{session_id}/iterate", response_model=Session)
+async def iterate_session(session_id: str, request: ContinueSessionRequest):
+    """Run one iteration of the discussion (non-streaming).
     
-    # Save session
-    session_manager.save_session(session)
+    The iteration runs as a background job, so it completes even if this
+    request is dropped.
+    """
+    job = await submit_iteration(session_id, request, stream_tokens=False)
+    job = await iteration_jobs.wait(job.job_id)
+    if job.status != JobStatus.COMPLETED:
+        raise HTTPException(status_code=500, detail=job.error or "Iteration did not complete")
     
-    return session
+    return await session_manager.aload_session(session_id)
 
 
 @app.post("/sessions/{session_id}/iterate/stream")
 async def iterate_session_stream(session_id: str, request: ContinueSessionRequest):
-    """Run one iteration with streaming updates (Server-Sent Events)."""
+    """Run one iteration with streaming updates (Server-Sent Events).
+    
+    The iteration runs as a background job: if the client disconnects it
+    carries on, and the client can resume with ``/jobs/{job_id}/stream``
+    and the last event ID it saw (the job ID is in the ``X-Job-Id``
+    header, or from ``/sessions/{session_id}/job``).
+
+    A request that can't start an iteration is refused before any events
+    are sent, with an HTTP status rather than an ``error`` event: 404 for
+    an unknown session, 409 if it already has an iteration running and
+    400 if its budget is spent. Failures during the iteration still arrive
+    as an ``error`` event on the stream.
+    """
+    job = await submit_iteration(session_id, request, stream_tokens=True)
+    response = job_event_stream(job.job_id)
+    response.headers["X-Job-Id"] = job.job_id
+    return response
+
+
+@app.post("/sessions/{session_id}/jobs", response_model=IterationJob, status_code=202)
+async def submit_iteration_job(session_id: str, request: ContinueSessionRequest):
+    """Start an iteration in the background and return its job straight away."""
+    return await submit_iteration(session_id, request, stream_tokens=True)
+
+
+@app.get("/sessions/{session_id}/job", response_model=IterationJob)
+async def get_session_job(session_id: str):
+    """Get a session's most recent iteration job."""
+    job = iteration_jobs.latest_for_session(session_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="No job for this session")
+    return job
+
+
+@app.get("/sessions/{session_id}/events")
+async def watch_session(session_id: str):
+    """Follow a session's live iteration events (Server-Sent Events).
+    
+    Any number of viewers can watch the same session without starting an
+    iteration of their own; the stream stays open across iterations. Each
+    viewer has its own bounded queue, so a slow one misses events (text
+    deltas first, then a ``lagged`` event) rather than slowing the
+    iteration. Event IDs are ``<job_id>:<event number>``, where the job's
+    own stream (``/jobs/{job_id}/stream``) can take over to fill in gaps.
+    """
+    if not await session_manager.aload_session_view(session_id, SessionView(include_iterations=False)):
+        raise HTTPException(status_code=404, detail="Session not found")
+    broker = get_event_broker()
     
     async def event_generator():
+        subscription = broker.subscribe(session_id)
         try:
-            # Load session
-            session = session_manager.load_session(session_id)
-            if not session:
-                yield f"data: {json.dumps({'type': 'error', 'message': 'Session not found'})}\n\n"
-                return
-            
-            # Check budget
-            if session.budget.is_exceeded:
-                yield f"data: {json.dumps({'type': 'error', 'message': 'Budget exceeded'})}\n\n"
-                return
-            
-            # Send start event
-            iteration_number = len(session.iterations) + 1
-            yield f"data: {json.dumps({'type': 'start', 'iteration': iteration_number, 'total_agents': len(session.agents)})}\n\n"
-            
-            # Randomize agent order for this iteration
-            agents_order = session.agents.copy()
-            random.shuffle(agents_order)
-            
-            # Collect messages from each agent in randomized order
-            messages = []
-            for idx, agent in enumerate(agents_order):
-                # Check budget before each agent
-                if session.budget.used >= session.budget.total_budget:
-                    yield f"data: {json.dumps({'type': 'budget_exceeded'})}\n\n"
-                    break
-                
-                # Send agent start event
-                yield f"data: {json.dumps({'type': 'agent_start', 'agent_id': agent.id, 'agent_role': agent.role, 'index': idx})}\n\n"
-                await asyncio.sleep(0.1)  # Small delay for UI
-                
-                # Get agent response
-                message = await Ray.speak(
-                    agent=agent,
-                    session=session,
-                    iteration_number=iteration_number,
-                    previous_messages=messages,
-                    api_keys=request.api_keys
-                )
-                messages.append(message)
-                
-                # Update budget
-                session.budget.used += message.cost
-                session.budget.remaining = session.budget.total_budget - session.budget.used
-                
-                # Check if this was an error response
-                is_error = message.content.startswith("[Error:")
-                
-                # Send agent response event (use mode='json' to serialize dates)
-                event_type = 'agent_error' if is_error else 'agent_response'
-                yield f"data: {json.dumps({'type': event_type, 'message': message.model_dump(mode='json'), 'budget': session.budget.model_dump(mode='json')})}\n\n"
-                await asyncio.sleep(0.1)
-            
-            # Create iteration object
-            iteration = Iteration(
-                iteration_number=iteration_number,
-                messages=messages,
-                summary=None,
-                user_guidance=request.user_guidance
-            )
-            
-            # Send summarizing event
-            yield f"data: {json.dumps({'type': 'summarizing'})}\n\n"
-            await asyncio.sleep(0.1)
-            
-            # Have Dana summarize
-            summary = await Dana.summarize_iteration(session, iteration, request.api_keys)
-            iteration.summary = summary
-            
-            # Add iteration to session
-            session.iterations.append(iteration)
-            session.updated_at = datetime.now()
-            
-            # Save session
-            session_manager.save_session(session)
-            
-            # Send complete event with full session (use mode='json' to serialize dates)
-            yield f"data: {json.dumps({'type': 'complete', 'session': session.model_dump(mode='json')})}\n\n"
-            
-        except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            while True:
+                item = await subscription.get(timeout=settings.event_keepalive_interval)
+                if item is None:
+                    yield ": keepalive\n\n"  # Lets proxies and the server notice a gone client
+                    continue
+                event_id, event = item
+                event_line = f"id: {event_id}\n" if event_id is not None else ""
+                yield f"{event_line}data: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
     
     return StreamingResponse(
         event_generator(),
@@ -266,25 +300,157 @@ async def iterate_session_stream(session_id: str, request: ContinueSessionReques
     )
 
 
+@app.get("/jobs/{job_id}", response_model=IterationJob)
+async def get_job(job_id: str):
+    """Get an iteration job's status, with the iteration once it's completed."""
+    job = iteration_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """Attach to an iteration job's events (Server-Sent Events).
+    
+    With a ``Last-Event-ID`` header (sent by browsers when an EventSource
+    reconnects), only the events after it are replayed before going live;
+    otherwise the stream starts from the job's first event.
+    """
+    if not iteration_jobs.get(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    try:
+        after = int(last_event_id) if last_event_id else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID must be an event number")
+    return job_event_stream(job_id, after)
+
+
 @app.get("/sessions", response_model=list[SessionListItem])
-async def list_sessions():
-    """List all sessions."""
-    return session_manager.list_sessions()
+async def list_sessions(
+    response: Response,
+    status: Optional[SessionStatus] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    min_cost: Optional[float] = None,
+    max_cost: Optional[float] = None,
+    issue: Optional[str] = None,
+    sort: Literal["created_at", "total_cost", "iteration_count"] = "created_at",
+    order: Literal["asc", "desc"] = "desc",
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None
+):
+    """List sessions, optionally filtered, sorted and paginated.
+    
+    Without ``limit`` every matching session is returned. With it, the
+    cursor for the next page (if any) is sent in the X-Next-Cursor header.
+    """
+    query = SessionQuery(
+        status=status,
+        created_from=created_from,
+        created_to=created_to,
+        min_cost=min_cost,
+        max_cost=max_cost,
+        issue=issue,
+        sort=sort,
+        order=order,
+        limit=limit,
+        cursor=cursor
+    )
+    
+    try:
+        page = await session_manager.aquery_sessions(query)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
+
+
+@app.get("/sessions/search", response_model=list[SearchHit])
+async def search_sessions(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Full-text search over issues, agent messages, summaries and disagreements.
+    
+    Words must all match (the last one as a prefix); use double quotes for
+    phrases. Hits are ranked by relevance and point to the session,
+    iteration and message they were found in.
+    """
+    if build_match_query(q) is None:
+        raise HTTPException(status_code=400, detail="Search query has no searchable terms")
+    try:
+        return await session_manager.asearch_sessions(q, limit)
+    except NotImplementedError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def parse_iteration_range(iterations: str) -> tuple[Optional[int], Optional[int]]:
+    """Parse an iteration selector like "3", "2..5", "-3..", "..4" or "latest"."""
+    if iterations == "latest":
+        return -1, -1
+    try:
+        if ".." not in iterations:
+            number = int(iterations)
+            return number, number
+        start, end = iterations.split("..", 1)
+        return (int(start) if start else None), (int(end) if end else None)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid iteration range: {iterations}")
 
 
 @app.get("/sessions/{session_id}", response_model=Session)
-async def get_session(session_id: str):
-    """Get a specific session."""
-    session = session_manager.load_session(session_id)
+async def get_session(
+    session_id: str,
+    fields: Literal["full", "summaries", "header"] = "full",
+    iterations: Optional[str] = None,
+    include_messages: bool = True
+):
+    """Get a specific session.
+    
+    ``fields=summaries`` drops agent messages, ``fields=header`` drops
+    iterations entirely, and ``iterations`` selects a range of iteration
+    numbers (negative numbers count from the end).
+    """
+    iteration_from, iteration_to = parse_iteration_range(iterations) if iterations else (None, None)
+    view = SessionView(
+        include_iterations=fields != "header",
+        include_messages=include_messages and fields == "full",
+        iteration_from=iteration_from,
+        iteration_to=iteration_to
+    )
+    
+    if view == SessionView():
+        session = await session_manager.aload_session(session_id)
+    else:
+        session = await session_manager.aload_session_view(session_id, view)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     return session
 
 
+@app.get("/sessions/{session_id}/iterations/{iteration_number}", response_model=Iteration)
+async def get_iteration(session_id: str, iteration_number: int):
+    """Get a single iteration of a session."""
+    iteration = await session_manager.aload_iteration(session_id, iteration_number)
+    if not iteration:
+        raise HTTPException(status_code=404, detail="Iteration not found")
+    return iteration
+
+
 @app.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
-    """Delete a session."""
-    success = session_manager.delete_session(session_id)
+    """Delete a session.
+    
+    Raises 409 while another request, like a running iteration, holds the
+    session, since it would save the session again afterwards.
+    """
+    try:
+        success = await session_manager.adelete_session(session_id)
+    except SessionBusyError:
+        raise session_busy()
     if not success:
         raise HTTPException(status_code=404, detail="Session not found")
     return {"status": "deleted", "session_id": session_id}
@@ -293,16 +459,74 @@ async def delete_session(session_id: str):
 @app.post("/sessions/{session_id}/complete")
 async def complete_session(session_id: str):
     """Mark a session as completed."""
-    session = session_manager.load_session(session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    session.status = SessionStatus.COMPLETED
-    session_manager.save_session(session)
+    session = await acquire_session(session_id)
+    try:
+        session.status = SessionStatus.COMPLETED
+        await session_manager.asave_session(session)
+    finally:
+        await session_manager.arelease_session(session_id)
     
     return {"status": "completed", "session_id": session_id}
 
 
+@app.get("/admin/cache")
+async def get_cache_stats():
+    """Get session cache counters (hits, misses, evictions, size)."""
+    return session_manager.cache.stats()
+
+
+@app.get("/admin/jobs")
+async def get_job_stats():
+    """Get iteration worker and job counts."""
+    return iteration_jobs.stats()
+
+
+@app.get("/admin/events")
+async def get_event_stats():
+    """Get live event subscriber counts and events dropped for slow viewers."""
+    return get_event_broker().stats()
+
+
+@app.get("/admin/scheduler")
+async def get_scheduler_stats():
+    """Get LLM call queue depth and wait times per provider and model."""
+    return get_scheduler().stats()
+
+
+@app.get("/admin/completion-cache")
+async def get_completion_cache_stats():
+    """Get completion cache counters, or 404 if the cache is disabled."""
+    cache = get_completion_cache()
+    if cache is None:
+        raise HTTPException(status_code=404, detail="Completion cache is disabled")
+    return await asyncio.to_thread(cache.stats)
+
+
+@app.delete("/admin/completion-cache")
+async def clear_completion_cache():
+    """Empty the completion cache."""
+    cache = get_completion_cache()
+    if cache is None:
+        raise HTTPException(status_code=404, detail="Completion cache is disabled")
+    await asyncio.to_thread(cache.clear)
+    return {"status": "cleared"}
+
+
+@app.post("/admin/archive", response_model=ArchiveReport)
+async def archive_sessions(older_than_days: Optional[float] = None):
+    """Move completed and long-untouched sessions into compressed storage.
+    
+    Sessions with a request running on them are skipped.
+    """
+    if older_than_days is None:
+        older_than_days = settings.archive_after_days
+    
+    try:
+        return await session_manager.aarchive_sessions(older_than_days)
+    except NotImplementedError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.get("/models/pricing")
 async def get_model_pricing():
     """Get approximate pricing information for models.
@@ -320,6 +544,7 @@ async def get_model_pricing():
             "model_id": model.model_id,
             "input_per_1m": model.input_per_1m,
             "output_per_1m": model.output_per_1m,
+            "context_window": model.context_window,
             "note": model.note
         })
 
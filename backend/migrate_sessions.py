@@ -0,0 +1,54 @@
+"""Import file-based sessions into the SQLite backend.
+
+Usage:
+    python migrate_sessions.py [--sessions-dir DIR] [--db PATH]
+
+Defaults come from the application settings (sessions_dir, sqlite_path).
+Sessions already in the database are overwritten with the file version.
+The sessions directory is only read; no catalog or search index is built there.
+"""
+
+import argparse
+from config import get_settings
+from session_store import FileSessionStore
+from sqlite_store import SqliteSessionStore
+
+
+def migrate(sessions_dir: str, db_path: str) -> int:
+    """Copy every session in ``sessions_dir`` into the database at ``db_path``.
+
+    Returns the number of sessions imported.
+    """
+    source = FileSessionStore(sessions_dir, read_only=True)
+    imported = 0
+
+    try:
+        target = SqliteSessionStore(db_path)
+        try:
+            for item in source.list_sessions():
+                session = source.load_session(item.session_id)
+                if session is None:
+                    continue
+                target.save_session(session)
+                imported += 1
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+    return imported
+
+
+def main() -> None:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Import file-based sessions into SQLite.")
+    parser.add_argument("--sessions-dir", default=settings.sessions_dir, help="Directory of session files")
+    parser.add_argument("--db", default=settings.sqlite_path, help="SQLite database path")
+    args = parser.parse_args()
+
+    imported = migrate(args.sessions_dir, args.db)
+    print(f"Imported {imported} sessions from {args.sessions_dir} into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 """Data models for Anjoman."""
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field
 from typing import Optional, Literal
 from datetime import datetime
 from enum import Enum
@@ -14,6 +14,21 @@ class SessionStatus(str, Enum):
     ERROR = "error"
 
 
+class TurnMode(str, Enum):
+    """How Rays take turns within an iteration."""
+    SEQUENTIAL = "sequential"  # One at a time, each sees what was said before
+    PARALLEL = "parallel"  # All at once, each sees only previous iterations
+
+
+class JobStatus(str, Enum):
+    """Where a background iteration job is."""
+    QUEUED = "queued"  # Waiting for a free worker
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"  # Stopped by a server shutdown
+
+
 class AgentConfig(BaseModel):
     """Configuration for a single Ray agent."""
     id: str = Field(..., description="Agent ID (e.g., ray-1)")
@@ -23,6 +38,7 @@ class AgentConfig(BaseModel):
     cost_used: float = Field(0.0, description="Accumulated cost in USD")
     tokens_in: int = Field(0, description="Total input tokens")
     tokens_out: int = Field(0, description="Total output tokens")
+    tokens_cached: int = Field(0, description="Input tokens read from the provider's prompt cache")
 
 
 class AgentMessage(BaseModel):
@@ -33,7 +49,15 @@ class AgentMessage(BaseModel):
     timestamp: datetime
     tokens_in: int = 0
     tokens_out: int = 0
+    tokens_cached: int = 0  # Of tokens_in, read from the provider's prompt cache at a discount
     cost: float = 0.0
+    retries: int = 0  # Provider calls repeated after transient errors
+    hedged: bool = False  # Whether a duplicate request was fired
+    overhead_cost: float = 0.0  # Estimated spend on abandoned attempts, on top of cost
+    timed_out: bool = False  # The agent missed its time slot; content is a placeholder
+    cached: bool = False  # Served from the completion cache, at no cost
+    budget_rejected: bool = False  # Not sent: its worst-case cost didn't fit in the budget
+    truncated: bool = False  # Cut short by the output cap or by running out of budget mid-stream
 
 
 class SuggestedDirection(BaseModel):
@@ -50,6 +74,7 @@ class IterationSummary(BaseModel):
     suggested_directions: list[SuggestedDirection] = Field(default_factory=list)
     suggested_direction: Optional[str] = None  # Deprecated, kept for backwards compatibility
     total_cost: float
+    cost: float = 0.0  # Dana's own call, charged to the budget
     timestamp: datetime
 
 
@@ -59,6 +84,21 @@ class Iteration(BaseModel):
     messages: list[AgentMessage]
     summary: Optional[IterationSummary] = None
     user_guidance: Optional[str] = None
+    skipped_agents: list[str] = Field(default_factory=list)  # Not reached before the deadline
+
+
+class DigestEntry(BaseModel):
+    """Condensed context for a run of earlier iterations."""
+    first_iteration: int
+    last_iteration: int
+    level: int = 0  # 0 for one iteration; each level up folds several entries of the level below
+    text: str
+
+
+class ContextDigest(BaseModel):
+    """Rolling digest of the iterations too old to show Rays verbatim."""
+    entries: list[DigestEntry] = Field(default_factory=list)  # Oldest first
+    through_iteration: int = 0  # Last iteration rolled in
 
 
 class BudgetInfo(BaseModel):
@@ -67,6 +107,12 @@ class BudgetInfo(BaseModel):
     used: float
     remaining: float
     warning_threshold: float = 0.8  # Warn at 80%
+    retries: int = 0  # Provider calls repeated after transient errors
+    hedged_calls: int = 0  # Calls that fired a duplicate request
+    overhead_cost: float = 0.0  # Spend on abandoned attempts, included in used
+    cached_tokens: int = 0  # Input tokens read from provider prompt caches
+    reserved: float = 0.0  # Worst-case cost of calls in flight, not yet in used
+    rejected_calls: int = 0  # Calls refused because their worst case didn't fit
     
     @property
     def is_warning(self) -> bool:
@@ -89,6 +135,9 @@ class Session(BaseModel):
     iterations: list[Iteration] = []
     budget: BudgetInfo
     status: SessionStatus = SessionStatus.ACTIVE
+    turn_mode: TurnMode = TurnMode.SEQUENTIAL
+    context_digest: ContextDigest = Field(default_factory=ContextDigest)
+    current_iteration: Optional[Iteration] = None  # The iteration underway, with the turns so far
 
 
 class ApiKeys(BaseModel):
@@ -113,6 +162,10 @@ class ApiKeys(BaseModel):
         if self.cohere_api_key:
             providers.append("cohere")
         return providers
+    
+    def key_for_provider(self, provider: str) -> Optional[str]:
+        """Get the key for a provider, or None if it wasn't supplied."""
+        return getattr(self, f"{provider}_api_key", None)
 
 
 class CreateSessionRequest(BaseModel):
@@ -122,6 +175,8 @@ class CreateSessionRequest(BaseModel):
     num_agents: Optional[int] = None  # None means Dana decides
     model_preference: str = "balanced"  # "budget", "balanced", or "performance"
     suggested_agents: Optional[list[AgentConfig]] = None
+    turn_mode: TurnMode = TurnMode.SEQUENTIAL
+    use_cache: bool = True  # False bypasses the completion cache
     api_keys: Optional[ApiKeys] = None
 
 
@@ -138,6 +193,7 @@ class SessionProposal(BaseModel):
     proposed_agents: list[AgentConfig]
     rationale: str
     available_models: list[ModelInfo]
+    cached: bool = False  # Served from the completion cache
 
 
 class ContinueSessionRequest(BaseModel):
@@ -145,6 +201,10 @@ class ContinueSessionRequest(BaseModel):
     session_id: str
     user_guidance: Optional[str] = None
     accept_suggestion: bool = True
+    turn_mode: Optional[TurnMode] = None  # None uses the session's turn mode
+    agent_timeout: Optional[float] = Field(None, gt=0)  # Seconds per Ray; None uses the server default
+    iteration_deadline: Optional[float] = Field(None, gt=0)  # Seconds for the whole iteration
+    use_cache: bool = True  # False bypasses the completion cache
     api_keys: Optional[ApiKeys] = None
 
 
@@ -157,3 +217,101 @@ class SessionListItem(BaseModel):
     total_cost: float
     iteration_count: int
 
+
+
+class SessionQuery(BaseModel):
+    """Filters, sort order and page for listing sessions."""
+    status: Optional[SessionStatus] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    min_cost: Optional[float] = None
+    max_cost: Optional[float] = None
+    issue: Optional[str] = None  # Case-insensitive substring of the issue
+    sort: Literal["created_at", "total_cost", "iteration_count"] = "created_at"
+    order: Literal["asc", "desc"] = "desc"
+    limit: Optional[int] = None  # None returns every match
+    cursor: Optional[str] = None
+
+
+class SessionPage(BaseModel):
+    """One page of session list items."""
+    items: list[SessionListItem]
+    next_cursor: Optional[str] = None
+
+
+class SessionView(BaseModel):
+    """Which parts of a session to load.
+    
+    Iteration bounds are inclusive iteration numbers; negative values count
+    from the end, so ``iteration_from=-1`` selects only the latest iteration.
+    Without messages, the iteration underway (``current_iteration``) is
+    left without its turns too.
+    """
+    include_iterations: bool = True
+    include_messages: bool = True
+    iteration_from: Optional[int] = None
+    iteration_to: Optional[int] = None
+    
+    def iteration_range(self, iteration_count: int) -> tuple[int, int]:
+        """Resolve the bounds to absolute iteration numbers."""
+        def resolve(bound: Optional[int], default: int) -> int:
+            if bound is None:
+                return default
+            return iteration_count + 1 + bound if bound < 0 else bound
+        
+        if not self.include_iterations:
+            return 1, 0
+        return resolve(self.iteration_from, 1), resolve(self.iteration_to, iteration_count)
+    
+    def apply(self, session: Session) -> Session:
+        """Project a fully loaded session down to this view."""
+        first, last = self.iteration_range(len(session.iterations))
+        iterations = [
+            iteration if self.include_messages else iteration.model_copy(update={"messages": []})
+            for iteration in session.iterations
+            if first <= iteration.iteration_number <= last
+        ]
+        current = session.current_iteration
+        if current is not None and not self.include_messages:
+            current = current.model_copy(update={"messages": []})
+        return session.model_copy(update={"iterations": iterations, "current_iteration": current})
+
+
+class SearchHit(BaseModel):
+    """A full-text search match, pointing at where in a session it was found."""
+    session_id: str
+    issue: str  # Preview of the session's issue
+    kind: Literal["issue", "message", "summary", "disagreement"]
+    iteration_number: Optional[int] = None
+    position: Optional[int] = None  # Index of the message or disagreement within its iteration
+    agent_id: Optional[str] = None
+    snippet: str
+    score: float  # Higher is more relevant
+
+
+class ArchiveReport(BaseModel):
+    """Result of moving sessions into the compressed archive tier."""
+    archived: int = 0
+    skipped: int = 0  # In use by a request, left for the next pass
+    bytes_before: int = 0
+    bytes_after: int = 0
+    
+    @computed_field
+    @property
+    def bytes_saved(self) -> int:
+        """Disk space freed by compression."""
+        return self.bytes_before - self.bytes_after
+
+
+class IterationJob(BaseModel):
+    """An iteration running in the background, independent of the request that started it."""
+    job_id: str
+    session_id: str
+    status: JobStatus = JobStatus.QUEUED
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    turns_completed: int = 0  # Ray turns answered, timed out or failed so far
+    events: int = 0  # Events so far on the job's stream; the next one's ID
+    error: Optional[str] = None
+    iteration: Optional[Iteration] = None  # The result, once completed
@@ -8,6 +8,10 @@ from typing import Literal
 from pydantic import BaseModel
 
 
+# Assumed for models missing from the registry
+DEFAULT_CONTEXT_WINDOW = 8192
+
+
 class ModelConfig(BaseModel):
     """Configuration for a single LLM model."""
     model_id: str
@@ -17,6 +21,7 @@ class ModelConfig(BaseModel):
     description: str
     input_per_1m: float  # Input cost per 1M tokens
     output_per_1m: float  # Output cost per 1M tokens
+    context_window: int = DEFAULT_CONTEXT_WINDOW  # Max input tokens
     note: str = ""
 
 
@@ -31,6 +36,7 @@ MODELS = [
         description="Latest with customizable personalities",
         input_per_1m=20.00,
         output_per_1m=100.00,
+        context_window=400000,
         note="Latest with customizable personalities"
     ),
     ModelConfig(
@@ -41,6 +47,7 @@ MODELS = [
         description="Advanced reasoning capabilities",
         input_per_1m=15.00,
         output_per_1m=75.00,
+        context_window=400000,
         note="Advanced reasoning capabilities"
     ),
     ModelConfig(
@@ -51,6 +58,7 @@ MODELS = [
         description="Optimized multimodal model",
         input_per_1m=5.00,
         output_per_1m=15.00,
+        context_window=128000,
         note="Optimized multimodal model"
     ),
     ModelConfig(
@@ -61,6 +69,7 @@ MODELS = [
         description="Fast and capable",
         input_per_1m=10.00,
         output_per_1m=30.00,
+        context_window=128000,
         note="Fast and capable"
     ),
     ModelConfig(
@@ -71,6 +80,7 @@ MODELS = [
         description="Affordable intelligence",
         input_per_1m=0.15,
         output_per_1m=0.60,
+        context_window=128000,
         note="Affordable intelligence"
     ),
     ModelConfig(
@@ -81,6 +91,7 @@ MODELS = [
         description="Fast and economical",
         input_per_1m=0.50,
         output_per_1m=1.50,
+        context_window=16385,
         note="Fast and economical"
     ),
 
@@ -93,6 +104,7 @@ MODELS = [
         description="Best for complex workflows",
         input_per_1m=5.00,
         output_per_1m=25.00,
+        context_window=200000,
         note="Best for complex workflows (Nov 2025)"
     ),
     ModelConfig(
@@ -103,6 +115,7 @@ MODELS = [
         description="Superior coding, 1M context",
         input_per_1m=4.00,
         output_per_1m=20.00,
+        context_window=200000,
         note="Superior coding, 1M context (Sept 2025)"
     ),
     ModelConfig(
@@ -113,6 +126,7 @@ MODELS = [
         description="Most capable Claude 3",
         input_per_1m=15.00,
         output_per_1m=75.00,
+        context_window=200000,
         note="Most capable Claude 3"
     ),
     ModelConfig(
@@ -123,6 +137,7 @@ MODELS = [
         description="Fast and economical",
         input_per_1m=0.25,
         output_per_1m=1.25,
+        context_window=200000,
         note="Fast and economical"
     ),
 
@@ -135,6 +150,7 @@ MODELS = [
         description="Most capable Mistral",
         input_per_1m=4.00,
         output_per_1m=12.00,
+        context_window=128000,
         note="Most capable Mistral"
     ),
     ModelConfig(
@@ -145,6 +161,7 @@ MODELS = [
         description="Balanced performance",
         input_per_1m=2.70,
         output_per_1m=8.10,
+        context_window=128000,
         note="Balanced performance"
     ),
     ModelConfig(
@@ -155,6 +172,7 @@ MODELS = [
         description="Fast and economical",
         input_per_1m=1.00,
         output_per_1m=3.00,
+        context_window=32000,
         note="Fast and economical"
     ),
 
@@ -167,6 +185,7 @@ MODELS = [
         description="Latest Gemini, very fast",
         input_per_1m=0.00,
         output_per_1m=0.00,
+        context_window=1048576,
         note="Latest Gemini, very fast (experimental)"
     ),
     ModelConfig(
@@ -177,6 +196,7 @@ MODELS = [
         description="Advanced capabilities",
         input_per_1m=1.25,
         output_per_1m=5.00,
+        context_window=2097152,
         note="Advanced capabilities"
     ),
     ModelConfig(
@@ -187,6 +207,7 @@ MODELS = [
         description="Fast responses",
         input_per_1m=0.075,
         output_per_1m=0.30,
+        context_window=1048576,
         note="Fast responses"
     ),
 
@@ -199,6 +220,7 @@ MODELS = [
         description="Most capable Cohere",
         input_per_1m=3.00,
         output_per_1m=15.00,
+        context_window=128000,
         note="Most capable Cohere"
     ),
     ModelConfig(
@@ -209,6 +231,7 @@ MODELS = [
         description="Balanced performance",
         input_per_1m=0.50,
         output_per_1m=1.50,
+        context_window=128000,
         note="Balanced performance"
     ),
 ]
@@ -258,3 +281,9 @@ def get_model_by_id(model_id: str) -> ModelConfig | None:
         if model.model_id == model_id:
             return model
     return None
+
+
+def get_context_window(model_id: str) -> int:
+    """Get a model's context window in tokens, or a conservative default for unknown models."""
+    model = get_model_by_id(model_id)
+    return model.context_window if model else DEFAULT_CONTEXT_WINDOW
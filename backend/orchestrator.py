@@ -1,39 +1,348 @@
 """Orchestration logic for Anjoman - Dana and Rays."""
 
-from typing import Optional
+from typing import AsyncIterator, Awaitable, Callable, Optional
+import asyncio
 import litellm
-import os
+import random
+import re
 from datetime import datetime
 from models import (
     Session, AgentConfig, AgentMessage, Iteration,
-    IterationSummary, SuggestedDirection, SessionStatus, SessionProposal, ApiKeys, ModelInfo
+    IterationSummary, SuggestedDirection, SessionStatus, SessionProposal, ApiKeys, ModelInfo,
+    TurnMode
 )
 from prompts import (
     DANA_SYSTEM_PROMPT,
     build_agent_proposal_prompt,
     build_iteration_summary_prompt,
-    build_ray_agent_prompt
+    build_ray_agent_messages
 )
-from models_config import MODELS, get_model_tiers
+from models_config import MODELS, get_model_tiers, get_model_by_id
+import providers
+from scheduler import get_scheduler
+from config import get_settings
+from completion_cache import get_completion_cache
+from context_digest import context_budget, update_context_digest
+from resilience import CallReport, abandoned_cost, get_hedge_policy, get_retry_policy, is_timeout
+from budget_ledger import (
+    BudgetExceeded, BudgetLedger, GenerationCutOff, SpendMeter, affordable_output_tokens, estimate_cost
+)
+
+
+# Most a Ray may say in one turn, in tokens
+RAY_MAX_TOKENS = 500
+
+
+async def _stream_completion(params: dict, on_delta: Callable[[str], None]):
+    """Run a completion with ``stream=True``, passing text to ``on_delta`` as it arrives.
+    
+    Returns the full response rebuilt from the chunks, with usage taken from
+    the provider's final chunk where it sends one (and estimated otherwise),
+    so token counts and cost work as for a non-streamed call.
+    """
+    params = {**params, "stream": True}
+    model_config = get_model_by_id(params["model"])
+    if model_config and model_config.provider == "openai":
+        # OpenAI only reports usage on streams when asked to
+        params["stream_options"] = {"include_usage": True}
+    
+    chunks = []
+    async for chunk in await providers.acompletion(**params):
+        chunks.append(chunk)
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            on_delta(delta)
+    
+    return litellm.stream_chunk_builder(chunks, messages=params["messages"])
+
+
+async def _attempt(
+    params: dict,
+    on_delta: Optional[Callable[[str], None]],
+    on_wait: Optional[Callable[[dict], None]]
+):
+    """Make one completion call once the scheduler lets it through.
+    
+    Streams it if ``on_delta`` is given. Records the call's latency (to the
+    first token when streaming) for the hedging policy.
+    """
+    hedging = get_hedge_policy()
+    latency_key = f"{params['model']}:{'stream' if on_delta else 'full'}"
+    
+    async with get_scheduler().slot(params, on_wait) as ticket:
+        started = asyncio.get_running_loop().time()
+        if on_delta is None:
+            response = await providers.acompletion(**params)
+            hedging.latencies.record(latency_key, asyncio.get_running_loop().time() - started)
+        else:
+            first_token = []
+            
+            def forward(text: str) -> None:
+                if not first_token:
+                    first_token.append(asyncio.get_running_loop().time() - started)
+                on_delta(text)
+            
+            response = await _stream_completion(params, forward)
+            if first_token:
+                hedging.latencies.record(latency_key, first_token[0])
+        ticket.record_usage(response)
+    return response
+
+
+async def _hedged_attempt(
+    params: dict,
+    on_delta: Optional[Callable[[str], None]],
+    on_wait: Optional[Callable[[dict], None]],
+    report: CallReport
+):
+    """Make a call, firing a duplicate if it runs slower than the hedging delay.
+    
+    Whichever copy finishes first wins and the other is cancelled; when
+    streaming, the first copy to produce text wins and only its text is
+    passed on. The prompt cost of a cancelled copy goes on the report.
+    """
+    delay = get_hedge_policy().delay(f"{params['model']}:{'stream' if on_delta else 'full'}")
+    if delay is None:
+        return await _attempt(params, on_delta, on_wait)
+    
+    tasks: list[asyncio.Task] = []
+    abandoned: set[asyncio.Task] = set()
+    winner: list[int] = []
+    
+    def abandon_others(keep: int) -> None:
+        for idx, task in enumerate(tasks):
+            if idx != keep and not task.done() and task not in abandoned:
+                task.cancel()
+                abandoned.add(task)
+                if keep >= 0:
+                    report.overhead_cost += abandoned_cost(params)
+    
+    def claim(idx: int) -> Optional[Callable[[str], None]]:
+        if on_delta is None:
+            return None
+        
+        def forward(text: str) -> None:
+            if not winner:
+                winner.append(idx)
+                abandon_others(idx)
+            if winner[0] == idx:
+                on_delta(text)
+        return forward
+    
+    tasks.append(asyncio.create_task(_attempt(params, claim(0), on_wait)))
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            report.hedged = True
+            tasks.append(asyncio.create_task(_attempt(params, claim(1), on_wait)))
+        
+        errors = []
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled():
+                    continue
+                if task.exception() is None:
+                    abandon_others(tasks.index(task))
+                    return task.result()
+                errors.append(task.exception())
+        raise errors[0]
+    finally:
+        abandon_others(-1)  # The caller went away; nothing was won
+
+
+async def _retrying_attempt(
+    params: dict,
+    on_delta: Optional[Callable[[str], None]],
+    on_wait: Optional[Callable[[dict], None]],
+    report: CallReport
+):
+    """Make a call, retrying transient errors and hedging slow attempts.
+    
+    A stream that already produced text isn't retried, since the text has
+    been passed on.
+    """
+    policy = get_retry_policy()
+    streamed = []
+    
+    def forward(text: str) -> None:
+        streamed.append(True)
+        on_delta(text)
+    
+    while True:
+        try:
+            return await _hedged_attempt(params, forward if on_delta else None, on_wait, report)
+        except Exception as e:
+            if streamed or not policy.should_retry(e, report.retries):
+                raise
+            if is_timeout(e):
+                report.overhead_cost += abandoned_cost(params)
+            report.retries += 1
+            delay = policy.delay(report.retries, e)
+            print(f"Retrying {params['model']} in {delay:.1f}s after error: {e}")
+            await asyncio.sleep(delay)
+
+
+async def _complete(
+    params: dict,
+    on_delta: Optional[Callable[[str], None]] = None,
+    on_wait: Optional[Callable[[dict], None]] = None,
+    report: Optional[CallReport] = None,
+    use_cache: bool = True
+):
+    """Run a completion, from the completion cache if it's there.
+    
+    Otherwise the call is made (retrying transient errors and hedging slow
+    calls) and its response cached. Streams it if ``on_delta`` is given; a
+    cached response is passed to it in one piece. ``on_wait`` hears about
+    any time spent queued behind provider or model limits, and ``report``
+    collects retries, hedging, abandoned spend and whether it was cached.
+    """
+    report = report or CallReport()
+    cache = get_completion_cache() if use_cache else None
+    if cache:
+        response = await cache.aget(params)
+        if response is not None:
+            report.cached = True
+            if on_delta and response.choices[0].message.content:
+                on_delta(response.choices[0].message.content)
+            return response
+    
+    response = await _retrying_attempt(params, on_delta, on_wait, report)
+    if cache:
+        await cache.aput(params, response)
+    return response
+
+
+class _JsonFieldStream:
+    """Decodes one top-level string field of a JSON object as it streams in.
+    
+    Dana answers in JSON, so the raw deltas aren't readable; this picks out
+    the text of a single field (e.g. the summary) chunk by chunk.
+    """
+    
+    def __init__(self, field: str):
+        self._opening = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self._pos: Optional[int] = None  # Next undecoded character of the value
+        self._done = False
+    
+    def feed(self, text: str) -> str:
+        """Add streamed text and return the newly decoded part of the field."""
+        self._buffer += text
+        if self._done:
+            return ""
+        if self._pos is None:
+            match = self._opening.search(self._buffer)
+            if not match:
+                return ""
+            self._pos = match.end()
+        
+        decoded = []
+        buffer, i = self._buffer, self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self._done = True
+                break
+            if char != '\\':
+                decoded.append(char)
+                i += 1
+                continue
+            
+            # Wait for the rest of an escape sequence split across chunks
+            if i + 1 >= len(buffer) or (buffer[i + 1] == 'u' and i + 6 > len(buffer)):
+                break
+            escape = buffer[i + 1]
+            if escape == 'u':
+                try:
+                    decoded.append(chr(int(buffer[i + 2:i + 6], 16)))
+                except ValueError:
+                    pass
+                i += 6
+            else:
+                decoded.append({'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}.get(escape, escape))
+                i += 2
+        
+        self._pos = i
+        return "".join(decoded)
+
+
+class _Finished:
+    """Marks a result on the event queue of ``_relay``."""
+    
+    def __init__(self, result=None, error: Optional[BaseException] = None):
+        self.result = result
+        self.error = error
+
+
+async def _relay(queue: asyncio.Queue, calls: list[Awaitable]) -> AsyncIterator:
+    """Run calls concurrently, yielding events they put on ``queue`` as they happen.
+    
+    Each call's result is yielded as soon as it finishes, interleaved with
+    the events, so callers can tell them apart by type.
+    """
+    async def run(call):
+        try:
+            queue.put_nowait(_Finished(result=await call))
+        except Exception as e:
+            queue.put_nowait(_Finished(error=e))
+    
+    tasks = [asyncio.create_task(run(call)) for call in calls]
+    try:
+        pending = len(tasks)
+        while pending:
+            item = await queue.get()
+            if not isinstance(item, _Finished):
+                yield item
+                continue
+            pending -= 1
+            if item.error is not None:
+                raise item.error
+            yield item.result
+    finally:
+        # The consumer went away (e.g. client disconnected); stop the rest
+        for task in tasks:
+            task.cancel()
+
+
+class _TurnClock:
+    """Time limits on the Rays' turns in one iteration."""
+    
+    def __init__(self, agent_timeout: Optional[float] = None, cutoff: Optional[float] = None):
+        self.agent_timeout = agent_timeout
+        self.cutoff = cutoff  # Event loop time after which no Ray may still be speaking
+    
+    def expired(self) -> bool:
+        """Check whether the Rays are out of time."""
+        return self.cutoff is not None and asyncio.get_running_loop().time() >= self.cutoff
+    
+    def turn_timeout(self) -> Optional[float]:
+        """Seconds a Ray starting now may take, or None if unlimited."""
+        limits = [self.agent_timeout] if self.agent_timeout is not None else []
+        if self.cutoff is not None:
+            limits.append(max(0.0, self.cutoff - asyncio.get_running_loop().time()))
+        return min(limits) if limits else None
 
 
 class Dana:
     """The orchestrator - proposes agents, enforces turns, and summarizes."""
     
     @staticmethod
-    def _set_api_keys(api_keys: Optional[ApiKeys] = None):
-        """Set API keys from user or environment."""
-        if api_keys:
-            if api_keys.openai_api_key:
-                os.environ['OPENAI_API_KEY'] = api_keys.openai_api_key
-            if api_keys.anthropic_api_key:
-                os.environ['ANTHROPIC_API_KEY'] = api_keys.anthropic_api_key
-            if api_keys.mistral_api_key:
-                os.environ['MISTRAL_API_KEY'] = api_keys.mistral_api_key
-            if api_keys.google_api_key:
-                os.environ['GOOGLE_API_KEY'] = api_keys.google_api_key
-            if api_keys.cohere_api_key:
-                os.environ['COHERE_API_KEY'] = api_keys.cohere_api_key
+    def _api_key_for(model: str, api_keys: Optional[ApiKeys] = None) -> Optional[str]:
+        """Get the user's key for a model's provider.
+        
+        Keys are passed on each call rather than set in the environment, so
+        requests with different users' keys can run concurrently. Returns
+        None when the user has no key for the provider, in which case LiteLLM
+        falls back to the server's own keys from the environment.
+        """
+        if not api_keys:
+            return None
+        
+        provider = providers.provider_for_model(model)
+        return api_keys.key_for_provider(provider) if provider else None
     
     @staticmethod
     def _get_model_tiers(api_keys: Optional[ApiKeys] = None) -> dict[str, dict]:
@@ -75,12 +384,11 @@ class Dana:
         budget: float, 
         num_agents: Optional[int] = None,
         model_preference: str = "balanced",
-        api_keys: Optional[ApiKeys] = None
+        api_keys: Optional[ApiKeys] = None,
+        use_cache: bool = True
     ) -> SessionProposal:
         """Propose agent configuration based on the issue."""
         
-        Dana._set_api_keys(api_keys)
-        
         # Get available models and model tiers
         available_models = Dana._get_available_models(api_keys)
         model_tiers = Dana._get_model_tiers(api_keys)
@@ -99,14 +407,16 @@ class Dana:
         )
         
         try:
-            response = await litellm.acompletion(
-                model="gpt-5.1",  # Use latest GPT-5.1 for Dana
-                messages=[
+            report = CallReport()
+            response = await _complete({
+                "model": "gpt-5.1",  # Use latest GPT-5.1 for Dana
+                "messages": [
                     {"role": "system", "content": DANA_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
-                response_format={"type": "json_object"}
-            )
+                "response_format": {"type": "json_object"},
+                "api_key": Dana._api_key_for("gpt-5.1", api_keys)
+            }, report=report, use_cache=use_cache)
             
             import json
             result = json.loads(response.choices[0].message.content)
@@ -130,7 +440,8 @@ class Dana:
             return SessionProposal(
                 proposed_agents=agents,
                 rationale=result['rationale'],
-                available_models=available_models
+                available_models=available_models,
+                cached=report.cached
             )
             
         except Exception as e:
@@ -172,28 +483,306 @@ class Dana:
             available_models=available_models
         )
     
+    @staticmethod
+    async def run_iteration(
+        session: Session,
+        user_guidance: Optional[str] = None,
+        api_keys: Optional[ApiKeys] = None,
+        turn_mode: TurnMode = TurnMode.SEQUENTIAL,
+        stream_tokens: bool = False,
+        agent_timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+        use_cache: bool = True
+    ) -> AsyncIterator[dict]:
+        """Run one iteration, yielding progress events as they happen.
+        
+        In sequential mode the Rays speak one at a time in random order, each
+        seeing what was said before it. In parallel mode they all speak at
+        once from the previous iterations' context only, and responses are
+        yielded in the order they complete. With ``stream_tokens``, text is
+        also yielded as it's generated, in ``agent_delta`` and
+        ``summary_delta`` events. Calls held back by provider or model limits
+        report ``queued`` and ``dequeued`` events. Once Dana has summarized,
+        the iteration is appended to the session.
+        
+        A Ray that takes longer than ``agent_timeout`` seconds is recorded as
+        timed out (an ``agent_timeout`` event) and the round goes on. With a
+        ``deadline`` in seconds for the whole iteration, Rays must be done
+        ``summary_time_reserve`` seconds before it (Rays not reached by then
+        are skipped with ``agent_skipped``), and Dana summarizes whatever
+        arrived in the time left. ``use_cache=False`` bypasses the completion
+        cache.
+        
+        Every call reserves its worst-case cost from the budget before it's
+        made, and the summary's is held back from the start. A Ray whose
+        call doesn't fit is skipped (``agent_skipped`` with reason
+        ``budget``). If not even the summary fits, the iteration is refused:
+        it ends after a ``budget_exceeded`` event, with the session paused
+        and nothing added to it.
+        
+        While it runs, the iteration (with the turns so far) is the
+        session's ``current_iteration``, so saving the session mid-round
+        keeps the turns already paid for.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        clock = _TurnClock(agent_timeout)
+        summary_cutoff = None
+        if deadline is not None:
+            reserve = min(get_settings().summary_time_reserve, deadline / 2)
+            clock.cutoff = started + deadline - reserve
+            summary_cutoff = started + deadline
+        
+        iteration_number = len(session.iterations) + 1
+        yield {
+            'type': 'start',
+            'iteration': iteration_number,
+            'total_agents': len(session.agents),
+            'turn_mode': turn_mode.value,
+            'agent_timeout': agent_timeout,
+            'deadline': deadline
+        }
+        
+        # Randomize agent order for this iteration
+        agents_order = session.agents.copy()
+        random.shuffle(agents_order)
+        
+        iteration = Iteration(iteration_number=iteration_number, messages=[], user_guidance=user_guidance)
+        messages = iteration.messages
+        
+        # Keep back enough for Dana's summary, so the Rays can't spend it
+        ledger = BudgetLedger(session.budget)
+        try:
+            summary_hold = ledger.reserve(Dana.summary_estimate(session, iteration, api_keys), 'Dana')
+        except BudgetExceeded as e:
+            print(f"Not starting iteration {iteration_number}: {e}")
+            session.status = SessionStatus.PAUSED
+            yield {'type': 'budget_exceeded', 'message': str(e)}
+            return
+        
+        # The iteration underway is kept on the session, so each turn is saved with it as it lands
+        session.current_iteration = iteration
+        skipped = iteration.skipped_agents
+        if turn_mode == TurnMode.PARALLEL:
+            turns = Dana._parallel_turns(session, agents_order, iteration_number, messages, api_keys, stream_tokens, clock, use_cache, ledger)
+        else:
+            turns = Dana._sequential_turns(session, agents_order, iteration_number, messages, api_keys, stream_tokens, clock, use_cache, ledger)
+        async for event in turns:
+            if event['type'] == 'agent_skipped':
+                skipped.append(event['agent_id'])
+            yield event
+        
+        yield {'type': 'summarizing'}
+        queue = asyncio.Queue()
+        on_delta = (lambda text: queue.put_nowait({'type': 'summary_delta', 'delta': text})) if stream_tokens else None
+        on_wait = lambda event: queue.put_nowait({**event, 'agent_id': 'Dana'})
+        summary_timeout = max(0.0, summary_cutoff - loop.time()) if summary_cutoff is not None else None
+        ledger.release(summary_hold)  # The summary reserves its own, now its prompt is known
+        summarize = Dana.summarize_iteration(session, iteration, api_keys, on_delta, on_wait, summary_timeout, use_cache, ledger)
+        async for item in _relay(queue, [summarize]):
+            if isinstance(item, dict):
+                yield item
+            else:
+                iteration.summary = item
+        
+        session.iterations.append(iteration)
+        session.current_iteration = None
+        update_context_digest(session)
+        session.updated_at = datetime.now()
+    
+    @staticmethod
+    async def _sequential_turns(
+        session: Session,
+        agents: list[AgentConfig],
+        iteration_number: int,
+        messages: list[AgentMessage],
+        api_keys: Optional[ApiKeys],
+        stream_tokens: bool,
+        clock: _TurnClock,
+        use_cache: bool,
+        ledger: BudgetLedger
+    ) -> AsyncIterator[dict]:
+        """Have each Ray speak in turn, appending to ``messages``.
+        
+        Rays whose turn would start after the clock's cutoff are skipped.
+        """
+        for idx, agent in enumerate(agents):
+            # Check budget before each agent
+            if session.budget.is_exceeded:
+                yield {'type': 'budget_exceeded'}
+                break
+            
+            if clock.expired():
+                for skipped in agents[idx:]:
+                    yield {'type': 'agent_skipped', 'agent_id': skipped.id, 'agent_role': skipped.role, 'reason': 'deadline'}
+                break
+            
+            turn = Dana._speak(session, [agent], iteration_number, messages, api_keys, stream_tokens, clock, use_cache, ledger, first_index=idx)
+            async for event in turn:
+                yield event
+    
+    @staticmethod
+    async def _parallel_turns(
+        session: Session,
+        agents: list[AgentConfig],
+        iteration_number: int,
+        messages: list[AgentMessage],
+        api_keys: Optional[ApiKeys],
+        stream_tokens: bool,
+        clock: _TurnClock,
+        use_cache: bool,
+        ledger: BudgetLedger
+    ) -> AsyncIterator[dict]:
+        """Have every Ray speak concurrently, appending to ``messages`` as they finish.
+        
+        All calls start together, each reserving its worst-case cost from the
+        ledger first, so together they can't overshoot the budget; calls that
+        don't fit are refused before they're made.
+        """
+        if session.budget.is_exceeded:
+            yield {'type': 'budget_exceeded'}
+            return
+        
+        async for event in Dana._speak(session, agents, iteration_number, messages, api_keys, stream_tokens, clock, use_cache, ledger):
+            yield event
+    
+    @staticmethod
+    async def _speak(
+        session: Session,
+        agents: list[AgentConfig],
+        iteration_number: int,
+        messages: list[AgentMessage],
+        api_keys: Optional[ApiKeys],
+        stream_tokens: bool,
+        clock: _TurnClock,
+        use_cache: bool,
+        ledger: BudgetLedger,
+        first_index: int = 0
+    ) -> AsyncIterator[dict]:
+        """Have agents speak at once, each seeing ``messages`` as they were before.
+        
+        Yields an ``agent_start`` event per agent, then text deltas (if
+        streaming) and each response as it arrives, appending responses to
+        ``messages``. The calls are already running while the start events
+        are consumed. Agents whose call the ledger refused are reported as
+        ``agent_skipped`` instead.
+        """
+        queue = asyncio.Queue()
+        for idx, agent in enumerate(agents, first_index):
+            queue.put_nowait({'type': 'agent_start', 'agent_id': agent.id, 'agent_role': agent.role, 'index': idx})
+        
+        def delta_callback(agent: AgentConfig) -> Optional[Callable[[str], None]]:
+            if not stream_tokens:
+                return None
+            return lambda text: queue.put_nowait({'type': 'agent_delta', 'agent_id': agent.id, 'delta': text})
+        
+        def wait_callback(agent: AgentConfig) -> Callable[[dict], None]:
+            return lambda event: queue.put_nowait({**event, 'agent_id': agent.id})
+        
+        previous_messages = list(messages)
+        timeout = clock.turn_timeout()
+        calls = [
+            Ray.speak(
+                agent=agent,
+                session=session,
+                iteration_number=iteration_number,
+                previous_messages=previous_messages,
+                api_keys=api_keys,
+                on_delta=delta_callback(agent),
+                on_wait=wait_callback(agent),
+                timeout=timeout,
+                use_cache=use_cache,
+                ledger=ledger
+            )
+            for agent in agents
+        ]
+        async for item in _relay(queue, calls):
+            if isinstance(item, dict):
+                yield item
+            elif item.budget_rejected:
+                yield {
+                    'type': 'agent_skipped',
+                    'agent_id': item.agent_id,
+                    'agent_role': item.agent_role,
+                    'reason': 'budget',
+                    'budget': session.budget.model_dump(mode='json')
+                }
+            else:
+                messages.append(item)
+                yield Dana._record_message(session, item, charged=True)
+    
+    @staticmethod
+    def _record_message(session: Session, message: AgentMessage, charged: bool = False) -> dict:
+        """Charge a message to the session budget and build its event.
+        
+        Spend on retried and hedged attempts that were given up on counts
+        against the budget too, and is also tallied on its own. Pass
+        ``charged`` for messages whose cost a budget ledger already charged.
+        """
+        if not charged:
+            session.budget.used += message.cost + message.overhead_cost
+            session.budget.remaining = session.budget.total_budget - session.budget.used
+        session.budget.retries += message.retries
+        session.budget.hedged_calls += int(message.hedged)
+        session.budget.overhead_cost += message.overhead_cost
+        session.budget.cached_tokens += message.tokens_cached
+        
+        # Error responses and timeouts are reported separately (use mode='json' to serialize dates)
+        if message.timed_out:
+            event_type = 'agent_timeout'
+        elif message.content.startswith("[Error:"):
+            event_type = 'agent_error'
+        else:
+            event_type = 'agent_response'
+        return {
+            'type': event_type,
+            'message': message.model_dump(mode='json'),
+            'budget': session.budget.model_dump(mode='json')
+        }
+    
     @staticmethod
     async def summarize_iteration(
         session: Session,
         iteration: Iteration,
-        api_keys: Optional[ApiKeys] = None
+        api_keys: Optional[ApiKeys] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        on_wait: Optional[Callable[[dict], None]] = None,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        ledger: Optional[BudgetLedger] = None
     ) -> IterationSummary:
-        """Create a summary after an iteration."""
+        """Create a summary after an iteration.
         
-        Dana._set_api_keys(api_keys)
-        
-        # Build prompt
-        prompt = build_iteration_summary_prompt(session, iteration)
+        If ``on_delta`` is given the completion is streamed, and it receives
+        the summary text as it's generated. ``on_wait`` gets the scheduler's
+        queued events. If no summary arrives within ``timeout`` seconds, the
+        fallback summary is used. With a ``ledger``, the call's worst-case
+        cost is reserved first (falling back without a call if it doesn't
+        fit) and its actual cost charged to the budget.
+        """
         
+        params = Dana._summary_params(session, iteration, api_keys)
+        report = CallReport()
+        reservation = None
+        cost = 0.0
         try:
-            response = await litellm.acompletion(
-                model="gpt-5.1",  # Use latest GPT-5.1 for summaries
-                messages=[
-                    {"role": "system", "content": DANA_SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"}
-            )
+            if ledger:
+                reservation = ledger.reserve(estimate_cost(params), 'Dana')
+            
+            forward_summary = None
+            if on_delta is not None:
+                summary_text = _JsonFieldStream("summary")
+                
+                def forward_summary(text: str) -> None:
+                    decoded = summary_text.feed(text)
+                    if decoded:
+                        on_delta(decoded)
+            
+            response = await asyncio.wait_for(_complete(params, forward_summary, on_wait, report, use_cache), timeout)
+            try:
+                cost = 0.0 if report.cached else litellm.completion_cost(completion_response=response)
+            except Exception as e:
+                print(f"Could not calculate cost: {e}")
             
             import json
             result = json.loads(response.choices[0].message.content)
@@ -217,11 +806,15 @@ class Dana:
                 suggested_directions=suggested_directions,
                 suggested_direction=suggested_direction_text,  # Keep for backwards compatibility
                 total_cost=sum(msg.cost for msg in iteration.messages),
+                cost=cost + report.overhead_cost,
                 timestamp=datetime.now()
             )
             
         except Exception as e:
             print(f"Error summarizing iteration: {e}")
+            if isinstance(e, asyncio.TimeoutError):
+                # The abandoned call's prompt may still be billed
+                report.overhead_cost += abandoned_cost(params)
             return IterationSummary(
                 iteration_number=iteration.iteration_number,
                 summary="Error generating summary.",
@@ -233,8 +826,71 @@ class Dana:
                 ],
                 suggested_direction="Continue discussion.",
                 total_cost=sum(msg.cost for msg in iteration.messages),
+                cost=cost + report.overhead_cost,
+                timestamp=datetime.now()
+            )
+        
+        finally:
+            if ledger:
+                ledger.settle(reservation, cost + report.overhead_cost)
+    
+    @staticmethod
+    def keep_interrupted_iteration(session: Session, reason: str) -> Optional[Iteration]:
+        """Move an iteration that stopped partway from ``current_iteration`` into the history.
+        
+        Its turns are already paid for, so instead of being overwritten by
+        the next iteration they're kept, under a summary saying why the
+        iteration stopped. An iteration without turns is just dropped.
+        Returns the iteration kept, if any.
+        """
+        iteration = session.current_iteration
+        session.current_iteration = None
+        if iteration is None or not iteration.messages:
+            return None
+        
+        if iteration.summary is None:
+            iteration.summary = IterationSummary(
+                iteration_number=iteration.iteration_number,
+                summary=f"Iteration interrupted before it was summarized: {reason}",
+                total_cost=sum(msg.cost for msg in iteration.messages),
                 timestamp=datetime.now()
             )
+        session.iterations.append(iteration)
+        update_context_digest(session)
+        session.updated_at = datetime.now()
+        return iteration
+    
+    @staticmethod
+    def summary_estimate(session: Session, iteration: Iteration, api_keys: Optional[ApiKeys] = None) -> float:
+        """Worst-case cost of summarizing ``iteration`` once every Ray has had its say."""
+        return estimate_cost(
+            Dana._summary_params(session, iteration, api_keys),
+            extra_prompt_tokens=len(session.agents) * RAY_MAX_TOKENS
+        )
+    
+    @staticmethod
+    def can_afford_iteration(
+        session: Session,
+        user_guidance: Optional[str] = None,
+        api_keys: Optional[ApiKeys] = None
+    ) -> bool:
+        """Whether the budget left covers the next iteration's summary, without which it's refused."""
+        iteration = Iteration(iteration_number=len(session.iterations) + 1, messages=[], user_guidance=user_guidance)
+        left = session.budget.total_budget - session.budget.used
+        return Dana.summary_estimate(session, iteration, api_keys) <= left
+    
+    @staticmethod
+    def _summary_params(session: Session, iteration: Iteration, api_keys: Optional[ApiKeys]) -> dict:
+        """Build the completion params for Dana's summary of an iteration."""
+        return {
+            "model": "gpt-5.1",  # Use latest GPT-5.1 for summaries
+            "messages": [
+                {"role": "system", "content": DANA_SYSTEM_PROMPT},
+                {"role": "user", "content": build_iteration_summary_prompt(session, iteration)}
+            ],
+            "response_format": {"type": "json_object"},
+            "api_key": Dana._api_key_for("gpt-5.1", api_keys)
+        }
 
 
 class Ray:
@@ -246,54 +902,99 @@ class Ray:
         session: Session,
         iteration_number: int,
         previous_messages: list[AgentMessage],
-        api_keys: Optional[ApiKeys] = None
+        api_keys: Optional[ApiKeys] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        on_wait: Optional[Callable[[dict], None]] = None,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        ledger: Optional[BudgetLedger] = None
     ) -> AgentMessage:
-        """Have an agent contribute to the discussion."""
+        """Have an agent contribute to the discussion.
         
-        Dana._set_api_keys(api_keys)
+        If ``on_delta`` is given the completion is streamed and it receives
+        the text as it's generated; usage and cost are still taken from the
+        complete response. ``on_wait`` gets the scheduler's queued events.
+        If there's no response within ``timeout`` seconds (including any
+        queueing and retries), the message is marked as timed out. A
+        response from the completion cache costs nothing.
         
-        # Build prompt (now includes full context from session.iterations)
-        prompt = build_ray_agent_prompt(
+        With a ``ledger``, the call's worst-case cost is reserved before it's
+        made and its actual cost charged once known; if the reservation is
+        refused, no call is made and the message is marked budget_rejected.
+        The output cap shrinks to what the budget can still pay for, and a
+        streamed response is metered as it arrives and cut off if it would
+        overspend. Responses stopped early either way are marked truncated.
+        """
+        
+        # Build prompt (previous iterations fitted to the model's context budget),
+        # shared prefix first so the provider can reuse it across agents
+        messages = build_ray_agent_messages(
             agent=agent,
             session=session,
             iteration_number=iteration_number,
             previous_messages=previous_messages,
-            last_summary=None  # No longer needed, using session.iterations instead
+            cache_breakpoints=providers.uses_cache_breakpoints(agent.model),
+            max_context_tokens=context_budget(agent.model)
         )
         
+        report = CallReport()
+        reservation = None
         try:
             # Use max_completion_tokens for newer models (GPT-5+, Claude 4+)
             # Use max_tokens for older models
             params = {
                 "model": agent.model,
-                "messages": [{"role": "user", "content": prompt}],
+                "messages": messages,
                 "temperature": 0.7,
+                "api_key": Dana._api_key_for(agent.model, api_keys),
             }
             
             # Newer models use max_completion_tokens
             if any(x in agent.model.lower() for x in ['gpt-5', 'claude-opus-4-5', 'claude-4-5-sonnet']):
-                params["max_completion_tokens"] = 500
+                cap = "max_completion_tokens"
             else:
-                params["max_tokens"] = 500
+                cap = "max_tokens"
+            params[cap] = RAY_MAX_TOKENS
+            
+            if ledger:
+                # Near the end of the budget, ask for no more than it can still pay for
+                affordable = affordable_output_tokens(params, ledger.available)
+                if affordable is not None and affordable < RAY_MAX_TOKENS:
+                    params[cap] = max(affordable, get_settings().budget_min_output_tokens)
+                reservation = ledger.reserve(estimate_cost(params), agent.id)
+                
+                if on_delta is not None:
+                    # Stop the stream if it would spend more than is left (e.g. the cap isn't honoured)
+                    meter = SpendMeter(params, lambda: ledger.headroom(reservation))
+                    
+                    def metered(text: str, forward: Callable[[str], None] = on_delta) -> None:
+                        forward(text)
+                        if not report.cached:
+                            meter.feed(text)
+                    on_delta = metered
             
-            response = await litellm.acompletion(**params)
+            response = await asyncio.wait_for(_complete(params, on_delta, on_wait, report, use_cache), timeout)
             
-            # Extract usage information
+            # Extract usage information (a cached response wasn't sent or billed)
             usage = response.usage
-            tokens_in = usage.prompt_tokens
-            tokens_out = usage.completion_tokens
+            tokens_in = 0 if report.cached else usage.prompt_tokens
+            tokens_out = 0 if report.cached else usage.completion_tokens
+            tokens_cached = 0 if report.cached else providers.cached_prompt_tokens(usage)
             
-            # Calculate cost using LiteLLM's completion_cost
+            # Calculate cost using LiteLLM's completion_cost (prompt cache reads at their discounted rate)
             try:
-                cost = litellm.completion_cost(completion_response=response)
+                cost = 0.0 if report.cached else litellm.completion_cost(completion_response=response)
             except Exception as e:
                 print(f"Could not calculate cost: {e}")
                 cost = 0.0
             
-            # Update agent's accumulated stats
+            # Update agent's accumulated stats (including abandoned retries and hedges)
             agent.tokens_in += tokens_in
             agent.tokens_out += tokens_out
-            agent.cost_used += cost
+            agent.tokens_cached += tokens_cached
+            agent.cost_used += cost + report.overhead_cost
+            if ledger:
+                ledger.settle(reservation, cost + report.overhead_cost)
             
             content = response.choices[0].message.content
             
@@ -304,11 +1005,69 @@ class Ray:
                 timestamp=datetime.now(),
                 tokens_in=tokens_in,
                 tokens_out=tokens_out,
-                cost=cost
+                tokens_cached=tokens_cached,
+                cost=cost,
+                retries=report.retries,
+                hedged=report.hedged,
+                overhead_cost=report.overhead_cost,
+                cached=report.cached,
+                truncated=response.choices[0].finish_reason == "length"
+            )
+            
+        except GenerationCutOff as e:
+            print(f"Cut {agent.id} off: {e}")
+            # There's no usage for an unfinished stream; charge what the meter counted
+            agent.tokens_in += meter.prompt_tokens
+            agent.tokens_out += meter.output_tokens
+            agent.cost_used += meter.cost + report.overhead_cost
+            ledger.settle(reservation, meter.cost + report.overhead_cost)
+            return AgentMessage(
+                agent_id=agent.id,
+                agent_role=agent.role,
+                content=meter.text,
+                timestamp=datetime.now(),
+                tokens_in=meter.prompt_tokens,
+                tokens_out=meter.output_tokens,
+                cost=meter.cost,
+                retries=report.retries,
+                hedged=report.hedged,
+                overhead_cost=report.overhead_cost,
+                truncated=True
+            )
+            
+        except BudgetExceeded as e:
+            print(f"Not calling {agent.id}: {e}")
+            return AgentMessage(
+                agent_id=agent.id,
+                agent_role=agent.role,
+                content=f"[Skipped: Not enough budget left for {agent.model}]",
+                timestamp=datetime.now(),
+                budget_rejected=True
+            )
+            
+        except asyncio.TimeoutError:
+            print(f"{agent.id} timed out after {timeout}s")
+            # The abandoned call's prompt may still be billed
+            report.overhead_cost += abandoned_cost(params)
+            agent.cost_used += report.overhead_cost
+            if ledger:
+                ledger.settle(reservation, report.overhead_cost)
+            return AgentMessage(
+                agent_id=agent.id,
+                agent_role=agent.role,
+                content=f"[Timed out: No response from {agent.model} in time]",
+                timestamp=datetime.now(),
+                retries=report.retries,
+                hedged=report.hedged,
+                overhead_cost=report.overhead_cost,
+                timed_out=True
             )
             
         except Exception as e:
             print(f"Error getting response from {agent.id}: {e}")
+            agent.cost_used += report.overhead_cost
+            if ledger:
+                ledger.settle(reservation, report.overhead_cost)
             # Return an error message
             return AgentMessage(
                 agent_id=agent.id,
@@ -317,6 +1076,12 @@ class Ray:
                 timestamp=datetime.now(),
                 tokens_in=0,
                 tokens_out=0,
-                cost=0.0
+                cost=0.0,
+                retries=report.retries,
+                hedged=report.hedged,
+                overhead_cost=report.overhead_cost
             )
-
+        
+        finally:
+            if ledger:
+                ledger.release(reservation)  # Cancelled before the cost was known
@@ -0,0 +1,37 @@
+"""Cursor helpers for paginated session listing."""
+
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+from models import SessionQuery
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor can't be used with a query."""
+
+
+def encode_cursor(query: SessionQuery, sort_value, session_id: str) -> str:
+    """Encode the position after an item as an opaque cursor."""
+    raw = json.dumps([query.sort, query.order, sort_value, session_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(query: SessionQuery) -> Optional[tuple]:
+    """Decode a query's cursor into ``(sort_value, session_id)``."""
+    if not query.cursor:
+        return None
+    try:
+        sort, order, sort_value, session_id = json.loads(base64.urlsafe_b64decode(query.cursor))
+    except Exception:
+        raise InvalidCursorError("Malformed cursor")
+    if sort != query.sort or order != query.order:
+        raise InvalidCursorError("Cursor was issued for a different sort order")
+    return sort_value, session_id
+
+
+def naive_datetime(value: datetime) -> datetime:
+    """Convert a datetime to naive local time, as session timestamps are stored."""
+    if value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
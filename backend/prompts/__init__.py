@@ -3,12 +3,13 @@
 from .dana_system import DANA_SYSTEM_PROMPT
 from .agent_proposal import build_agent_proposal_prompt
 from .iteration_summary import build_iteration_summary_prompt
-from .ray_agent import build_ray_agent_prompt
+from .ray_agent import build_ray_agent_messages, build_ray_agent_prompt
 
 __all__ = [
     'DANA_SYSTEM_PROMPT',
     'build_agent_proposal_prompt',
     'build_iteration_summary_prompt',
+    'build_ray_agent_messages',
     'build_ray_agent_prompt',
 ]
 
@@ -1,73 +1,126 @@
-"""Prompt for Ray agents to speak."""
+"""Prompt for Ray agents to speak.
+
+The prompt is laid out for provider prefix caching: everything every Ray
+sees (the instructions, the issue and the previous iterations) comes first
+as the system message, then this iteration's conversation so far, and only
+then the speaking agent's identity. Agents and turns then share as long a
+prefix as possible.
+
+The previous iterations are fitted to a token budget: the latest in full,
+older ones from the session's context digest (see ``context_digest``).
+"""
 
 from typing import Optional
-from models import AgentConfig, Session, AgentMessage
+from context_digest import count_tokens, digest_iteration, entry_label
+from models import AgentConfig, Session, AgentMessage, DigestEntry, Iteration
 
 
-def build_ray_agent_prompt(
-    agent: AgentConfig,
-    session: Session,
-    iteration_number: int,
-    previous_messages: list[AgentMessage],
-    last_summary: Optional[str] = None
-) -> str:
-    """Build prompt for a Ray agent to speak.
-    
+def _render_iteration(prev_iter: Iteration) -> str:
+    """Render a previous iteration in full."""
+    context = f"\n--- Iteration {prev_iter.iteration_number} ---\n"
+
+    # Include user guidance if provided
+    if prev_iter.user_guidance:
+        context += f"User Guidance: {prev_iter.user_guidance}\n\n"
+
+    # Include summary
+    if prev_iter.summary:
+        context += f"Summary: {prev_iter.summary.summary}\n"
+
+        # Include key disagreements
+        if prev_iter.summary.key_disagreements:
+            context += f"Key Disagreements: {', '.join(prev_iter.summary.key_disagreements)}\n"
+
+        # Include suggested directions that were discussed
+        if prev_iter.summary.suggested_directions:
+            directions = [d.option for d in prev_iter.summary.suggested_directions]
+            context += f"Directions Suggested: {', '.join(directions)}\n"
+
+    return context + "\n"
+
+
+def _render_entry(entry: DigestEntry) -> str:
+    """Render a digest entry as one line."""
+    return f"{entry_label(entry)}: {entry.text}\n"
+
+
+def build_previous_context(session: Session, max_tokens: Optional[int] = None, model: Optional[str] = None) -> str:
+    """Build the context of previous iterations, within a token budget.
+
+    Iterations not yet rolled into the session's digest are shown in full,
+    newest first while they fit, then condensed; then digest entries,
+    newest first while they fit. Anything older is left out.
+
     Args:
-        agent: The agent configuration
         session: The current session
-        iteration_number: Current iteration number
-        previous_messages: Messages from this iteration so far
-        last_summary: Optional summary from previous iteration (deprecated, now using session.iterations)
-    
+        max_tokens: Token budget for the context, or None for no limit
+        model: Model whose tokenizer to count with
+
     Returns:
-        The prompt string
+        The context string, empty for the first iteration
     """
-    
-    style_note = f"\n\nYour style: {agent.style}" if agent.style else ""
-    
-    # Build conversation history for current iteration
-    history = ""
-    if previous_messages:
-        history = "\n\nConversation so far in this iteration:\n"
-        for msg in previous_messages:
-            history += f"\n{msg.agent_role} ({msg.agent_id}):\n{msg.content}\n"
-    
-    # Build context from ALL previous iterations
+
+    digest = session.context_digest
+    recent = [it for it in session.iterations if it.iteration_number > digest.through_iteration]
+    candidates = list(reversed(recent)) + list(reversed(digest.entries))
+
+    full, condensed = [], []
+    omitted_through = 0
+    used = 0
+    for candidate in candidates:
+        if isinstance(candidate, Iteration):
+            text = _render_iteration(candidate)
+            tokens = count_tokens(text, model) if max_tokens is not None else 0
+            if max_tokens is None or used + tokens <= max_tokens:
+                full.insert(0, text)
+                used += tokens
+                continue
+            candidate = digest_iteration(candidate)
+
+        text = _render_entry(candidate)
+        tokens = count_tokens(text, model) if max_tokens is not None else 0
+        if max_tokens is None or used + tokens <= max_tokens:
+            condensed.insert(0, text)
+            used += tokens
+            continue
+
+        omitted_through = candidate.last_iteration
+        break
+
     context = ""
-    if session.iterations and len(session.iterations) > 0:
-        context = "\n\n=== PREVIOUS ITERATIONS CONTEXT ===\n"
-        
-        for prev_iter in session.iterations:
-            context += f"\n--- Iteration {prev_iter.iteration_number} ---\n"
-            
-            # Include user guidance if provided
-            if prev_iter.user_guidance:
-                context += f"User Guidance: {prev_iter.user_guidance}\n\n"
-            
-            # Include summary
-            if prev_iter.summary:
-                context += f"Summary: {prev_iter.summary.summary}\n"
-                
-                # Include key disagreements
-                if prev_iter.summary.key_disagreements:
-                    context += f"Key Disagreements: {', '.join(prev_iter.summary.key_disagreements)}\n"
-                
-                # Include suggested directions that were discussed
-                if prev_iter.summary.suggested_directions:
-                    directions = [d.option for d in prev_iter.summary.suggested_directions]
-                    context += f"Directions Suggested: {', '.join(directions)}\n"
-            
-            context += "\n"
-        
+    if condensed or omitted_through:
+        context += "\n\n=== EARLIER ITERATIONS (CONDENSED) ===\n"
+        if omitted_through:
+            context += f"(Iterations 1-{omitted_through} left out for length)\n"
+        context += "".join(condensed)
+        context += "=== END CONDENSED ===\n"
+
+    if full:
+        context += "\n\n=== PREVIOUS ITERATIONS CONTEXT ===\n"
+        context += "".join(full)
         context += "=== END PREVIOUS CONTEXT ===\n"
-    
-    return f"""You are {agent.id}, a {agent.role} in the Anjoman deliberation system.{style_note}
+
+    return context
+
+
+def build_ray_shared_context(session: Session, max_context_tokens: Optional[int] = None, model: Optional[str] = None) -> str:
+    """Build the part of the prompt that is the same for every Ray in an iteration.
+
+    Args:
+        session: The current session
+        max_context_tokens: Token budget for the previous iterations, or None for no limit
+        model: Model whose tokenizer to count with
+
+    Returns:
+        The system prompt string
+    """
+
+    context = build_previous_context(session, max_context_tokens, model)
+
+    return f"""You are an agent in the Anjoman deliberation system. Several agents, each with its own role, take turns discussing an issue over a number of iterations.
 
 Issue under discussion:
 {session.issue}
-
-This is Iteration {iteration_number}.
 {context}
 
 Your task:
@@ -85,8 +138,105 @@ Guidelines:
 - Focused on moving the discussion forward
 - Acknowledge and reference previous points when relevant
 
-Length: 150-300 words (be concise but thorough).
-{history}
+Length: 150-300 words (be concise but thorough)."""
+
 
-Provide your analysis:"""
+def build_ray_iteration_history(iteration_number: int, previous_messages: list[AgentMessage]) -> str:
+    """Build the current iteration's conversation so far, shared by the Rays still to speak.
+
+    Args:
+        iteration_number: Current iteration number
+        previous_messages: Messages from this iteration so far
+
+    Returns:
+        The history string
+    """
+
+    history = f"This is Iteration {iteration_number}."
+    if previous_messages:
+        history += "\n\nConversation so far in this iteration:\n"
+        for msg in previous_messages:
+            history += f"\n{msg.agent_role} ({msg.agent_id}):\n{msg.content}\n"
+    return history
+
+
+def build_ray_turn_prompt(agent: AgentConfig) -> str:
+    """Build the part of the prompt that is specific to the speaking Ray.
+
+    Args:
+        agent: The agent configuration
+
+    Returns:
+        The turn prompt string
+    """
+
+    style_note = f"\n\nYour style: {agent.style}" if agent.style else ""
+    return f"You are {agent.id}, a {agent.role}.{style_note}\n\nProvide your analysis:"
+
+
+def build_ray_agent_messages(
+    agent: AgentConfig,
+    session: Session,
+    iteration_number: int,
+    previous_messages: list[AgentMessage],
+    cache_breakpoints: bool = False,
+    max_context_tokens: Optional[int] = None
+) -> list[dict]:
+    """Build the chat messages for a Ray agent to speak.
+
+    Args:
+        agent: The agent configuration
+        session: The current session
+        iteration_number: Current iteration number
+        previous_messages: Messages from this iteration so far
+        cache_breakpoints: Mark the shared prefixes with ``cache_control``,
+            for providers that only cache where asked to (Anthropic)
+        max_context_tokens: Token budget for the previous iterations, or None for no limit
+
+    Returns:
+        A system message followed by a user message
+    """
+
+    shared = build_ray_shared_context(session, max_context_tokens, agent.model)
+    history = build_ray_iteration_history(iteration_number, previous_messages)
+    turn = build_ray_turn_prompt(agent)
+
+    if not cache_breakpoints:
+        return [
+            {"role": "system", "content": shared},
+            {"role": "user", "content": f"{history}\n\n{turn}"}
+        ]
+
+    breakpoint = {"type": "ephemeral"}
+    history_block = {"type": "text", "text": history}
+    if previous_messages:
+        # Later speakers in a sequential iteration extend this history
+        history_block["cache_control"] = breakpoint
+    return [
+        {"role": "system", "content": [{"type": "text", "text": shared, "cache_control": breakpoint}]},
+        {"role": "user", "content": [history_block, {"type": "text", "text": f"\n\n{turn}"}]}
+    ]
+
+
+def build_ray_agent_prompt(
+    agent: AgentConfig,
+    session: Session,
+    iteration_number: int,
+    previous_messages: list[AgentMessage],
+    last_summary: Optional[str] = None
+) -> str:
+    """Build prompt for a Ray agent to speak, as a single string.
+
+    Args:
+        agent: The agent configuration
+        session: The current session
+        iteration_number: Current iteration number
+        previous_messages: Messages from this iteration so far
+        last_summary: Optional summary from previous iteration (deprecated, now using session.iterations)
+
+    Returns:
+        The prompt string
+    """
 
+    messages = build_ray_agent_messages(agent, session, iteration_number, previous_messages)
+    return "\n\n".join(message["content"] for message in messages)
@@ -0,0 +1,193 @@
+"""Shared, pooled HTTP clients for LLM provider APIs."""
+
+import asyncio
+import os
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import urlsplit
+import httpx
+import litellm
+from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+from openai import AsyncOpenAI
+from config import get_settings
+from models_config import get_model_by_id
+
+
+# Where each provider's API lives; config.provider_base_urls overrides these
+DEFAULT_BASE_URLS = {
+    "openai": "https://api.openai.com/v1",
+    "anthropic": "https://api.anthropic.com",
+    "mistral": "https://api.mistral.ai/v1",
+    "google": "https://generativelanguage.googleapis.com/v1beta",
+    "cohere": "https://api.cohere.ai",
+}
+
+# LiteLLM provider names that differ from ours
+_LITELLM_PROVIDERS = {"gemini": "google", "vertex_ai": "google", "cohere_chat": "cohere"}
+
+# Providers whose prompt caching needs explicit breakpoints
+_EXPLICIT_PROMPT_CACHING = {"anthropic"}
+
+
+def provider_for_model(model: str) -> Optional[str]:
+    """Get our provider name for a model, or None if it can't be told."""
+    model_config = get_model_by_id(model)
+    if model_config:
+        return model_config.provider
+    try:
+        _, provider, _, _ = litellm.get_llm_provider(model)
+    except Exception:
+        return None
+    return _LITELLM_PROVIDERS.get(provider, provider)
+
+
+def uses_cache_breakpoints(model: str) -> bool:
+    """Check whether a model's provider only caches prompt prefixes marked with ``cache_control``.
+
+    OpenAI, Gemini and the rest cache long shared prefixes on their own.
+    """
+    return provider_for_model(model) in _EXPLICIT_PROMPT_CACHING
+
+
+def cached_prompt_tokens(usage) -> int:
+    """Get how many prompt tokens a provider read from its prompt cache.
+
+    LiteLLM reports these as ``prompt_tokens_details.cached_tokens`` for
+    every provider, and prices them at the cache-read rate in ``completion_cost``.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+
+class ProviderClients:
+    """Long-lived pooled HTTP clients, one per provider and base URL.
+
+    LiteLLM otherwise picks its own clients per call, so agent turns keep
+    paying for new connections and TLS handshakes. Here every provider gets
+    one ``httpx.AsyncClient`` with a bounded, keep-alive connection pool that
+    all calls share. OpenAI calls go through an ``AsyncOpenAI`` client on top
+    of the pool, given each call's key with ``with_options``; the other
+    providers use LiteLLM's own HTTP handler around the pooled client.
+    """
+
+    def __init__(
+        self,
+        base_urls: Optional[dict[str, str]] = None,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 120.0,
+        timeout: float = 600.0
+    ):
+        self.base_urls = {**DEFAULT_BASE_URLS, **(base_urls or {})}
+        self._overridden = set(base_urls or {})
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = timeout
+        self._http_clients: dict[tuple[str, str], httpx.AsyncClient] = {}
+        self._llm_clients: dict[tuple[str, str], object] = {}
+
+    @classmethod
+    def from_settings(cls) -> "ProviderClients":
+        """Build the clients from the application settings."""
+        settings = get_settings()
+        return cls(
+            base_urls=settings.provider_base_urls,
+            max_connections=settings.provider_max_connections,
+            max_keepalive_connections=settings.provider_max_keepalive_connections,
+            keepalive_expiry=settings.provider_keepalive_expiry,
+            timeout=settings.provider_timeout
+        )
+
+    def http_client(self, provider: str) -> httpx.AsyncClient:
+        """Get the pooled HTTP client for a provider, creating it on first use."""
+        key = (provider, self.base_urls.get(provider, ""))
+        client = self._http_clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            self._http_clients[key] = client
+            self._llm_clients.pop(key, None)
+        return client
+
+    def _llm_client(self, provider: str):
+        """Get the client LiteLLM takes for a provider, wrapping the pooled one."""
+        key = (provider, self.base_urls.get(provider, ""))
+        http_client = self.http_client(provider)
+        client = self._llm_clients.get(key)
+        if client is None:
+            if provider == "openai":
+                # The real key is set per call; retries are the orchestrator's
+                client = AsyncOpenAI(api_key="unset", base_url=key[1], http_client=http_client, max_retries=0)
+            else:
+                client = AsyncHTTPHandler(timeout=self.timeout)
+                client.client = http_client
+            self._llm_clients[key] = client
+        return client
+
+    def completion_params(self, params: dict) -> dict:
+        """Add the shared client (and any base URL override) to completion params.
+
+        Models whose provider can't be told are left to LiteLLM's defaults.
+        """
+        provider = provider_for_model(params["model"])
+        if provider not in self.base_urls:
+            return params
+
+        params = dict(params)
+        client = self._llm_client(provider)
+        if isinstance(client, AsyncOpenAI):
+            # LiteLLM ignores api_key when given an OpenAI client, so the
+            # user's key (or the server's, as LiteLLM would use) goes on it
+            api_key = params.get("api_key") or os.environ.get("OPENAI_API_KEY")
+            if not api_key:
+                return params
+            client = client.with_options(api_key=api_key)
+        elif provider in self._overridden:
+            params.setdefault("api_base", self.base_urls[provider])
+        params["client"] = client
+        return params
+
+    async def acompletion(self, **params):
+        """Call ``litellm.acompletion`` over the shared client for the model's provider."""
+        return await litellm.acompletion(**self.completion_params(params))
+
+    async def warm_up(self, providers: Optional[list[str]] = None, timeout: float = 5.0) -> list[str]:
+        """Open a connection to each provider ahead of the first real call.
+
+        Sends a HEAD request to each API host so the TCP and TLS setup is
+        done and the connection is waiting in the pool. Failures are only
+        logged; returns the providers that were reached.
+        """
+        providers = providers or list(self.base_urls)
+
+        async def warm(provider: str) -> bool:
+            parts = urlsplit(self.base_urls[provider])
+            try:
+                await self.http_client(provider).head(f"{parts.scheme}://{parts.netloc}/", timeout=timeout)
+                return True
+            except Exception as e:
+                print(f"Could not warm up connection to {provider}: {e}")
+                return False
+
+        reached = await asyncio.gather(*(warm(provider) for provider in providers))
+        return [provider for provider, ok in zip(providers, reached) if ok]
+
+    async def aclose(self) -> None:
+        """Close every pooled connection."""
+        for client in self._http_clients.values():
+            await client.aclose()
+        self._http_clients.clear()
+        self._llm_clients.clear()
+
+
+@lru_cache()
+def get_provider_clients() -> ProviderClients:
+    """Get the application's shared provider clients."""
+    return ProviderClients.from_settings()
+
+
+async def acompletion(**params):
+    """Call ``litellm.acompletion`` over the application's shared provider clients."""
+    return await get_provider_clients().acompletion(**params)
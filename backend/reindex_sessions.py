@@ -0,0 +1,24 @@
+"""Rebuild the full-text search index from the stored sessions.
+
+Usage:
+    python reindex_sessions.py
+
+The index is kept up to date on every save; rebuild it after session files
+were added, edited or restored by hand.
+"""
+
+from session_manager import SessionManager
+
+
+def main() -> None:
+    manager = SessionManager()
+    try:
+        indexed = manager.rebuild_search_index()
+    finally:
+        manager.close()
+
+    print(f"Indexed {indexed} sessions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Retry and hedging policies for LLM calls."""
+
+import asyncio
+import random
+from collections import deque
+from functools import lru_cache
+from typing import Optional
+import httpx
+import litellm
+from budget_ledger import count_prompt_tokens, model_prices
+from config import get_settings
+
+
+def is_transient(error: BaseException) -> bool:
+    """Check whether an error is worth retrying: rate limits, server errors and timeouts."""
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError, litellm.APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and (status in (408, 429) or status >= 500)
+
+
+def is_timeout(error: BaseException) -> bool:
+    """Check whether an error was a timeout, after which the provider may still bill the prompt."""
+    return isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)) or getattr(error, "status_code", None) == 408
+
+
+def abandoned_cost(params: dict) -> float:
+    """Estimate the spend of a call given up on: the cost of its prompt.
+
+    Priced the same way as the budget ledger's reservations. Returns 0.0
+    for models with no known price.
+    """
+    # Check the price first; counting tokens is the slow part
+    prices = model_prices(params["model"])
+    if prices is None:
+        return 0.0
+    return prices[0] * count_prompt_tokens(params)
+
+
+class RetryPolicy:
+    """How often and how long to wait before retrying a transient error.
+
+    Waits grow exponentially from ``base_delay`` up to ``max_delay``, with
+    full jitter so calls that failed together don't retry together. A
+    ``Retry-After`` header from the provider is respected as a minimum.
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 20.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_settings(cls) -> "RetryPolicy":
+        """Build the policy from the application settings."""
+        settings = get_settings()
+        return cls(
+            max_retries=settings.llm_max_retries,
+            base_delay=settings.llm_retry_base_delay,
+            max_delay=settings.llm_retry_max_delay
+        )
+
+    def should_retry(self, error: BaseException, retries: int) -> bool:
+        """Check whether to retry after ``retries`` earlier retries."""
+        return retries < self.max_retries and is_transient(error)
+
+    def delay(self, retry: int, error: Optional[BaseException] = None) -> float:
+        """Seconds to wait before retry number ``retry`` (counting from 1)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+
+        response = getattr(error, "response", None)
+        retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+        try:
+            delay = max(delay, min(float(retry_after), self.max_delay))
+        except (TypeError, ValueError):
+            pass
+        return delay
+
+
+class LatencyTracker:
+    """Recent call latencies per key, for estimating percentiles."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: dict[str, deque] = {}
+
+    def record(self, key: str, seconds: float) -> None:
+        """Add a latency sample."""
+        if key not in self._samples:
+            self._samples[key] = deque(maxlen=self.window)
+        self._samples[key].append(seconds)
+
+    def quantile(self, key: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """Get the ``q`` quantile of recent latencies, or None with too few samples."""
+        samples = self._samples.get(key)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class HedgePolicy:
+    """When to fire a duplicate request for a call that is running slow.
+
+    The delay is the ``quantile`` (p95 by default) of the model's recent
+    latencies, so only the slowest few percent of calls get hedged. Until
+    a model has ``min_samples`` latencies there is no hedging.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        quantile: float = 0.95,
+        min_samples: int = 20,
+        min_delay: float = 0.5
+    ):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies = LatencyTracker()
+
+    @classmethod
+    def from_settings(cls) -> "HedgePolicy":
+        """Build the policy from the application settings."""
+        settings = get_settings()
+        return cls(
+            enabled=settings.llm_hedging,
+            quantile=settings.llm_hedge_quantile,
+            min_samples=settings.llm_hedge_min_samples,
+            min_delay=settings.llm_hedge_min_delay
+        )
+
+    def delay(self, key: str) -> Optional[float]:
+        """Seconds to wait before hedging a call, or None not to hedge it."""
+        if not self.enabled:
+            return None
+        latency = self.latencies.quantile(key, self.quantile, self.min_samples)
+        return None if latency is None else max(latency, self.min_delay)
+
+
+class CallReport:
+    """What it took to get one response, beyond the response itself."""
+
+    def __init__(self):
+        self.retries = 0
+        self.hedged = False
+        self.overhead_cost = 0.0  # Estimated spend on attempts that were given up on
+        self.cached = False  # Served from the completion cache
+
+
+@lru_cache()
+def get_retry_policy() -> RetryPolicy:
+    """Get the application's retry policy."""
+    return RetryPolicy.from_settings()
+
+
+@lru_cache()
+def get_hedge_policy() -> HedgePolicy:
+    """Get the application's hedging policy."""
+    return HedgePolicy.from_settings()
@@ -0,0 +1,252 @@
+"""Admission control for LLM calls: concurrency caps and rate limits per provider and model."""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Optional
+import litellm
+from config import CallLimits, get_settings
+from providers import provider_for_model
+
+
+class TokenBucket:
+    """Refills ``per_minute`` units a minute, holding at most ``capacity``.
+
+    Takers wait in arrival order until the bucket can cover them. A take
+    larger than the capacity waits for a full bucket and leaves it in debt,
+    so later takers wait for the refill.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def available(self) -> float:
+        """Units that could be taken right now."""
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+        return self.level
+
+    async def take(self, amount: float) -> None:
+        """Wait until ``amount`` units are available, then take them."""
+        needed = min(amount, self.capacity)
+        async with self._lock:
+            while self.available() < needed:
+                await asyncio.sleep((needed - self.level) / self.rate)
+            self.level -= amount
+
+    def refund(self, amount: float) -> None:
+        """Return units taken but not used (a negative amount takes more)."""
+        self.level = min(self.capacity, self.available() + amount)
+
+
+class _Limiter:
+    """The concurrency cap and rate buckets of one provider or model, with queue counters."""
+
+    def __init__(self, limits: CallLimits):
+        self.semaphore = asyncio.Semaphore(limits.concurrency) if limits.concurrency else None
+        self.concurrency = limits.concurrency
+        self.requests = TokenBucket(limits.rpm) if limits.rpm else None
+        self.tokens = TokenBucket(limits.tpm) if limits.tpm else None
+        self.in_flight = 0
+        self.queued = 0
+        self.calls = 0
+        self.waited_calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def must_wait(self, tokens: int) -> bool:
+        """Check whether a call needing ``tokens`` would have to queue."""
+        if self.semaphore and self.semaphore.locked():
+            return True
+        if self.requests and self.requests.available() < 1:
+            return True
+        if self.tokens and self.tokens.available() < min(tokens, self.tokens.capacity):
+            return True
+        return self.queued > 0
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait for a concurrency slot and rate allowance."""
+        started = time.monotonic()
+        self.queued += 1
+        try:
+            if self.semaphore:
+                await self.semaphore.acquire()
+            try:
+                if self.requests:
+                    await self.requests.take(1)
+                if self.tokens:
+                    await self.tokens.take(tokens)
+            except BaseException:
+                if self.semaphore:
+                    self.semaphore.release()
+                raise
+        finally:
+            self.queued -= 1
+
+        waited = time.monotonic() - started
+        self.in_flight += 1
+        self.calls += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        if waited > 0.001:
+            self.waited_calls += 1
+
+    def release(self) -> None:
+        """Give back the concurrency slot."""
+        self.in_flight -= 1
+        if self.semaphore:
+            self.semaphore.release()
+
+    def stats(self) -> dict:
+        """Get queue depth and wait time counters."""
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "concurrency": self.concurrency,
+            "calls": self.calls,
+            "waited_calls": self.waited_calls,
+            "avg_wait": self.total_wait / self.calls if self.calls else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+def estimate_tokens(params: dict) -> int:
+    """Estimate the tokens a completion will use: its prompt plus the most it may generate."""
+    try:
+        prompt_tokens = litellm.token_counter(model=params["model"], messages=params["messages"])
+    except Exception:
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in params["messages"]) // 4
+    return prompt_tokens + (params.get("max_completion_tokens") or params.get("max_tokens") or 0)
+
+
+class CallTicket:
+    """An admitted call, for reconciling its token estimate with real usage."""
+
+    def __init__(self, provider: str, model: str, limiters: list[_Limiter], estimated_tokens: int):
+        self.provider = provider
+        self.model = model
+        self.waited = 0.0
+        self.estimated_tokens = estimated_tokens
+        self._limiters = limiters
+
+    def record_usage(self, response) -> None:
+        """Correct the tokens-per-minute buckets with the response's actual usage."""
+        usage = getattr(response, "usage", None)
+        total = getattr(usage, "total_tokens", None)
+        if not isinstance(total, int):
+            return
+        for limiter in self._limiters:
+            if limiter.tokens:
+                limiter.tokens.refund(self.estimated_tokens - total)
+        self.estimated_tokens = total
+
+
+class CallScheduler:
+    """Queues LLM calls so they stay within per-provider and per-model limits.
+
+    Every call takes a slot from its provider's limiter (which always has a
+    concurrency cap, ``default_provider_concurrency`` unless configured) and
+    from its model's limiter if that model has limits. Calls over a limit
+    wait in arrival order instead of being sent to fail with a 429.
+    Limiters are always taken model first, then provider, so calls can't
+    deadlock holding each other's slots.
+    """
+
+    def __init__(
+        self,
+        provider_limits: Optional[dict[str, CallLimits]] = None,
+        model_limits: Optional[dict[str, CallLimits]] = None,
+        default_provider_concurrency: Optional[int] = 32
+    ):
+        self.provider_limits = provider_limits or {}
+        self.model_limits = model_limits or {}
+        self.default_provider_concurrency = default_provider_concurrency
+        self._providers: dict[str, _Limiter] = {}
+        self._models: dict[str, _Limiter] = {}
+
+    @classmethod
+    def from_settings(cls) -> "CallScheduler":
+        """Build the scheduler from the application settings."""
+        settings = get_settings()
+        return cls(
+            provider_limits=settings.provider_limits,
+            model_limits=settings.model_limits,
+            default_provider_concurrency=settings.default_provider_concurrency
+        )
+
+    def _limiters(self, provider: str, model: str) -> list[_Limiter]:
+        """Get the limiters a call to ``model`` must pass, in acquisition order."""
+        limiters = []
+        if model in self.model_limits:
+            if model not in self._models:
+                self._models[model] = _Limiter(self.model_limits[model])
+            limiters.append(self._models[model])
+
+        if provider not in self._providers:
+            limits = self.provider_limits.get(provider, CallLimits())
+            if limits.concurrency is None:
+                limits = limits.model_copy(update={"concurrency": self.default_provider_concurrency})
+            self._providers[provider] = _Limiter(limits)
+        limiters.append(self._providers[provider])
+        return limiters
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        params: dict,
+        on_wait: Optional[Callable[[dict], None]] = None
+    ) -> AsyncIterator[CallTicket]:
+        """Hold a place for one completion call while the block runs.
+
+        If the call has to queue, ``on_wait`` gets a ``queued`` event with
+        the queue depth, then a ``dequeued`` event with the seconds waited
+        once the call is let through.
+        """
+        model = params["model"]
+        provider = provider_for_model(model) or "unknown"
+        limiters = self._limiters(provider, model)
+        tokens = estimate_tokens(params) if any(limiter.tokens for limiter in limiters) else 0
+        ticket = CallTicket(provider, model, limiters, tokens)
+
+        queued = any(limiter.must_wait(tokens) for limiter in limiters)
+        if queued and on_wait:
+            on_wait({
+                'type': 'queued',
+                'provider': provider,
+                'model': model,
+                'queue_depth': max(limiter.queued for limiter in limiters) + 1
+            })
+
+        started = time.monotonic()
+        acquired = []
+        try:
+            for limiter in limiters:
+                await limiter.acquire(tokens)
+                acquired.append(limiter)
+            ticket.waited = time.monotonic() - started
+            if queued and on_wait:
+                on_wait({'type': 'dequeued', 'provider': provider, 'model': model, 'waited': round(ticket.waited, 3)})
+
+            yield ticket
+        finally:
+            for limiter in acquired:
+                limiter.release()
+
+    def stats(self) -> dict:
+        """Get queue depth and wait times per provider and per limited model."""
+        return {
+            "providers": {name: limiter.stats() for name, limiter in self._providers.items()},
+            "models": {name: limiter.stats() for name, limiter in self._models.items()},
+        }
+
+
+@lru_cache()
+def get_scheduler() -> CallScheduler:
+    """Get the application's shared call scheduler."""
+    return CallScheduler.from_settings()
@@ -0,0 +1,234 @@
+"""Local full-text search over session contents."""
+
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterator, Optional
+from models import Session, SearchHit
+from session_catalog import ISSUE_PREVIEW_CHARS
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_sessions (
+    session_id TEXT PRIMARY KEY,
+    issue TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS search_documents (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    iteration_number INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    agent_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_search_documents_session ON search_documents(session_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(content, tokenize = 'porter unicode61');
+"""
+
+# Markers around matched terms in snippets (markdown bold, like agent messages)
+SNIPPET_OPEN = "**"
+SNIPPET_CLOSE = "**"
+SNIPPET_TOKENS = 16
+
+# Ranking cost grows with the number of matching documents, so queries made
+# only of very common words are ranked over their most recent matches
+MAX_RANKED_MATCHES = 10000
+
+# Quoted phrases or bare words in a user query
+_QUERY_TERM = re.compile(r'"([^"]*)"|(\w+)')
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """Turn free text into an FTS5 MATCH expression.
+
+    Every word or "quoted phrase" must match; the last bare word also
+    matches as a prefix so partially typed queries find results. FTS5
+    operators in the input are treated as plain words. Returns None if the
+    query has no searchable terms.
+    """
+    terms = []
+    for match in _QUERY_TERM.finditer(query):
+        phrase, word = match.groups()
+        words = re.findall(r"\w+", phrase) if phrase is not None else [word]
+        if words:
+            terms.append((" ".join(words), phrase is None))
+
+    if not terms:
+        return None
+
+    parts = [f'"{text}"' for text, _ in terms]
+    if terms[-1][1]:
+        parts[-1] += "*"
+    return " ".join(parts)
+
+
+def session_documents(session: Session) -> Iterator[tuple[str, int, int, Optional[str], str]]:
+    """Yield the searchable texts of a session.
+
+    Each document is ``(kind, iteration_number, position, agent_id, text)``;
+    the iteration number and position are 0 where they don't apply.
+    """
+    yield "issue", 0, 0, None, session.issue
+    for iteration in session.iterations:
+        for idx, message in enumerate(iteration.messages):
+            yield "message", iteration.iteration_number, idx, message.agent_id, message.content
+        if iteration.summary:
+            yield "summary", iteration.iteration_number, 0, None, iteration.summary.summary
+            for idx, disagreement in enumerate(iteration.summary.key_disagreements or []):
+                yield "disagreement", iteration.iteration_number, idx, None, disagreement
+
+
+class SearchIndex:
+    """Inverted index over session issues, messages, summaries and disagreements.
+
+    Backed by an SQLite FTS5 table, so matching and BM25 ranking happen in
+    the index without reading any session. A side table maps each indexed
+    document back to its session, iteration and position. Sessions only
+    grow, so ``index_session`` compares document keys and inserts just the
+    new ones; the issue is re-indexed only if its text changed.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+        conn = self._connect()
+        self.created = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'search_fts'"
+        ).fetchone() is None
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def index_session(self, session: Session) -> None:
+        """Add a session's new documents to the index."""
+        conn = self._connect()
+        known = {
+            (kind, iteration_number, position): doc_id
+            for doc_id, kind, iteration_number, position in conn.execute(
+                "SELECT id, kind, iteration_number, position FROM search_documents WHERE session_id = ?",
+                (session.session_id,)
+            )
+        }
+        row = conn.execute(
+            "SELECT issue FROM search_sessions WHERE session_id = ?", (session.session_id,)
+        ).fetchone()
+        issue_changed = row is None or row[0] != session.issue
+
+        with conn:
+            if issue_changed:
+                conn.execute(
+                    "INSERT OR REPLACE INTO search_sessions (session_id, issue) VALUES (?, ?)",
+                    (session.session_id, session.issue)
+                )
+
+            current = set()
+            for kind, iteration_number, position, agent_id, text in session_documents(session):
+                key = (kind, iteration_number, position)
+                current.add(key)
+                if key in known:
+                    if not (kind == "issue" and issue_changed):
+                        continue
+                    self._delete_documents(conn, [known[key]])
+
+                doc_id = conn.execute(
+                    """
+                    INSERT INTO search_documents (session_id, kind, iteration_number, position, agent_id)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (session.session_id, kind, iteration_number, position, agent_id)
+                ).lastrowid
+                conn.execute("INSERT INTO search_fts (rowid, content) VALUES (?, ?)", (doc_id, text))
+
+            stale = [doc_id for key, doc_id in known.items() if key not in current]
+            self._delete_documents(conn, stale)
+
+    @staticmethod
+    def _delete_documents(conn: sqlite3.Connection, doc_ids: list[int]) -> None:
+        """Remove documents from the index."""
+        conn.executemany("DELETE FROM search_fts WHERE rowid = ?", [(doc_id,) for doc_id in doc_ids])
+        conn.executemany("DELETE FROM search_documents WHERE id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    def remove_session(self, session_id: str) -> None:
+        """Drop every document of a session from the index."""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "DELETE FROM search_fts WHERE rowid IN (SELECT id FROM search_documents WHERE session_id = ?)",
+                (session_id,)
+            )
+            conn.execute("DELETE FROM search_documents WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM search_sessions WHERE session_id = ?", (session_id,))
+
+    def clear(self) -> None:
+        """Empty the index."""
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM search_fts")
+            conn.execute("DELETE FROM search_documents")
+            conn.execute("DELETE FROM search_sessions")
+
+    def search(self, query: str, limit: int = 20) -> list[SearchHit]:
+        """Find the best matching documents for a free-text query, best first."""
+        match = build_match_query(query)
+        if match is None:
+            return []
+
+        conn = self._connect()
+        cutoff = conn.execute(
+            "SELECT rowid FROM search_fts WHERE search_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+            (match, MAX_RANKED_MATCHES - 1)
+        ).fetchone()
+
+        rows = conn.execute(
+            f"""
+            SELECT d.session_id, substr(s.issue, 1, ?), d.kind, d.iteration_number, d.position, d.agent_id,
+                   snippet(search_fts, 0, ?, ?, '…', {SNIPPET_TOKENS}), rank
+            FROM search_fts
+            JOIN search_documents d ON d.id = search_fts.rowid
+            JOIN search_sessions s ON s.session_id = d.session_id
+            WHERE search_fts MATCH ? AND search_fts.rowid >= ?
+            ORDER BY rank
+            LIMIT ?
+            """,
+            (ISSUE_PREVIEW_CHARS, SNIPPET_OPEN, SNIPPET_CLOSE, match, cutoff[0] if cutoff else 0, limit)
+        ).fetchall()
+
+        return [
+            SearchHit(
+                session_id=session_id,
+                issue=issue,
+                kind=kind,
+                iteration_number=iteration_number or None,
+                position=position if kind in ("message", "disagreement") else None,
+                agent_id=agent_id,
+                snippet=snippet,
+                # bm25 ranks are negative, lower is better
+                score=-rank
+            )
+            for session_id, issue, kind, iteration_number, position, agent_id, snippet, rank in rows
+        ]
+
+    def close(self) -> None:
+        """Close every connection opened by this index."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
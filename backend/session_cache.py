@@ -0,0 +1,145 @@
+"""In-memory LRU cache of hydrated sessions."""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from models import Session
+
+# Rough per-object overhead used when estimating a session's memory footprint
+_MESSAGE_OVERHEAD = 512
+_SESSION_OVERHEAD = 2048
+
+
+def estimate_session_size(session: Session) -> int:
+    """Estimate how many bytes a hydrated session occupies.
+
+    Only walks the text fields that dominate a session's size, so it's
+    far cheaper than serializing it.
+    """
+    size = _SESSION_OVERHEAD + len(session.issue)
+    for iteration in session.iterations:
+        size += len(iteration.user_guidance or "")
+        if iteration.summary:
+            size += _MESSAGE_OVERHEAD + len(iteration.summary.summary)
+        for message in iteration.messages:
+            size += _MESSAGE_OVERHEAD + len(message.content)
+    return size
+
+
+@dataclass
+class _CacheEntry:
+    session: Session
+    size: int
+    dirty: bool = False
+
+
+class SessionCache:
+    """Bounded LRU cache of sessions keyed by session_id.
+
+    The cache is bounded by entry count and by estimated size in bytes.
+    Entries can be marked dirty to defer writing them (write-behind); dirty
+    entries are never dropped silently, eviction hands them back to the
+    caller to be written.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the cache holds anything at all."""
+        return self.max_entries > 0
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Get a cached session and mark it most recently used."""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        return entry.session
+
+    def peek(self, session_id: str) -> Optional[Session]:
+        """Get a cached session without touching counters or recency."""
+        entry = self._entries.get(session_id)
+        return entry.session if entry else None
+
+    def put(self, session: Session, dirty: bool = False) -> list[Session]:
+        """Cache a session.
+
+        Returns the dirty sessions that had to be evicted to make room; the
+        caller is responsible for writing them.
+        """
+        if not self.enabled:
+            return [session] if dirty else []
+
+        old = self._entries.pop(session.session_id, None)
+        if old is not None:
+            self._bytes -= old.size
+            dirty = dirty or old.dirty
+
+        size = estimate_session_size(session)
+        self._entries[session.session_id] = _CacheEntry(session=session, size=size, dirty=dirty)
+        self._bytes += size
+        return self._evict()
+
+    def discard(self, session_id: str) -> None:
+        """Drop a session from the cache without writing it."""
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def take_dirty(self, session_id: Optional[str] = None) -> list[Session]:
+        """Mark dirty sessions clean and return them for writing."""
+        if session_id is not None:
+            entries = [self._entries[session_id]] if session_id in self._entries else []
+        else:
+            entries = list(self._entries.values())
+
+        dirty = []
+        for entry in entries:
+            if entry.dirty:
+                entry.dirty = False
+                dirty.append(entry.session)
+        return dirty
+
+    def mark_dirty(self, session_id: str) -> None:
+        """Mark a cached session as needing a write (e.g. after a failed flush)."""
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            entry.dirty = True
+
+    def stats(self) -> dict:
+        """Get counters for sizing the cache."""
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "dirty": sum(1 for entry in self._entries.values() if entry.dirty),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _evict(self) -> list[Session]:
+        """Evict least recently used entries until within bounds."""
+        evicted_dirty = []
+        # Always keep the most recently used entry, even if it alone is over the byte cap
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+            if entry.dirty:
+                evicted_dirty.append(entry.session)
+        return evicted_dirty
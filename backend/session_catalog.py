@@ -0,0 +1,347 @@
+"""Persistent catalog of session list entries."""
+
+import bisect
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from operator import itemgetter
+from pathlib import Path
+from typing import Callable, Optional
+from models import Session, SessionListItem, SessionQuery, SessionPage
+from pagination import decode_cursor, encode_cursor, naive_datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking is available
+    fcntl = None
+
+# Longest issue text kept in a catalog entry
+ISSUE_PREVIEW_CHARS = 280
+
+# File suffixes that hold sessions, longest first
+SESSION_SUFFIXES = (".json.gz", ".journal", ".json")
+
+# Entry fields kept in sorted indexes for paginated listing
+SORT_KEYS = ("created_at", "total_cost", "iteration_count")
+
+# Subdirectory of sessions_dir holding compressed, archived sessions
+ARCHIVE_DIR = "archive"
+
+
+def session_id_from_path(path: Path) -> Optional[str]:
+    """Get the session ID a session file belongs to, or None if it isn't one."""
+    for suffix in SESSION_SUFFIXES:
+        if path.name.endswith(suffix):
+            return path.name[:-len(suffix)]
+    return None
+
+
+class SessionCatalog:
+    """Keeps the fields needed for listing sessions without opening them.
+
+    Entries live in memory and are persisted to ``catalog.jsonl`` as an
+    append-only log of ``put``/``del`` records, compacted when it grows
+    well past the number of live entries. Workers sharing the directory
+    append to the same log, so appends and compaction hold an ``flock`` on
+    ``catalog.lock``, and compaction rebuilds the log from its own records
+    rather than from this process's entries. Saves and deletes through the
+    store keep it current; files changed outside of this process are picked
+    up by ``refresh``, which runs at startup and on a timer (see
+    ``SessionManager``), never per request. Each entry remembers the mtime
+    and size of the session file it was built from, so ``refresh`` only
+    re-reads files that changed. Archived sessions under
+    ``archive/`` are cataloged like live ones. Without an ``index_dir`` the
+    catalog is only kept in memory and nothing is written.
+
+    For paginated listing, the catalog also keeps a sorted list of
+    ``(value, session_id)`` per sort key, overall and per status, so a page
+    is read by walking the index from the cursor position and stops once it
+    has ``limit`` matches. A status filter picks that status's index, and a
+    cost range on the cost sort is cut out of the index by bisection; the
+    remaining filters are checked entry by entry. All methods are
+    thread-safe.
+    """
+
+    def __init__(self, index_dir: Optional[Path], sessions_dir: Path, read_session_data: Callable[[Path], dict]):
+        self.index_dir = index_dir
+        self.sessions_dir = sessions_dir
+        self.catalog_path = None
+        if index_dir is not None:
+            index_dir.mkdir(parents=True, exist_ok=True)
+            self.catalog_path = index_dir / "catalog.jsonl"
+        self._read_session_data = read_session_data
+        self._entries: dict[str, dict] = {}
+        self._indexes: dict[tuple[str, Optional[str]], list[tuple]] = {}  # (sort key, status or None) -> index
+        self._log_records = 0
+        self._lock = threading.RLock()
+        self._load()
+        self.refresh()
+
+    def list_items(self) -> list[SessionListItem]:
+        """Get list items for every cataloged session, newest first."""
+        with self._lock:
+            entries = list(self._entries.values())
+        items = [SessionListItem(**self._list_fields(entry)) for entry in entries]
+        items.sort(key=lambda x: x.created_at, reverse=True)
+        return items
+
+    def put(self, session: Session, session_path: Path) -> None:
+        """Record the current state of a saved session."""
+        data = session.model_dump(mode='json', exclude={'iterations'})
+        self.put_data(data, len(session.iterations), session_path)
+
+    def put_data(self, data: dict, iteration_count: int, session_path: Path) -> None:
+        """Record a session from its raw data."""
+        entry = self._build_entry(data, iteration_count, session_path)
+        with self._lock:
+            self._set_entry(entry)
+            self._append({"op": "put", "entry": entry})
+
+    def entries(self) -> list[dict]:
+        """Get a snapshot of all catalog entries."""
+        with self._lock:
+            return list(self._entries.values())
+
+    def remove(self, session_id: str) -> None:
+        """Forget a deleted session."""
+        with self._lock:
+            if self._drop_entry(session_id):
+                self._append({"op": "del", "session_id": session_id})
+
+    def refresh(self) -> None:
+        """Bring the catalog in sync with session files changed out of band."""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self) -> None:
+        """Refresh implementation; the caller holds the catalog lock."""
+        seen = set()
+
+        for entry in self._scan():
+            path = Path(entry.path)
+            session_id = session_id_from_path(path)
+            if not entry.is_file() or session_id is None:
+                continue
+
+            seen.add(session_id)
+            stat = entry.stat()
+            cached = self._entries.get(session_id)
+            if (
+                cached
+                and cached['file'] == self._relative(path)
+                and cached['mtime_ns'] == stat.st_mtime_ns
+                and cached['size'] == stat.st_size
+            ):
+                continue
+
+            try:
+                data = self._read_session_data(path)
+            except Exception as e:
+                print(f"Error loading session {path}: {e}")
+                continue
+
+            new_entry = self._build_entry(data, len(data.get('iterations', [])), path)
+            self._set_entry(new_entry)
+            self._append({"op": "put", "entry": new_entry})
+
+        for session_id in [sid for sid in self._entries if sid not in seen]:
+            self.remove(session_id)
+
+    def query(self, query: SessionQuery) -> SessionPage:
+        """Get one page of list items matching a query."""
+        position = decode_cursor(query)
+        descending = query.order == "desc"
+
+        with self._lock:
+            index = self._indexes.get((query.sort, query.status.value if query.status else None), [])
+            low, high = 0, len(index)
+            if query.sort == "total_cost":
+                if query.min_cost is not None:
+                    low = bisect.bisect_left(index, query.min_cost, key=itemgetter(0))
+                if query.max_cost is not None:
+                    high = bisect.bisect_right(index, query.max_cost, key=itemgetter(0))
+
+            if position is None:
+                start = high - 1 if descending else low
+            elif descending:
+                start = min(bisect.bisect_left(index, tuple(position)), high) - 1
+            else:
+                start = max(bisect.bisect_right(index, tuple(position)), low)
+
+            step = -1 if descending else 1
+            matches = []
+            i = start
+            while low <= i < high:
+                entry = self._entries[index[i][1]]
+                if self._matches(entry, query):
+                    matches.append(entry)
+                    if query.limit is not None and len(matches) > query.limit:
+                        break
+                i += step
+
+        next_cursor = None
+        if query.limit is not None and len(matches) > query.limit:
+            matches = matches[:query.limit]
+            last = matches[-1]
+            next_cursor = encode_cursor(query, last[query.sort], last['session_id'])
+
+        return SessionPage(
+            items=[SessionListItem(**self._list_fields(entry)) for entry in matches],
+            next_cursor=next_cursor
+        )
+
+    @staticmethod
+    def _matches(entry: dict, query: SessionQuery) -> bool:
+        """Check a catalog entry against a query's filters."""
+        if query.status is not None and entry['status'] != query.status.value:
+            return False
+        if query.min_cost is not None and entry['total_cost'] < query.min_cost:
+            return False
+        if query.max_cost is not None and entry['total_cost'] > query.max_cost:
+            return False
+        if query.issue and query.issue.lower() not in entry['issue'].lower():
+            return False
+        if query.created_from is not None or query.created_to is not None:
+            created_at = naive_datetime(datetime.fromisoformat(entry['created_at']))
+            if query.created_from is not None and created_at < naive_datetime(query.created_from):
+                return False
+            if query.created_to is not None and created_at > naive_datetime(query.created_to):
+                return False
+        return True
+
+    def _set_entry(self, entry: dict) -> None:
+        """Add or replace an entry, keeping the sorted indexes in step."""
+        session_id = entry['session_id']
+        self._drop_entry(session_id)
+        self._entries[session_id] = entry
+        for index_key in self._index_keys(entry):
+            bisect.insort(self._indexes.setdefault(index_key, []), (entry[index_key[0]], session_id))
+
+    def _drop_entry(self, session_id: str) -> bool:
+        """Remove an entry and its index positions. Returns False if absent."""
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return False
+        for index_key in self._index_keys(entry):
+            index = self._indexes[index_key]
+            item = (entry[index_key[0]], session_id)
+            i = bisect.bisect_left(index, item)
+            if i < len(index) and index[i] == item:
+                del index[i]
+        return True
+
+    @staticmethod
+    def _index_keys(entry: dict) -> list[tuple[str, Optional[str]]]:
+        """Get the keys of the sorted indexes an entry belongs in."""
+        return [(key, status) for key in SORT_KEYS for status in (None, entry['status'])]
+
+    def _scan(self):
+        """Yield directory entries for live and archived session files."""
+        yield from os.scandir(self.sessions_dir)
+        archive_dir = self.sessions_dir / ARCHIVE_DIR
+        if archive_dir.is_dir():
+            yield from os.scandir(archive_dir)
+
+    def _relative(self, path: Path) -> str:
+        """Get a session file's path relative to sessions_dir."""
+        return path.relative_to(self.sessions_dir).as_posix()
+
+    def _load(self) -> None:
+        """Load catalog entries from the on-disk log."""
+        if self.catalog_path is None or not self.catalog_path.exists():
+            return
+
+        self._entries, self._log_records = self._read_log()
+
+        for sid, entry in self._entries.items():
+            for index_key in self._index_keys(entry):
+                self._indexes.setdefault(index_key, []).append((entry[index_key[0]], sid))
+        for index in self._indexes.values():
+            index.sort()
+
+        if self._log_is_long():
+            with self._log_locked():
+                self._compact()
+
+    def _read_log(self) -> tuple[dict[str, dict], int]:
+        """Replay the on-disk log into entries. Returns them and the number of records read."""
+        entries: dict[str, dict] = {}
+        records = 0
+        with open(self.catalog_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record['op'] == 'put':
+                    entries[record['entry']['session_id']] = record['entry']
+                elif record['op'] == 'del':
+                    entries.pop(record['session_id'], None)
+                records += 1
+        return entries, records
+
+    @contextmanager
+    def _log_locked(self):
+        """Hold the lock that serializes writes to the log across workers."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.index_dir / "catalog.lock", "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _append(self, record: dict) -> None:
+        """Append one record to the catalog log, compacting it once it's grown long."""
+        if self.catalog_path is None:
+            return
+        with self._log_locked():
+            with open(self.catalog_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, default=str) + "\n")
+            self._log_records += 1
+            if self._log_is_long():
+                self._compact()
+
+    def _log_is_long(self) -> bool:
+        """Whether the log has grown well past the live entries."""
+        return self._log_records > 2 * len(self._entries) + 100
+
+    def _compact(self) -> None:
+        """Rewrite the catalog log with one record per live entry.
+
+        The caller holds the log lock. Entries come from the log itself, so
+        records other workers appended since this one loaded are kept.
+        """
+        entries, _ = self._read_log()
+        tmp_path = self.catalog_path.with_suffix(".jsonl.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in entries.values():
+                f.write(json.dumps({"op": "put", "entry": entry}, default=str) + "\n")
+        os.replace(tmp_path, self.catalog_path)
+        self._log_records = len(entries)
+
+    def _build_entry(self, data: dict, iteration_count: int, session_path: Path) -> dict:
+        """Build a catalog entry from session data and its file."""
+        stat = session_path.stat()
+        file = self._relative(session_path)
+        return {
+            "session_id": data['session_id'],
+            "created_at": data['created_at'],
+            "issue": data['issue'][:ISSUE_PREVIEW_CHARS],
+            "status": data['status'],
+            "total_cost": data['budget']['used'],
+            "iteration_count": iteration_count,
+            "file": file,
+            "archived": file.startswith(f"{ARCHIVE_DIR}/"),
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+        }
+
+    @staticmethod
+    def _list_fields(entry: dict) -> dict:
+        """Pick the SessionListItem fields out of a catalog entry."""
+        return {k: entry[k] for k in SessionListItem.model_fields}
@@ -0,0 +1,98 @@
+"""Exclusive per-session locks that hold across worker processes."""
+
+import threading
+from pathlib import Path
+from typing import IO, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking is available
+    fcntl = None
+
+
+class SessionBusyError(Exception):
+    """Raised when a session is already locked by another request."""
+
+    def __init__(self, session_id: str):
+        super().__init__(f"Session {session_id} is busy with another request")
+        self.session_id = session_id
+
+
+class SessionLocks:
+    """Non-blocking exclusive locks, one per session.
+
+    A lock is taken in two layers: a set of held session IDs guards against
+    concurrent requests in this process, and an ``flock`` on
+    ``<lock_dir>/<session_id>.lock`` guards against other workers on the
+    same host. The OS drops the flock if the process dies, so a crashed
+    worker never leaves a session locked.
+
+    Locks never wait: acquiring a held lock raises SessionBusyError so the
+    caller can reject the request instead of queueing a duplicate.
+    """
+
+    def __init__(self, lock_dir: str):
+        self.lock_dir = Path(lock_dir)
+        self._held: dict[str, Optional[IO]] = {}
+        self._lock = threading.Lock()
+
+    def _get_lock_path(self, session_id: str) -> Path:
+        """Get the lock file path for a session."""
+        return self.lock_dir / f"{session_id}.lock"
+
+    def is_locked(self, session_id: str) -> bool:
+        """Whether this process currently holds the session's lock."""
+        with self._lock:
+            return session_id in self._held
+
+    def acquire(self, session_id: str) -> None:
+        """Take the session's lock or raise SessionBusyError."""
+        with self._lock:
+            if session_id in self._held:
+                raise SessionBusyError(session_id)
+            self._held[session_id] = None
+
+        try:
+            handle = self._lock_file(session_id)
+        except BaseException:
+            with self._lock:
+                self._held.pop(session_id, None)
+            raise
+
+        with self._lock:
+            self._held[session_id] = handle
+
+    def _lock_file(self, session_id: str) -> Optional[IO]:
+        """Take the cross-process lock file for a session."""
+        if fcntl is None:
+            return None
+
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        handle = open(self._get_lock_path(session_id), "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            raise SessionBusyError(session_id)
+        except BaseException:
+            handle.close()
+            raise
+        return handle
+
+    def release(self, session_id: str) -> None:
+        """Release the session's lock if this process holds it."""
+        with self._lock:
+            handle = self._held.pop(session_id, None)
+
+        # The lock file is left in place: unlinking it would race with a
+        # worker that has it open and is about to lock it
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    def release_all(self) -> None:
+        """Release every lock held by this process."""
+        with self._lock:
+            session_ids = list(self._held)
+        for session_id in session_ids:
+            self.release(session_id)
@@ -1,84 +1,99 @@
 """Session persistence and management."""
 
-import json
-import os
-from pathlib import Path
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional
-from models import Session, SessionListItem, SessionStatus, BudgetInfo
+from typing import AsyncIterator, Optional
+from models import (
+    Session, SessionListItem, SessionStatus, ArchiveReport, SessionQuery, SessionPage,
+    SessionView, Iteration, SearchHit
+)
 from config import get_settings
+from session_store import SessionStore, create_session_store
+from session_cache import SessionCache
+from session_lock import SessionLocks
 
 
 class SessionManager:
-    """Manages session persistence to JSON files."""
-    
-    def __init__(self):
+    """Manages session persistence through a pluggable SessionStore.
+
+    The backend is chosen by ``settings.session_backend`` unless a store is
+    passed in explicitly. Every operation has an ``a``-prefixed coroutine
+    version that runs the store call, including JSON encoding and model
+    validation, on a dedicated thread pool so the event loop never blocks on
+    session I/O.
+
+    The async API also goes through a SessionCache: loads of hot sessions
+    are served from memory, and saves only mark the cached session dirty.
+    Dirty sessions are written by a background flusher every
+    ``session_flush_interval`` seconds, when evicted, on ``aflush`` (e.g. at
+    the end of an iteration) and on shutdown. The sync API bypasses the
+    cache and is meant for scripts and tests. Another background task
+    refreshes the store's catalog every ``session_catalog_refresh_interval``
+    seconds, so listings pick up session files changed outside the app.
+
+    Requests that modify a session, like running an iteration, hold the
+    session's lock (see ``alocked_session``) so a duplicate request gets
+    SessionBusyError instead of repeating the work and overwriting it.
+    """
+
+    def __init__(
+        self,
+        store: Optional[SessionStore] = None,
+        cache: Optional[SessionCache] = None,
+        locks: Optional[SessionLocks] = None
+    ):
         settings = get_settings()
-        self.sessions_dir = Path(settings.sessions_dir)
-        self.sessions_dir.mkdir(parents=True, exist_ok=True)
-    
-    def _get_session_path(self, session_id: str) -> Path:
-        """Get the file path for a session."""
-        return self.sessions_dir / f"{session_id}.json"
-    
+        self.store = store or create_session_store(settings)
+        self.cache = cache or SessionCache(
+            max_entries=settings.session_cache_size,
+            max_bytes=settings.session_cache_max_bytes
+        )
+        self.locks = locks or SessionLocks(settings.session_lock_dir)
+        self.flush_interval = settings.session_flush_interval
+        self.catalog_refresh_interval = settings.session_catalog_refresh_interval
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.session_io_workers,
+            thread_name_prefix="session-io"
+        )
+        self._background: list[asyncio.Task] = []
+
     def generate_session_id(self) -> str:
         """Generate a unique session ID."""
         timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
         return f"anj-{timestamp}"
-    
+
     def save_session(self, session: Session) -> None:
-        """Save a session to disk."""
+        """Save a session."""
         session.updated_at = datetime.now()
-        session_path = self._get_session_path(session.session_id)
-        
-        with open(session_path, 'w', encoding='utf-8') as f:
-            json.dump(session.model_dump(mode='json'), f, indent=2, default=str)
-    
+        self.store.save_session(session)
+
     def load_session(self, session_id: str) -> Optional[Session]:
-        """Load a session from disk."""
-        session_path = self._get_session_path(session_id)
-        
-        if not session_path.exists():
-            return None
-        
-        with open(session_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return Session(**data)
-    
+        """Load a session."""
+        return self.store.load_session(session_id)
+
+    def load_session_view(self, session_id: str, view: SessionView) -> Optional[Session]:
+        """Load part of a session."""
+        return self.store.load_session_view(session_id, view)
+
+    def load_iteration(self, session_id: str, iteration_number: int) -> Optional[Iteration]:
+        """Load a single iteration of a session."""
+        return self.store.load_iteration(session_id, iteration_number)
+
     def list_sessions(self) -> list[SessionListItem]:
         """List all sessions."""
-        sessions = []
-        
-        for session_file in self.sessions_dir.glob("*.json"):
-            try:
-                with open(session_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    
-                    sessions.append(SessionListItem(
-                        session_id=data['session_id'],
-                        created_at=data['created_at'],
-                        issue=data['issue'],
-                        status=data['status'],
-                        total_cost=data['budget']['used'],
-                        iteration_count=len(data.get('iterations', []))
-                    ))
-            except Exception as e:
-                print(f"Error loading session {session_file}: {e}")
-                continue
-        
-        # Sort by creation date, newest first
-        sessions.sort(key=lambda x: x.created_at, reverse=True)
-        return sessions
-    
+        return self.store.list_sessions()
+
+    def query_sessions(self, query: SessionQuery) -> SessionPage:
+        """List one page of sessions matching a query."""
+        return self.store.query_sessions(query)
+
     def delete_session(self, session_id: str) -> bool:
         """Delete a session."""
-        session_path = self._get_session_path(session_id)
-        
-        if session_path.exists():
-            session_path.unlink()
-            return True
-        return False
-    
+        return self.store.delete_session(session_id)
+
     def update_session_status(self, session_id: str, status: SessionStatus) -> None:
         """Update session status."""
         session = self.load_session(session_id)
@@ -86,3 +101,237 @@ class SessionManager:
             session.status = status
             self.save_session(session)
 
+    def archive_sessions(self, older_than_days: Optional[float] = None) -> ArchiveReport:
+        """Move completed or long-untouched sessions into the archive tier.
+
+        Sessions locked by a request, in this or another worker, are skipped.
+        """
+        return self.store.archive_sessions(older_than_days, self.locks)
+
+    def search_sessions(self, query: str, limit: int = 20) -> list[SearchHit]:
+        """Full-text search across all sessions."""
+        return self.store.search_sessions(query, limit)
+
+    def rebuild_search_index(self) -> int:
+        """Re-index every session, e.g. after files were changed by hand."""
+        return self.store.rebuild_search_index()
+
+    def refresh_catalog(self) -> None:
+        """Pick up session files changed outside the app."""
+        self.store.refresh_catalog()
+
+    # Async API
+
+    async def _run(self, func, *args):
+        """Run a blocking call on the session I/O thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def asave_session(self, session: Session, flush: bool = False) -> None:
+        """Save a session without blocking the event loop.
+
+        The write is deferred to the next flush unless ``flush`` is set or
+        the cache is disabled.
+        """
+        session.updated_at = datetime.now()
+        evicted = self.cache.put(session, dirty=True)
+        await self._write(evicted)
+        if flush:
+            await self.aflush(session.session_id)
+
+    async def aload_session(self, session_id: str) -> Optional[Session]:
+        """Load a session without blocking the event loop."""
+        session = self.cache.get(session_id)
+        if session is not None:
+            return session
+
+        session = await self._run(self.load_session, session_id)
+        if session is None:
+            return None
+
+        # Another coroutine may have cached (and changed) it while we were loading
+        cached = self.cache.peek(session_id)
+        if cached is not None:
+            return cached
+
+        evicted = self.cache.put(session)
+        await self._write(evicted)
+        return session
+
+    async def aacquire_session(self, session_id: str) -> Optional[Session]:
+        """Lock a session and load its latest stored version.
+
+        Raises SessionBusyError if another request, in this or another
+        worker, holds the lock. The session is reloaded from the store since
+        another worker may have changed it behind this worker's cache.
+        Returns None (without holding the lock) if the session doesn't exist.
+        """
+        await self._run(self.locks.acquire, session_id)
+        try:
+            await self.aflush(session_id)
+            session = await self._run(self.load_session, session_id)
+        except BaseException:
+            await self.arelease_session(session_id)
+            raise
+
+        if session is None:
+            self.cache.discard(session_id)
+            await self.arelease_session(session_id)
+            return None
+
+        evicted = self.cache.put(session)
+        await self._write(evicted)
+        return session
+
+    async def arelease_session(self, session_id: str) -> None:
+        """Write out a locked session and release its lock."""
+        try:
+            await self.aflush(session_id)
+        finally:
+            await self._run(self.locks.release, session_id)
+
+    @asynccontextmanager
+    async def alocked_session(self, session_id: str) -> AsyncIterator[Optional[Session]]:
+        """Hold a session's lock for the duration of a block.
+
+        Yields the freshly loaded session, or None if it doesn't exist.
+        """
+        session = await self.aacquire_session(session_id)
+        try:
+            yield session
+        finally:
+            if session is not None:
+                await self.arelease_session(session_id)
+
+    async def aload_session_view(self, session_id: str, view: SessionView) -> Optional[Session]:
+        """Load part of a session without blocking the event loop.
+
+        Cached sessions are projected in memory; otherwise the store reads
+        only what the view needs, and the partial result isn't cached.
+        """
+        session = self.cache.get(session_id)
+        if session is not None:
+            return view.apply(session)
+        return await self._run(self.load_session_view, session_id, view)
+
+    async def aload_iteration(self, session_id: str, iteration_number: int) -> Optional[Iteration]:
+        """Load a single iteration without blocking the event loop."""
+        session = self.cache.get(session_id)
+        if session is not None:
+            return next(
+                (it for it in session.iterations if it.iteration_number == iteration_number),
+                None
+            )
+        return await self._run(self.load_iteration, session_id, iteration_number)
+
+    async def alist_sessions(self) -> list[SessionListItem]:
+        """List all sessions without blocking the event loop.
+
+        Pending writes are flushed first so the listing reflects them.
+        """
+        await self.aflush()
+        return await self._run(self.list_sessions)
+
+    async def aquery_sessions(self, query: SessionQuery) -> SessionPage:
+        """List one page of sessions without blocking the event loop."""
+        await self.aflush()
+        return await self._run(self.query_sessions, query)
+
+    async def adelete_session(self, session_id: str) -> bool:
+        """Delete a session without blocking the event loop.
+
+        Raises SessionBusyError if another request holds the session's lock,
+        since it would write the session back the next time it saves.
+        """
+        await self._run(self.locks.acquire, session_id)
+        try:
+            self.cache.discard(session_id)
+            return await self._run(self.delete_session, session_id)
+        finally:
+            await self._run(self.locks.release, session_id)
+
+    async def aupdate_session_status(self, session_id: str, status: SessionStatus) -> None:
+        """Update session status without blocking the event loop.
+
+        Raises SessionBusyError if another request holds the session's lock.
+        """
+        async with self.alocked_session(session_id) as session:
+            if session:
+                session.status = status
+                await self.asave_session(session)
+
+    async def aarchive_sessions(self, older_than_days: Optional[float] = None) -> ArchiveReport:
+        """Run the archive tiering pass without blocking the event loop."""
+        await self.aflush()
+        return await self._run(self.archive_sessions, older_than_days)
+
+    async def asearch_sessions(self, query: str, limit: int = 20) -> list[SearchHit]:
+        """Full-text search without blocking the event loop.
+
+        Pending writes are flushed first so the index reflects them.
+        """
+        await self.aflush()
+        return await self._run(self.search_sessions, query, limit)
+
+    async def aflush(self, session_id: Optional[str] = None) -> None:
+        """Write dirty cached sessions, or just one of them."""
+        await self._write(self.cache.take_dirty(session_id))
+
+    async def _write(self, sessions: list[Session]) -> None:
+        """Write sessions to the store, re-marking them dirty on failure.
+
+        One failed write doesn't stop the rest of the batch; the first error
+        is raised once every session has been tried.
+        """
+        error = None
+        for session in sessions:
+            try:
+                await self._run(self.store.save_session, session)
+            except Exception as e:
+                print(f"Error writing session {session.session_id}: {e}")
+                self.cache.mark_dirty(session.session_id)
+                error = error or e
+        if error is not None:
+            raise error
+
+    async def _flush_periodically(self) -> None:
+        """Background task that writes dirty sessions on a timer."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.aflush()
+            except Exception:
+                # Already logged; the session stays dirty for the next pass
+                pass
+
+    async def _refresh_catalog_periodically(self) -> None:
+        """Background task that rescans for out-of-band session changes on a timer."""
+        while True:
+            await asyncio.sleep(self.catalog_refresh_interval)
+            try:
+                await self._run(self.refresh_catalog)
+            except Exception as e:
+                print(f"Error refreshing session catalog: {e}")
+
+    def start(self) -> None:
+        """Start the write-behind flusher and catalog refresher. Must be called from the event loop."""
+        if not self._background:
+            self._background = [
+                asyncio.create_task(self._flush_periodically()),
+                asyncio.create_task(self._refresh_catalog_periodically())
+            ]
+
+    async def aclose(self) -> None:
+        """Stop the background tasks, write everything dirty and release resources."""
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        self._background = []
+        await self.aflush()
+        self.locks.release_all()
+        self.close()
+
+    def close(self) -> None:
+        """Wait for pending I/O and release the store."""
+        self._executor.shutdown(wait=True)
+        self.store.close()
@@ -0,0 +1,712 @@
+"""Pluggable session storage backends."""
+
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+from models import (
+    Session, SessionListItem, SessionStatus, ArchiveReport, SessionQuery, SessionPage,
+    SessionView, Iteration, SearchHit
+)
+from config import Settings
+from search_index import SearchIndex
+from session_catalog import SessionCatalog, ARCHIVE_DIR
+from session_lock import SessionBusyError, SessionLocks
+
+# Matches the start of a journal message record, as written by json.dumps
+_MESSAGE_RECORD = re.compile(r'\{"op": "message", "iteration": (\d+),')
+_CURRENT_MESSAGE_RECORD = re.compile(r'\{"op": "current_message",')
+
+
+class SessionStore(ABC):
+    """Interface for session storage backends."""
+
+    # Full-text index kept up to date by save_session and delete_session
+    search_index: Optional[SearchIndex] = None
+
+    @abstractmethod
+    def save_session(self, session: Session) -> None:
+        """Persist a session."""
+
+    @abstractmethod
+    def load_session(self, session_id: str) -> Optional[Session]:
+        """Load a session, or None if it doesn't exist."""
+
+    def load_session_view(self, session_id: str, view: SessionView) -> Optional[Session]:
+        """Load part of a session.
+
+        The default loads everything and trims it; backends override this to
+        avoid reading the parts the view leaves out.
+        """
+        session = self.load_session(session_id)
+        return view.apply(session) if session else None
+
+    def load_iteration(self, session_id: str, iteration_number: int) -> Optional[Iteration]:
+        """Load a single iteration, or None if the session or iteration doesn't exist."""
+        view = SessionView(iteration_from=iteration_number, iteration_to=iteration_number)
+        session = self.load_session_view(session_id, view)
+        if session is None or not session.iterations:
+            return None
+        return session.iterations[0]
+
+    @abstractmethod
+    def list_sessions(self) -> list[SessionListItem]:
+        """List all sessions, newest first."""
+
+    @abstractmethod
+    def query_sessions(self, query: SessionQuery) -> SessionPage:
+        """List one page of sessions matching a query."""
+
+    @abstractmethod
+    def delete_session(self, session_id: str) -> bool:
+        """Delete a session. Returns False if it didn't exist."""
+
+    def archive_sessions(
+        self,
+        older_than_days: Optional[float] = None,
+        locks: Optional[SessionLocks] = None
+    ) -> ArchiveReport:
+        """Move completed or long-untouched sessions into compressed storage.
+
+        With ``locks``, each session's lock is held while it's moved, and
+        sessions locked by a request in any worker are skipped.
+        """
+        raise NotImplementedError(f"{type(self).__name__} doesn't support archiving")
+
+    def refresh_catalog(self) -> None:
+        """Pick up sessions changed outside of the store (a no-op if listing doesn't need it)."""
+
+    def search_sessions(self, query: str, limit: int = 20) -> list[SearchHit]:
+        """Full-text search over issues, messages and summaries, best match first."""
+        if self.search_index is None:
+            raise NotImplementedError(f"{type(self).__name__} doesn't support search")
+        return self.search_index.search(query, limit)
+
+    def rebuild_search_index(self) -> int:
+        """Re-index every stored session. Returns the number of sessions indexed."""
+        self.search_index.clear()
+        indexed = 0
+        for item in self.list_sessions():
+            session = self.load_session(item.session_id)
+            if session is not None:
+                self.search_index.index_session(session)
+                indexed += 1
+        return indexed
+
+    def _index_session(self, session: Session) -> None:
+        """Update the search index after a save.
+
+        The session itself is already saved, so an indexing failure is only
+        logged; ``rebuild_search_index`` repairs the index.
+        """
+        try:
+            self.search_index.index_session(session)
+        except Exception as e:
+            print(f"Error indexing session {session.session_id}: {e}")
+
+    def close(self) -> None:
+        """Release any resources held by the store."""
+
+
+@dataclass
+class _IterationState:
+    """What has already been journaled for one iteration."""
+    header: dict = field(default_factory=dict)  # Every field but messages and summary
+    message_count: int = 0
+    has_summary: bool = False
+
+
+def _iteration_header(iteration: Iteration) -> dict:
+    """Get the fields of an iteration other than its messages and summary."""
+    return iteration.model_dump(mode='json', exclude={'messages', 'summary'})
+
+
+def _iteration_state(data: dict) -> _IterationState:
+    """Get what a snapshot holds of one iteration's raw data."""
+    return _IterationState(
+        header={k: v for k, v in data.items() if k not in ('messages', 'summary')},
+        message_count=len(data.get('messages', [])),
+        has_summary=data.get('summary') is not None
+    )
+
+
+@dataclass
+class _JournalState:
+    """What has already been journaled for one session."""
+    meta: dict = field(default_factory=dict)
+    iterations: list[_IterationState] = field(default_factory=list)
+    current: Optional[_IterationState] = None  # The iteration underway
+    records: int = 0  # Records appended since the last snapshot
+    size: int = 0  # Bytes of journal this state describes
+
+
+class FileSessionStore(SessionStore):
+    """Stores one file per session in a directory.
+
+    Two on-disk formats are supported:
+    - "json": a full snapshot in ``<session_id>.json``, rewritten on every save
+    - "journal": ``<session_id>.journal``, a compact snapshot header followed by
+      append-only records (iteration, iteration_header, message, summary,
+      meta, and current* for the iteration underway), so each save
+      only writes what changed since the last one. The journal is compacted
+      back into a single snapshot after ``journal_compact_threshold`` records.
+
+    Completed or long-untouched sessions can be moved into a cold tier, as
+    gzipped compact JSON in ``archive/<session_id>.json.gz``; loads
+    decompress them transparently and saving one brings it back to the live
+    format. Loads understand every format regardless of the configured one. A
+    SessionCatalog under ``.index/`` keeps the list fields for every session
+    so listing doesn't have to open session files. The store is thread-safe:
+    access to each session's files is serialized by a per-session lock.
+
+    A ``read_only`` store (e.g. the source of a migration) writes nothing to
+    the directory: its catalog is built in memory, it has no search index,
+    and saving, deleting or archiving raises PermissionError.
+    """
+
+    def __init__(
+        self,
+        sessions_dir: str,
+        storage_format: str = "json",
+        journal_compact_threshold: int = 200,
+        read_only: bool = False
+    ):
+        self.sessions_dir = Path(sessions_dir)
+        self.read_only = read_only
+        if not read_only:
+            self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        self.storage_format = storage_format
+        self.journal_compact_threshold = journal_compact_threshold
+        self._journals: dict[str, _JournalState] = {}
+        self._session_locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self.catalog = SessionCatalog(
+            index_dir=None if read_only else self.sessions_dir / ".index",
+            sessions_dir=self.sessions_dir,
+            read_session_data=self._read_session_data
+        )
+        if not read_only:
+            self.search_index = SearchIndex(self.sessions_dir / ".index" / "search.db")
+            if self.search_index.created:
+                self.rebuild_search_index()
+
+    def _get_session_path(self, session_id: str) -> Path:
+        """Get the file path for a session."""
+        return self.sessions_dir / f"{session_id}.json"
+
+    def _get_journal_path(self, session_id: str) -> Path:
+        """Get the journal file path for a session."""
+        return self.sessions_dir / f"{session_id}.journal"
+
+    def _get_archive_path(self, session_id: str) -> Path:
+        """Get the archived file path for a session."""
+        return self.sessions_dir / ARCHIVE_DIR / f"{session_id}.json.gz"
+
+    def _check_writable(self) -> None:
+        """Refuse to change a read-only store."""
+        if self.read_only:
+            raise PermissionError(f"Session store at {self.sessions_dir} is read-only")
+
+    def _lock_for(self, session_id: str) -> threading.Lock:
+        """Get the lock that serializes file access for one session."""
+        with self._locks_guard:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def save_session(self, session: Session) -> None:
+        """Save a session to disk."""
+        self._check_writable()
+        with self._lock_for(session.session_id):
+            if self.storage_format == "journal":
+                self._save_journal(session)
+                self._get_session_path(session.session_id).unlink(missing_ok=True)
+                self._get_archive_path(session.session_id).unlink(missing_ok=True)
+                self.catalog.put(session, self._get_journal_path(session.session_id))
+                self._index_session(session)
+                return
+
+            session_path = self._get_session_path(session.session_id)
+            tmp_path = session_path.with_suffix(".json.tmp")
+
+            # Write then rename so concurrent readers never see a partial file
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(session.model_dump(mode='json'), f, indent=2, default=str)
+            os.replace(tmp_path, session_path)
+
+            self._get_journal_path(session.session_id).unlink(missing_ok=True)
+            self._get_archive_path(session.session_id).unlink(missing_ok=True)
+            self._journals.pop(session.session_id, None)
+            self.catalog.put(session, session_path)
+            self._index_session(session)
+
+    def load_session(self, session_id: str) -> Optional[Session]:
+        """Load a session from disk."""
+        with self._lock_for(session_id):
+            journal_path = self._get_journal_path(session_id)
+            session_path = self._get_session_path(session_id)
+            archive_path = self._get_archive_path(session_id)
+            if journal_path.exists():
+                data, state = self._replay_journal(journal_path)
+                self._journals[session_id] = state
+            elif session_path.exists():
+                with open(session_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            elif archive_path.exists():
+                data = self._read_session_data(archive_path)
+            else:
+                return None
+
+        # Validation doesn't touch the files, so it runs outside the lock
+        return Session(**data)
+
+    def load_session_view(self, session_id: str, view: SessionView) -> Optional[Session]:
+        """Load part of a session.
+
+        Journals are read without decoding the message records the view
+        leaves out. JSON snapshots have to be decoded whole, but are trimmed
+        before validation.
+        """
+        with self._lock_for(session_id):
+            journal_path = self._get_journal_path(session_id)
+            if journal_path.exists():
+                data, _ = self._replay_journal(journal_path, view)
+                return Session(**data)
+
+            for path in (self._get_session_path(session_id), self._get_archive_path(session_id)):
+                if path.exists():
+                    data = self._read_session_data(path)
+                    break
+            else:
+                return None
+
+        return Session(**self._project_data(data, view))
+
+    @staticmethod
+    def _project_data(data: dict, view: SessionView) -> dict:
+        """Trim raw session data down to a view."""
+        first, last = view.iteration_range(len(data['iterations']))
+        iterations = []
+        for iteration in data['iterations']:
+            if first <= iteration['iteration_number'] <= last:
+                if not view.include_messages:
+                    iteration = {**iteration, "messages": []}
+                iterations.append(iteration)
+        current = data.get('current_iteration')
+        if current is not None and not view.include_messages:
+            current = {**current, "messages": []}
+        return {**data, "iterations": iterations, "current_iteration": current}
+
+    def list_sessions(self) -> list[SessionListItem]:
+        """List all sessions from the catalog."""
+        return self.catalog.list_items()
+
+    def query_sessions(self, query: SessionQuery) -> SessionPage:
+        """List one page of sessions from the catalog's sorted indexes."""
+        return self.catalog.query(query)
+
+    def refresh_catalog(self) -> None:
+        """Bring the catalog in sync with session files changed by hand or by another process."""
+        self.catalog.refresh()
+
+    def delete_session(self, session_id: str) -> bool:
+        """Delete a session."""
+        self._check_writable()
+        with self._lock_for(session_id):
+            self._journals.pop(session_id, None)
+            deleted = False
+
+            for path in (
+                self._get_session_path(session_id),
+                self._get_journal_path(session_id),
+                self._get_archive_path(session_id)
+            ):
+                if path.exists():
+                    path.unlink()
+                    deleted = True
+
+            self.catalog.remove(session_id)
+            self.search_index.remove_session(session_id)
+
+        with self._locks_guard:
+            self._session_locks.pop(session_id, None)
+        return deleted
+
+    def _read_session_data(self, session_path: Path) -> dict:
+        """Read raw session data from a file in either format."""
+        if session_path.suffix == ".journal":
+            data, _ = self._replay_journal(session_path)
+            return data
+
+        if session_path.suffix == ".gz":
+            with gzip.open(session_path, 'rt', encoding='utf-8') as f:
+                return json.load(f)
+
+        with open(session_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def archive_sessions(
+        self,
+        older_than_days: Optional[float] = None,
+        locks: Optional[SessionLocks] = None
+    ) -> ArchiveReport:
+        """Compress completed sessions, and ones untouched for ``older_than_days``."""
+        self._check_writable()
+        report = ArchiveReport()
+        cutoff_ns = (
+            time.time_ns() - int(older_than_days * 86400 * 1e9)
+            if older_than_days is not None else None
+        )
+        (self.sessions_dir / ARCHIVE_DIR).mkdir(exist_ok=True)
+
+        for entry in self.catalog.entries():
+            if entry.get('archived'):
+                continue
+            completed = entry['status'] == SessionStatus.COMPLETED.value
+            stale = cutoff_ns is not None and entry['mtime_ns'] < cutoff_ns
+            if not (completed or stale):
+                continue
+            if locks is None:
+                self._archive_session(entry['session_id'], report)
+                continue
+
+            # A session in use would be written back over its archived copy
+            try:
+                locks.acquire(entry['session_id'])
+            except SessionBusyError:
+                report.skipped += 1
+                continue
+            try:
+                self._archive_session(entry['session_id'], report)
+            finally:
+                locks.release(entry['session_id'])
+
+        return report
+
+    def _archive_session(self, session_id: str, report: ArchiveReport) -> None:
+        """Move one session into the archive tier."""
+        with self._lock_for(session_id):
+            live_paths = [
+                path for path in (self._get_journal_path(session_id), self._get_session_path(session_id))
+                if path.exists()
+            ]
+            if not live_paths:
+                return
+
+            data = self._read_session_data(live_paths[0])
+            archive_path = self._get_archive_path(session_id)
+            tmp_path = archive_path.with_suffix(".gz.tmp")
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'), default=str)
+            os.replace(tmp_path, archive_path)
+
+            report.archived += 1
+            report.bytes_before += sum(path.stat().st_size for path in live_paths)
+            report.bytes_after += archive_path.stat().st_size
+
+            for path in live_paths:
+                path.unlink()
+            self._journals.pop(session_id, None)
+            self.catalog.put_data(data, len(data.get('iterations', [])), archive_path)
+
+    # Journal format
+
+    def _save_journal(self, session: Session) -> None:
+        """Append the changes since the last save to the session's journal."""
+        journal_path = self._get_journal_path(session.session_id)
+        state = self._journals.get(session.session_id)
+        if state is not None and not self._journal_matches(journal_path, state):
+            # Moved or rewritten by another process (e.g. archived), so the
+            # records this state would append to are gone
+            del self._journals[session.session_id]
+            self._compact_journal(session)
+            return
+        if state is None and journal_path.exists():
+            _, state = self._replay_journal(journal_path)
+
+        records = self._diff_records(session, state) if state else None
+
+        # No usable journal yet, history was rewritten, or the journal grew
+        # long enough that replaying it costs more than a fresh snapshot
+        if records is None or state.records + len(records) > self.journal_compact_threshold:
+            self._compact_journal(session)
+            return
+
+        if records:
+            with open(journal_path, 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps(r, default=str) + "\n" for r in records))
+            self._apply_records(state, records)
+            state.size = journal_path.stat().st_size
+
+    @staticmethod
+    def _journal_matches(journal_path: Path, state: _JournalState) -> bool:
+        """Whether a journal is still the one ``state`` was built from."""
+        try:
+            return journal_path.stat().st_size == state.size
+        except FileNotFoundError:
+            return False
+
+    def _compact_journal(self, session: Session) -> None:
+        """Rewrite a session's journal from scratch.
+
+        The compacted journal is a snapshot header without iterations,
+        followed by one record per iteration, message and summary, so
+        partial loads can still skip messages.
+        """
+        journal_path = self._get_journal_path(session.session_id)
+        tmp_path = journal_path.with_suffix(".journal.tmp")
+        header = session.model_dump(mode='json', exclude={'iterations', 'current_iteration'})
+        header['iterations'] = []
+        header['current_iteration'] = None
+
+        state = _JournalState()
+        self._apply_snapshot(state, header)
+        records = self._diff_records(session, state)
+        snapshot = {"op": "snapshot", "session": header, "base_records": len(records)}
+
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("".join(json.dumps(r, default=str) + "\n" for r in [snapshot, *records]))
+        os.replace(tmp_path, journal_path)
+
+        self._apply_records(state, records)
+        state.records = 0
+        state.size = journal_path.stat().st_size
+        self._journals[session.session_id] = state
+
+    def _diff_records(self, session: Session, state: _JournalState) -> Optional[list[dict]]:
+        """Build the journal records that bring ``state`` up to ``session``.
+
+        Returns None when the change can't be expressed as appends (for
+        example an iteration or message was removed), in which case the
+        caller falls back to a snapshot.
+        """
+        if len(session.iterations) < len(state.iterations):
+            return None
+
+        records = []
+        for idx, iteration in enumerate(session.iterations):
+            header = _iteration_header(iteration)
+            if idx < len(state.iterations):
+                journaled = state.iterations[idx]
+                if header != journaled.header:
+                    records.append({"op": "iteration_header", "iteration": idx, "header": header})
+            else:
+                journaled = _IterationState()
+                records.append({"op": "iteration", "header": header})
+
+            if len(iteration.messages) < journaled.message_count:
+                return None
+            if journaled.has_summary and iteration.summary is None:
+                return None
+
+            for message in iteration.messages[journaled.message_count:]:
+                records.append({
+                    "op": "message",
+                    "iteration": idx,
+                    "message": message.model_dump(mode='json')
+                })
+
+            if iteration.summary is not None and not journaled.has_summary:
+                records.append({
+                    "op": "summary",
+                    "iteration": idx,
+                    "summary": iteration.summary.model_dump(mode='json')
+                })
+
+        records.extend(self._diff_current(session.current_iteration, state.current))
+
+        # The iteration underway has its own records, so its turns aren't
+        # rewritten with every save
+        meta = session.model_dump(mode='json', exclude={'iterations', 'current_iteration'})
+        changed = {k: v for k, v in meta.items() if state.meta.get(k) != v}
+        if changed:
+            records.append({"op": "meta", "fields": changed})
+
+        return records
+
+    @staticmethod
+    def _diff_current(current: Optional[Iteration], journaled: Optional[_IterationState]) -> list[dict]:
+        """Build the records that bring the journaled iteration underway up to ``current``.
+
+        A new iteration (or one that lost turns) starts over with a
+        ``current`` record; otherwise only its new turns are appended.
+        """
+        if current is None:
+            return [{"op": "current", "header": None}] if journaled is not None else []
+
+        records = []
+        header = _iteration_header(current)
+        if (
+            journaled is None
+            or journaled.header.get('iteration_number') != header['iteration_number']
+            or len(current.messages) < journaled.message_count
+            or (journaled.has_summary and current.summary is None)
+        ):
+            journaled = _IterationState()
+            records.append({"op": "current", "header": header})
+        elif header != journaled.header:
+            records.append({"op": "current_header", "header": header})
+
+        for message in current.messages[journaled.message_count:]:
+            records.append({"op": "current_message", "message": message.model_dump(mode='json')})
+        if current.summary is not None and not journaled.has_summary:
+            records.append({"op": "current_summary", "summary": current.summary.model_dump(mode='json')})
+        return records
+
+    @staticmethod
+    def _apply_snapshot(state: _JournalState, data: dict) -> None:
+        """Reset journal state to match a snapshot."""
+        state.meta = {k: v for k, v in data.items() if k not in ('iterations', 'current_iteration')}
+        state.iterations = [_iteration_state(it) for it in data.get('iterations', [])]
+        current = data.get('current_iteration')
+        state.current = _iteration_state(current) if current is not None else None
+        state.records = 0
+
+    @staticmethod
+    def _apply_records(state: _JournalState, records: list[dict]) -> None:
+        """Advance journal state past records that were just written."""
+        for record in records:
+            op = record['op']
+            if op == 'iteration':
+                state.iterations.append(_IterationState(header=record['header']))
+            elif op == 'iteration_header':
+                state.iterations[record['iteration']].header = record['header']
+            elif op == 'message':
+                state.iterations[record['iteration']].message_count += 1
+            elif op == 'summary':
+                state.iterations[record['iteration']].has_summary = True
+            elif op == 'current':
+                state.current = _IterationState(header=record['header']) if record['header'] else None
+            elif op == 'current_header':
+                state.current.header = record['header']
+            elif op == 'current_message':
+                state.current.message_count += 1
+            elif op == 'current_summary':
+                state.current.has_summary = True
+            elif op == 'meta':
+                state.meta.update(record['fields'])
+        state.records += len(records)
+
+    def _replay_journal(
+        self,
+        journal_path: Path,
+        view: Optional[SessionView] = None
+    ) -> tuple[dict, Optional[_JournalState]]:
+        """Rebuild session data and journal state from a journal file.
+
+        With a view, message records are only decoded for the iterations it
+        selects, and no journal state is returned since the data is partial.
+        """
+        data = None
+        records = 0
+        base_records = 0
+        deferred: dict[int, list[str]] = {}
+        deferred_current: list[str] = []
+
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            size = os.fstat(f.fileno()).st_size
+            for line in f:
+                if view is not None:
+                    match = _MESSAGE_RECORD.match(line)
+                    if match:
+                        if view.include_messages:
+                            deferred.setdefault(int(match.group(1)), []).append(line)
+                        records += 1
+                        continue
+                    if _CURRENT_MESSAGE_RECORD.match(line):
+                        if view.include_messages:
+                            deferred_current.append(line)
+                        records += 1
+                        continue
+
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from an interrupted append
+                    print(f"Skipping unreadable journal record in {journal_path}")
+                    continue
+
+                op = record['op']
+                if op == 'snapshot':
+                    data = record['session']
+                    base_records = record.get('base_records', 0)
+                    continue
+                elif data is None:
+                    raise ValueError(f"Journal {journal_path} has no snapshot record")
+                elif op == 'iteration':
+                    # Older journals only recorded the number and guidance
+                    header = record.get('header') or {
+                        "iteration_number": record['iteration_number'],
+                        "user_guidance": record.get('user_guidance')
+                    }
+                    data['iterations'].append({**header, "messages": [], "summary": None})
+                elif op == 'iteration_header':
+                    data['iterations'][record['iteration']].update(record['header'])
+                elif op == 'message':
+                    data['iterations'][record['iteration']]['messages'].append(record['message'])
+                elif op == 'summary':
+                    data['iterations'][record['iteration']]['summary'] = record['summary']
+                elif op == 'current':
+                    header = record['header']
+                    data['current_iteration'] = {**header, "messages": [], "summary": None} if header else None
+                    deferred_current = []
+                elif op == 'current_header':
+                    data['current_iteration'].update(record['header'])
+                elif op == 'current_message':
+                    data['current_iteration']['messages'].append(record['message'])
+                elif op == 'current_summary':
+                    data['current_iteration']['summary'] = record['summary']
+                elif op == 'meta':
+                    data.update(record['fields'])
+                records += 1
+
+        if data is None:
+            raise ValueError(f"Journal {journal_path} has no snapshot record")
+
+        if view is not None:
+            first, last = view.iteration_range(len(data['iterations']))
+            for idx, lines in deferred.items():
+                if not first <= data['iterations'][idx]['iteration_number'] <= last:
+                    continue
+                for line in lines:
+                    try:
+                        data['iterations'][idx]['messages'].append(json.loads(line)['message'])
+                    except json.JSONDecodeError:
+                        print(f"Skipping unreadable journal record in {journal_path}")
+            for line in deferred_current:
+                try:
+                    data['current_iteration']['messages'].append(json.loads(line)['message'])
+                except json.JSONDecodeError:
+                    print(f"Skipping unreadable journal record in {journal_path}")
+            return self._project_data(data, view), None
+
+        state = _JournalState()
+        self._apply_snapshot(state, data)
+        state.records = records - base_records
+        state.size = size
+        return data, state
+
+    def close(self) -> None:
+        """Close the search index."""
+        if self.search_index is not None:
+            self.search_index.close()
+
+
+def create_session_store(settings: Settings) -> SessionStore:
+    """Create the session store selected by ``settings.session_backend``."""
+    if settings.session_backend == "sqlite":
+        from sqlite_store import SqliteSessionStore
+        return SqliteSessionStore(settings.sqlite_path)
+
+    if settings.session_backend == "file":
+        return FileSessionStore(
+            sessions_dir=settings.sessions_dir,
+            storage_format=settings.session_storage_format,
+            journal_compact_threshold=settings.journal_compact_threshold
+        )
+
+    raise ValueError(f"Unknown session backend: {settings.session_backend}")
@@ -0,0 +1,363 @@
+"""SQLite session storage backend."""
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+from models import Session, SessionListItem, SessionQuery, SessionPage, SessionView
+from pagination import decode_cursor, encode_cursor, naive_datetime
+from search_index import SearchIndex
+from session_catalog import ISSUE_PREVIEW_CHARS
+from session_store import SessionStore
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    issue TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total_cost REAL NOT NULL,
+    iteration_count INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions(created_at, session_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_total_cost ON sessions(total_cost, session_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_iteration_count ON sessions(iteration_count, session_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_status ON sessions(status, created_at);
+
+CREATE TABLE IF NOT EXISTS agents (
+    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    agent_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    cost_used REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (session_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS iterations (
+    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    iteration_number INTEGER NOT NULL,
+    user_guidance TEXT,
+    summary TEXT,
+    data TEXT,
+    PRIMARY KEY (session_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    iteration_position INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    agent_id TEXT NOT NULL,
+    cost REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (session_id, iteration_position, position),
+    FOREIGN KEY (session_id, iteration_position)
+        REFERENCES iterations(session_id, position) ON DELETE CASCADE
+);
+"""
+
+
+class SqliteSessionStore(SessionStore):
+    """Stores sessions in an embedded SQLite database.
+
+    Sessions, agents, iterations and messages live in separate tables. Query
+    columns (status, cost, agent ids...) are broken out; the rest of each row
+    is kept as JSON in ``data`` so new model fields don't need a migration
+    (for iterations, everything but the messages and summary).
+    The database runs in WAL mode so readers don't block the writer, and
+    each thread gets its own connection. The full-text search index lives
+    in the same database file.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        self._add_missing_columns(conn)
+
+        self.search_index = SearchIndex(self.db_path)
+        if self.search_index.created:
+            self.rebuild_search_index()
+
+    @staticmethod
+    def _add_missing_columns(conn: sqlite3.Connection) -> None:
+        """Bring a database created by an older version up to the current schema."""
+        columns = {name for _, name, *_ in conn.execute("PRAGMA table_info(iterations)")}
+        if "data" not in columns:
+            with conn:
+                conn.execute("ALTER TABLE iterations ADD COLUMN data TEXT")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def save_session(self, session: Session) -> None:
+        """Save a session, appending only iterations and messages that are new."""
+        conn = self._connect()
+        header = session.model_dump(mode='json', exclude={'iterations', 'agents'})
+
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO sessions
+                    (session_id, created_at, updated_at, issue, status, total_cost, iteration_count, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    updated_at = excluded.updated_at,
+                    issue = excluded.issue,
+                    status = excluded.status,
+                    total_cost = excluded.total_cost,
+                    iteration_count = excluded.iteration_count,
+                    data = excluded.data
+                """,
+                (
+                    session.session_id,
+                    header['created_at'],
+                    header['updated_at'],
+                    session.issue,
+                    header['status'],
+                    session.budget.used,
+                    len(session.iterations),
+                    json.dumps(header),
+                )
+            )
+
+            # Agent stats change every iteration and there are only a handful
+            conn.execute("DELETE FROM agents WHERE session_id = ?", (session.session_id,))
+            conn.executemany(
+                "INSERT INTO agents (session_id, position, agent_id, model, cost_used, data) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (session.session_id, idx, agent.id, agent.model, agent.cost_used,
+                     json.dumps(agent.model_dump(mode='json')))
+                    for idx, agent in enumerate(session.agents)
+                ]
+            )
+
+            self._save_iterations(conn, session)
+
+        self._index_session(session)
+
+    def _save_iterations(self, conn: sqlite3.Connection, session: Session) -> None:
+        """Insert new iterations and messages, and fill in new summaries and changed headers."""
+        stored = {
+            position: (has_summary, data)
+            for position, has_summary, data in conn.execute(
+                "SELECT position, summary IS NOT NULL, data FROM iterations WHERE session_id = ?",
+                (session.session_id,)
+            )
+        }
+        message_counts = dict(conn.execute(
+            "SELECT iteration_position, COUNT(*) FROM messages WHERE session_id = ? GROUP BY iteration_position",
+            (session.session_id,)
+        ))
+
+        # Iterations only ever grow; anything beyond the current list is stale
+        conn.execute(
+            "DELETE FROM iterations WHERE session_id = ? AND position >= ?",
+            (session.session_id, len(session.iterations))
+        )
+
+        for position, iteration in enumerate(session.iterations):
+            summary = (
+                json.dumps(iteration.summary.model_dump(mode='json'))
+                if iteration.summary else None
+            )
+            header = json.dumps(iteration.model_dump(mode='json', exclude={'messages', 'summary'}))
+            if position not in stored:
+                conn.execute(
+                    """
+                    INSERT INTO iterations (session_id, position, iteration_number, user_guidance, summary, data)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (session.session_id, position, iteration.iteration_number, iteration.user_guidance, summary, header)
+                )
+            else:
+                has_summary, stored_header = stored[position]
+                if summary is not None and not has_summary:
+                    conn.execute(
+                        "UPDATE iterations SET summary = ? WHERE session_id = ? AND position = ?",
+                        (summary, session.session_id, position)
+                    )
+                if header != stored_header:
+                    conn.execute(
+                        """
+                        UPDATE iterations SET iteration_number = ?, user_guidance = ?, data = ?
+                        WHERE session_id = ? AND position = ?
+                        """,
+                        (iteration.iteration_number, iteration.user_guidance, header, session.session_id, position)
+                    )
+
+            known = message_counts.get(position, 0)
+            conn.executemany(
+                """
+                INSERT INTO messages (session_id, iteration_position, position, agent_id, cost, data)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (session.session_id, position, idx, message.agent_id, message.cost,
+                     json.dumps(message.model_dump(mode='json')))
+                    for idx, message in enumerate(iteration.messages)
+                    if idx >= known
+                ]
+            )
+
+    def load_session(self, session_id: str) -> Optional[Session]:
+        """Load a session from the database."""
+        return self.load_session_view(session_id, SessionView())
+
+    def load_session_view(self, session_id: str, view: SessionView) -> Optional[Session]:
+        """Load part of a session, reading only the rows the view selects."""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT data, iteration_count FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        data = json.loads(row[0])
+        data['agents'] = [
+            json.loads(agent_data)
+            for (agent_data,) in conn.execute(
+                "SELECT data FROM agents WHERE session_id = ? ORDER BY position", (session_id,)
+            )
+        ]
+
+        first, last = view.iteration_range(row[1])
+        iterations = {}
+        for position, number, guidance, summary, header in conn.execute(
+            """
+            SELECT position, iteration_number, user_guidance, summary, data
+            FROM iterations
+            WHERE session_id = ? AND iteration_number BETWEEN ? AND ?
+            ORDER BY position
+            """,
+            (session_id, first, last)
+        ):
+            # Rows written before the data column only have the number and guidance
+            header = json.loads(header) if header else {"iteration_number": number, "user_guidance": guidance}
+            iterations[position] = {
+                **header,
+                "messages": [],
+                "summary": json.loads(summary) if summary else None
+            }
+
+        if view.include_messages and iterations:
+            for position, message_data in conn.execute(
+                """
+                SELECT iteration_position, data FROM messages
+                WHERE session_id = ? AND iteration_position BETWEEN ? AND ?
+                ORDER BY iteration_position, position
+                """,
+                (session_id, min(iterations), max(iterations))
+            ):
+                if position in iterations:
+                    iterations[position]['messages'].append(json.loads(message_data))
+
+        data['iterations'] = list(iterations.values())
+        if data.get('current_iteration') and not view.include_messages:
+            data['current_iteration']['messages'] = []
+        return Session(**data)
+
+    def list_sessions(self) -> list[SessionListItem]:
+        """List all sessions using the created_at index."""
+        return self.query_sessions(SessionQuery()).items
+
+    def query_sessions(self, query: SessionQuery) -> SessionPage:
+        """List one page of sessions with an indexed keyset query."""
+        where = []
+        params: list = []
+
+        if query.status is not None:
+            where.append("status = ?")
+            params.append(query.status.value)
+        if query.created_from is not None:
+            where.append("created_at >= ?")
+            params.append(naive_datetime(query.created_from).isoformat())
+        if query.created_to is not None:
+            where.append("created_at <= ?")
+            params.append(naive_datetime(query.created_to).isoformat())
+        if query.min_cost is not None:
+            where.append("total_cost >= ?")
+            params.append(query.min_cost)
+        if query.max_cost is not None:
+            where.append("total_cost <= ?")
+            params.append(query.max_cost)
+        if query.issue:
+            where.append("instr(lower(issue), lower(?)) > 0")
+            params.append(query.issue)
+
+        # query.sort is validated against a fixed set of column names
+        direction = "DESC" if query.order == "desc" else "ASC"
+        position = decode_cursor(query)
+        if position is not None:
+            where.append(f"({query.sort}, session_id) {'<' if query.order == 'desc' else '>'} (?, ?)")
+            params.extend(position)
+
+        sql = f"""
+            SELECT session_id, created_at, substr(issue, 1, ?), status, total_cost, iteration_count
+            FROM sessions
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY {query.sort} {direction}, session_id {direction}
+        """
+        params.insert(0, ISSUE_PREVIEW_CHARS)
+        if query.limit is not None:
+            sql += " LIMIT ?"
+            params.append(query.limit + 1)
+
+        rows = self._connect().execute(sql, params).fetchall()
+
+        next_cursor = None
+        if query.limit is not None and len(rows) > query.limit:
+            rows = rows[:query.limit]
+            columns = {"created_at": 1, "total_cost": 4, "iteration_count": 5}
+            next_cursor = encode_cursor(query, rows[-1][columns[query.sort]], rows[-1][0])
+
+        items = [
+            SessionListItem(
+                session_id=session_id,
+                created_at=created_at,
+                issue=issue,
+                status=status,
+                total_cost=total_cost,
+                iteration_count=iteration_count
+            )
+            for session_id, created_at, issue, status, total_cost, iteration_count in rows
+        ]
+
+        return SessionPage(items=items, next_cursor=next_cursor)
+
+    def delete_session(self, session_id: str) -> bool:
+        """Delete a session and everything that belongs to it."""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self.search_index.remove_session(session_id)
+        return cursor.rowcount > 0
+
+    def close(self) -> None:
+        """Close every connection opened by this store."""
+        self.search_index.close()
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
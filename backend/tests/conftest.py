@@ -81,6 +81,7 @@ def mock_litellm_response():
             self.message = type('obj', (object,), {
                 'content': '{"agents": [{"role": "Analyst", "style": "data-driven", "model": "gpt-4o"}], "rationale": "Test rationale"}'
             })()
+            self.finish_reason = "stop"
     
     class MockUsage:
         def __init__(self):
@@ -106,6 +107,7 @@ def mock_litellm_agent_response():
             self.message = type('obj', (object,), {
                 'content': 'This is a thoughtful analysis of the microservices architecture question. Based on the complexity and team size, I recommend a careful evaluation of the trade-offs.'
             })()
+            self.finish_reason = "stop"
     
     class MockUsage:
         def __init__(self):
@@ -121,3 +123,39 @@ def mock_litellm_agent_response():
     
     return MockResponse()
 
+
+@pytest.fixture
+def mock_litellm_stream():
+    """Build a fake streaming acompletion that sends text in the given pieces."""
+    from litellm import ModelResponseStream
+    from litellm.types.utils import Delta, StreamingChoices, Usage
+    
+    def make(pieces: list[str], prompt_tokens: int = 200, completion_tokens: int = 50):
+        calls = []
+        
+        async def acompletion(**params):
+            calls.append(params)
+            
+            async def chunks():
+                for piece in pieces:
+                    yield ModelResponseStream(model=params["model"], choices=[StreamingChoices(delta=Delta(content=piece))])
+                yield ModelResponseStream(
+                    model=params["model"],
+                    choices=[StreamingChoices(delta=Delta(content=None), finish_reason="stop")]
+                )
+                yield ModelResponseStream(
+                    model=params["model"],
+                    choices=[],
+                    usage=Usage(
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                        total_tokens=prompt_tokens + completion_tokens
+                    )
+                )
+            
+            return chunks()
+        
+        acompletion.calls = calls
+        return acompletion
+    
+    return make
@@ -0,0 +1,294 @@
+"""Tests for the HTTP API, through the app's own lifespan."""
+
+import asyncio
+import json
+import threading
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+import main
+from event_broker import EventBroker
+from iteration_jobs import IterationJobs
+from models import Iteration
+from session_lock import SessionLocks
+from session_manager import SessionManager
+from session_store import FileSessionStore
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """A session manager keeping sessions and locks under tmp_path."""
+    return SessionManager(FileSessionStore(str(tmp_path / "sessions")), locks=SessionLocks(str(tmp_path / "locks")))
+
+
+@pytest.fixture
+def client(manager, monkeypatch):
+    """A client for the app, started and stopped with its lifespan, over ``manager``."""
+    monkeypatch.setattr(main, "session_manager", manager)
+    monkeypatch.setattr(main, "iteration_jobs", IterationJobs(manager, workers=2))
+    monkeypatch.setattr(main.settings, "provider_warmup", False)
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+async def app(manager, monkeypatch):
+    """The app started with its lifespan on the test's event loop, over ``manager`` and a fresh broker.
+
+    For endless streams, which TestClient can't read: it only returns a
+    response once the app has finished sending it.
+    """
+    broker = EventBroker()
+    monkeypatch.setattr(main, "session_manager", manager)
+    monkeypatch.setattr(main, "iteration_jobs", IterationJobs(manager, workers=2, broker=broker))
+    monkeypatch.setattr(main, "get_event_broker", lambda: broker)
+    monkeypatch.setattr(main.settings, "provider_warmup", False)
+    async with main.lifespan(main.app):
+        yield main.app
+
+
+@pytest.fixture
+def session_id(client, manager, sample_session):
+    """A stored session's ID."""
+    manager.save_session(sample_session)
+    return sample_session.session_id
+
+
+@pytest.fixture
+def release():
+    """Iterations send a start event, hold until this is set, then send a response and complete."""
+    release = threading.Event()
+
+    async def held(session, *args, **kwargs):
+        yield {'type': 'start'}
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        yield {'type': 'agent_response', 'agent_id': 'Ray-1'}
+        session.iterations.append(Iteration(iteration_number=len(session.iterations) + 1, messages=[]))
+
+    with patch('iteration_jobs.Dana.run_iteration', new=held):
+        yield release
+    release.set()
+
+
+def parse_events(body: str) -> list[tuple]:
+    """Split an SSE body into (event ID, event) pairs, skipping comments."""
+    events = []
+    for message in body.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.splitlines() if not line.startswith(":"))
+        if "data" in fields:
+            events.append((fields.get("id"), json.loads(fields["data"])))
+    return events
+
+
+class EventStream:
+    """A GET of an SSE endpoint, read event by event straight over ASGI.
+
+    Leaving the ``async with`` disconnects, which ends the response.
+    """
+
+    def __init__(self, app, path: str):
+        self.app = app
+        self.path = path
+        self.status = None
+        self._messages = asyncio.Queue()
+        self._disconnected = asyncio.Event()
+        self._requested = False
+        self._buffer = ""
+
+    async def __aenter__(self):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": self.path, "raw_path": self.path.encode(),
+            "root_path": "", "query_string": b"", "headers": [(b"host", b"test")],
+            "client": ("test", 1), "server": ("test", 80)
+        }
+        self._task = asyncio.create_task(self.app(scope, self._receive, self._messages.put))
+        self.status = (await asyncio.wait_for(self._messages.get(), 5))["status"]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._disconnected.set()
+        await asyncio.wait_for(self._task, 5)
+
+    async def _receive(self) -> dict:
+        if not self._requested:
+            self._requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self._disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def next_event(self) -> tuple:
+        """Wait for the next event's (event ID, event)."""
+        while True:
+            while "\n\n" in self._buffer:
+                message, self._buffer = self._buffer.split("\n\n", 1)
+                events = parse_events(message)
+                if events:
+                    return events[0]
+            message = await asyncio.wait_for(self._messages.get(), 5)
+            self._buffer += message.get("body", b"").decode()
+
+
+async def wait_for_subscribers(broker: EventBroker, session_id: str, count: int) -> None:
+    """Wait until a session has ``count`` watchers."""
+    async with asyncio.timeout(5):
+        while broker.subscriber_count(session_id) != count:
+            await asyncio.sleep(0.01)
+
+
+class TestSessionConflicts:
+    """Test that requests on a session busy with an iteration get 409."""
+
+    @pytest.fixture
+    def running(self, client, session_id, release):
+        """A job holding ``session_id``'s lock until ``release`` is set."""
+        response = client.post(f"/sessions/{session_id}/jobs", json={"session_id": session_id})
+        assert response.status_code == 202
+        return response.json()
+
+    def test_duplicate_iterate_rejected(self, client, session_id, running, release):
+        """Test that a second iteration of a running session is refused, and allowed once it's done."""
+        for path in ("iterate", "iterate/stream", "jobs"):
+            response = client.post(f"/sessions/{session_id}/{path}", json={"session_id": session_id})
+            assert response.status_code == 409
+
+        release.set()
+        client.get(f"/jobs/{running['job_id']}/stream")  # Ends with the job
+        response = client.post(f"/sessions/{session_id}/iterate", json={"session_id": session_id})
+        assert response.status_code == 200
+        assert len(response.json()["iterations"]) == 2
+
+    def test_delete_and_complete_rejected(self, client, manager, session_id, running, release):
+        """Test that a running iteration's session can't be deleted or completed under it."""
+        assert client.delete(f"/sessions/{session_id}").status_code == 409
+        assert client.post(f"/sessions/{session_id}/complete").status_code == 409
+
+        release.set()
+        client.get(f"/jobs/{running['job_id']}/stream")
+        assert manager.load_session(session_id) is not None
+        assert client.delete(f"/sessions/{session_id}").status_code == 200
+        assert client.get(f"/sessions/{session_id}").status_code == 404
+
+
+class TestIterationJobs:
+    """Test starting iterations as jobs and following them over HTTP."""
+
+    def test_job_start(self, client, session_id, release):
+        """Test that a job is returned at once, streams numbered events and ends with the iteration."""
+        response = client.post(f"/sessions/{session_id}/jobs", json={"session_id": session_id})
+        assert response.status_code == 202
+        job = response.json()
+        assert job["session_id"] == session_id
+        assert job["status"] in ("queued", "running")
+        assert client.get(f"/sessions/{session_id}/job").json()["job_id"] == job["job_id"]
+
+        release.set()
+        response = client.get(f"/jobs/{job['job_id']}/stream")
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_events(response.text)
+        assert [event["type"] for _, event in events] == ["start", "agent_response", "complete"]
+        assert [event_id for event_id, _ in events] == ["0", "1", "2"]
+        assert len(events[-1][1]["session"]["iterations"]) == 1
+
+        job = client.get(f"/jobs/{job['job_id']}").json()
+        assert job["status"] == "completed"
+        assert job["iteration"]["iteration_number"] == 1
+        assert client.get("/admin/jobs").json()["completed"] == 1
+
+    def test_iterate_stream(self, client, session_id, release):
+        """Test that a streamed iteration names its job, which can be looked up afterwards."""
+        release.set()
+        response = client.post(f"/sessions/{session_id}/iterate/stream", json={"session_id": session_id})
+        assert response.status_code == 200
+        assert [event["type"] for _, event in parse_events(response.text)] == ["start", "agent_response", "complete"]
+        assert client.get(f"/jobs/{response.headers['x-job-id']}").json()["status"] == "completed"
+
+    def test_resume_from_last_event_id(self, client, session_id, release):
+        """Test that a reconnecting client gets only the events after its Last-Event-ID."""
+        release.set()
+        job_id = client.post(f"/sessions/{session_id}/jobs", json={"session_id": session_id}).json()["job_id"]
+        everything = parse_events(client.get(f"/jobs/{job_id}/stream").text)
+
+        response = client.get(f"/jobs/{job_id}/stream", headers={"Last-Event-ID": "0"})
+        assert parse_events(response.text) == everything[1:]
+        response = client.get(f"/jobs/{job_id}/stream", headers={"Last-Event-ID": "2"})
+        assert parse_events(response.text) == []
+        assert client.get(f"/jobs/{job_id}/stream", headers={"Last-Event-ID": "abc"}).status_code == 400
+
+    def test_unknown_job(self, client):
+        """Test that unknown jobs get 404."""
+        assert client.get("/jobs/nope").status_code == 404
+        assert client.get("/jobs/nope/stream").status_code == 404
+
+    def test_stream_refused_before_streaming(self, client, manager, session_id, sample_session, release):
+        """Test that iterations that can't start get an HTTP error, not an error event."""
+        body = {"session_id": session_id}
+        response = client.post("/sessions/nope/iterate/stream", json=body)
+        assert response.status_code == 404
+        assert response.headers["content-type"] == "application/json"
+
+        sample_session.budget.used = sample_session.budget.total_budget
+        manager.save_session(sample_session)
+        response = client.post(f"/sessions/{session_id}/iterate/stream", json=body)
+        assert response.status_code == 400
+        assert response.json()["detail"].startswith("Budget exceeded")
+        assert manager.load_session(session_id).status == "paused"
+        assert client.get(f"/sessions/{session_id}/job").status_code == 404
+
+        # Not spent, but too little left for the summary
+        release.set()
+        sample_session.budget.used = sample_session.budget.total_budget - 0.0001
+        sample_session.status = "active"
+        manager.save_session(sample_session)
+        assert client.post(f"/sessions/{session_id}/iterate", json=body).status_code == 400
+        assert manager.load_session(session_id).iterations == []
+
+
+class TestWatchers:
+    """Test following a session's live events from several viewers at once."""
+
+    async def test_two_viewers(self, app, manager, sample_session, release):
+        """Test that two viewers of a session both get every event of its job, tagged with the job."""
+        manager.save_session(sample_session)
+        session_id = sample_session.session_id
+        broker = main.get_event_broker()
+        transport = httpx.ASGITransport(app=app)
+        async with (
+            EventStream(app, f"/sessions/{session_id}/events") as first,
+            EventStream(app, f"/sessions/{session_id}/events") as second,
+            httpx.AsyncClient(transport=transport, base_url="http://test") as client
+        ):
+            assert (first.status, second.status) == (200, 200)
+            await wait_for_subscribers(broker, session_id, 2)
+            assert (await client.get("/admin/events")).json()["subscribers"] == 2
+
+            response = await client.post(f"/sessions/{session_id}/jobs", json={"session_id": session_id})
+            job_id = response.json()["job_id"]
+            release.set()
+            for viewer in (first, second):
+                events = [await viewer.next_event() for _ in range(3)]
+                assert [event_id for event_id, _ in events] == [f"{job_id}:{n}" for n in range(3)]
+                assert [event["type"] for _, event in events] == ["start", "agent_response", "complete"]
+
+        await wait_for_subscribers(broker, session_id, 0)
+
+    async def test_unknown_session(self, app):
+        """Test that watching an unknown session gets 404."""
+        async with EventStream(app, "/sessions/nope/events") as stream:
+            assert stream.status == 404
+
+
+class TestSearchEndpoint:
+    """Test full-text search over HTTP."""
+
+    def test_search(self, client, session_id):
+        """Test that hits point at the session, and queries without terms get 400."""
+        response = client.get("/sessions/search", params={"q": "microservices"})
+        assert response.status_code == 200
+        assert [(hit["session_id"], hit["kind"]) for hit in response.json()] == [(session_id, "issue")]
+
+        assert client.get("/sessions/search", params={"q": "nothing-like-this"}).json() == []
+        assert client.get("/sessions/search", params={"q": '"" *'}).status_code == 400
+        assert client.get("/sessions/search").status_code == 422
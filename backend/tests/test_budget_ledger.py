@@ -0,0 +1,318 @@
+"""Tests for reserving budget ahead of LLM calls."""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+from budget_ledger import (
+    BudgetExceeded, BudgetLedger, GenerationCutOff, SpendMeter, affordable_output_tokens, estimate_cost
+)
+from models import BudgetInfo, SessionStatus, TurnMode
+from orchestrator import Dana, Ray
+from resilience import abandoned_cost
+
+
+def params(model: str = "gpt-4o", **extra) -> dict:
+    """Completion params for a short prompt."""
+    return {"model": model, "messages": [{"role": "user", "content": "Should we adopt microservices?"}], **extra}
+
+
+class TestEstimateCost:
+    """Test worst-case cost estimates."""
+
+    def test_registry_prices(self):
+        """Test that the prompt and the output cap are priced from the model registry."""
+        estimate = estimate_cost(params(max_tokens=500))
+        prompt_cost = estimate - 500 * 15.00 / 1_000_000  # gpt-4o output at $15/1M
+
+        assert 0 < prompt_cost < 100 * 5.00 / 1_000_000
+        assert estimate_cost(params(max_completion_tokens=500)) == pytest.approx(estimate)
+        assert estimate_cost(params(max_tokens=500), extra_prompt_tokens=1000) == pytest.approx(estimate + 1000 * 5.00 / 1_000_000)
+
+    def test_uncapped_calls(self):
+        """Test that calls without an output cap assume the default output."""
+        with patch('budget_ledger.get_settings') as settings:
+            settings.return_value.budget_default_output_tokens = 2000
+            assert estimate_cost(params()) == pytest.approx(estimate_cost(params(max_tokens=2000)))
+
+    def test_unpriced_model(self):
+        """Test that models with no known price can't be estimated."""
+        assert estimate_cost(params("no-such-model", max_tokens=500)) == 0.0
+
+    def test_abandoned_calls_priced_like_reservations(self):
+        """Test that a hedged or timed-out call's prompt is charged at the ledger's prices."""
+        assert abandoned_cost(params(max_tokens=500)) == pytest.approx(estimate_cost(params(max_tokens=500)) - 500 * 15.00 / 1_000_000)
+        assert abandoned_cost(params("no-such-model")) == 0.0
+
+
+class TestSpendMeter:
+    """Test metering streamed output."""
+
+    @pytest.fixture
+    def prompt_tokens(self):
+        """Prompts count as 1000 tokens ($0.005 on gpt-4o)."""
+        with patch('budget_ledger.count_prompt_tokens', return_value=1000):
+            yield
+
+    def test_affordable_output(self, prompt_tokens):
+        """Test that the output a sum buys is what's left after the prompt, at the output price."""
+        assert affordable_output_tokens(params(), 0.005 + 200 * 15.00 / 1_000_000) in (199, 200)
+        assert affordable_output_tokens(params(), 0.001) == 0
+        assert affordable_output_tokens(params("no-such-model"), 1.0) is None
+
+    def test_cuts_off_over_the_limit(self, prompt_tokens):
+        """Test that output is counted as it arrives and stopped once it costs too much."""
+        meter = SpendMeter(params(), lambda: 0.005 + 10 * 15.00 / 1_000_000)
+
+        for _ in range(5):
+            meter.feed("abcdefgh")  # Two tokens each
+        assert meter.output_tokens == 10
+
+        with pytest.raises(GenerationCutOff):
+            meter.feed("x")
+        assert meter.text == "abcdefgh" * 5 + "x"
+        assert meter.cost == pytest.approx(0.005 + 11 * 15.00 / 1_000_000)
+
+    def test_unpriced_models_not_metered(self):
+        """Test that models with no known price run unmetered."""
+        meter = SpendMeter(params("no-such-model"), lambda: 0.0)
+        meter.feed("a" * 1000)
+        assert meter.cost == 0.0
+
+
+class TestBudgetLedger:
+    """Test reserving, settling and releasing."""
+
+    @pytest.fixture
+    def ledger(self):
+        """A ledger over a $1 budget with $0.20 spent."""
+        return BudgetLedger(BudgetInfo(total_budget=1.0, used=0.2, remaining=0.8))
+
+    def test_reserve_and_settle(self, ledger):
+        """Test that a hold is replaced by the actual cost."""
+        reservation = ledger.reserve(0.5, "Ray-1")
+        assert ledger.budget.reserved == pytest.approx(0.5)
+        assert ledger.available == pytest.approx(0.3)
+
+        ledger.settle(reservation, 0.1)
+        assert ledger.budget.reserved == 0
+        assert ledger.budget.used == pytest.approx(0.3)
+        assert ledger.budget.remaining == pytest.approx(0.7)
+
+        ledger.release(reservation)  # Already settled
+        ledger.settle(reservation, 0.1)
+        assert ledger.budget.used == pytest.approx(0.3)
+
+        released = ledger.reserve(0.2, "Ray-2")
+        ledger.release(released)
+        ledger.settle(released, 0.1)
+        assert ledger.budget.used == pytest.approx(0.3)
+
+    def test_settle_without_reservation(self, ledger):
+        """Test that a call that held nothing (e.g. an unpriced model) is still charged."""
+        ledger.settle(None, 0.1)
+        assert ledger.budget.used == pytest.approx(0.3)
+
+    def test_refuses_what_does_not_fit(self, ledger):
+        """Test that holds can't add up to more than is left."""
+        ledger.reserve(0.5, "Ray-1")
+
+        with pytest.raises(BudgetExceeded):
+            ledger.reserve(0.4, "Ray-2")
+        assert ledger.budget.rejected_calls == 1
+        assert ledger.budget.reserved == pytest.approx(0.5)
+
+        ledger.reserve(0.3, "Ray-3")
+
+    def test_release(self, ledger):
+        """Test that releasing frees a hold without charging anything."""
+        reservation = ledger.reserve(0.5, "Ray-1")
+        ledger.release(reservation)
+
+        assert ledger.budget.reserved == 0
+        assert ledger.budget.used == pytest.approx(0.2)
+
+    def test_stale_holds_are_dropped(self):
+        """Test that a new ledger doesn't inherit holds from an interrupted run."""
+        budget = BudgetInfo(total_budget=1.0, used=0.0, remaining=1.0, reserved=0.6)
+        assert BudgetLedger(budget).available == pytest.approx(1.0)
+
+
+class TestBudgetedCalls:
+    """Test reservations on Ray and Dana's calls."""
+
+    @pytest.fixture
+    def session(self, sample_session, sample_agent_config):
+        """A session with three gpt-4o agents and a $0.35 budget."""
+        sample_session.agents = [
+            sample_agent_config.model_copy(update={"id": f"Ray-{idx}"}) for idx in range(1, 4)
+        ]
+        sample_session.budget = BudgetInfo(total_budget=0.35, used=0.0, remaining=0.35)
+        return sample_session
+
+    @pytest.fixture
+    def calls(self, mock_litellm_response, mock_litellm_agent_response):
+        """Every call worst-cases at $0.10 and costs $0.01; records which models were called."""
+        made = []
+
+        async def acompletion(**params):
+            made.append(params["model"])
+            await asyncio.sleep(0.01)  # Let concurrent calls overlap
+            return mock_litellm_response if params["model"] == "gpt-5.1" else mock_litellm_agent_response
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.01), \
+             patch('orchestrator.estimate_cost', return_value=0.10):
+            yield made
+
+    @pytest.mark.asyncio
+    async def test_parallel_calls_never_overcommit(self, session, calls):
+        """Test that concurrent Rays only go ahead while their worst case fits next to the summary's."""
+        events = [event async for event in Dana.run_iteration(session, turn_mode=TurnMode.PARALLEL)]
+
+        skipped = [e for e in events if e['type'] == 'agent_skipped']
+        assert len(skipped) == 1
+        assert skipped[0]['reason'] == 'budget'
+        assert calls.count("gpt-4o") == 2
+        assert calls.count("gpt-5.1") == 1  # The summary was still made
+
+        iteration = session.iterations[0]
+        assert len(iteration.messages) == 2
+        assert iteration.skipped_agents == [skipped[0]['agent_id']]
+        assert iteration.summary.cost == pytest.approx(0.01)
+
+        budget = session.budget
+        assert budget.used == pytest.approx(0.03)
+        assert budget.reserved == 0
+        assert budget.rejected_calls == 1
+
+    @pytest.mark.asyncio
+    async def test_no_turns_without_room_for_the_summary(self, session, calls):
+        """Test that an iteration is refused, adding nothing, if its summary couldn't be paid for."""
+        session.budget.used = 0.3
+        assert not Dana.can_afford_iteration(session)
+
+        events = [event async for event in Dana.run_iteration(session)]
+
+        assert [event['type'] for event in events] == ['start', 'budget_exceeded']
+        assert calls == []
+        assert session.budget.used == pytest.approx(0.3)
+        assert session.iterations == []
+        assert session.current_iteration is None
+        assert session.status == SessionStatus.PAUSED
+
+    @pytest.mark.asyncio
+    async def test_rejected_ray_makes_no_call(self, session, calls):
+        """Test that a Ray whose worst case doesn't fit isn't sent."""
+        ledger = BudgetLedger(session.budget)
+        ledger.reserve(0.3, "Ray-2")
+
+        message = await Ray.speak(session.agents[0], session, 1, [], ledger=ledger)
+
+        assert message.budget_rejected
+        assert message.cost == 0.0
+        assert calls == []
+        assert session.budget.reserved == pytest.approx(0.3)
+
+    @pytest.mark.asyncio
+    async def test_errors_release_the_hold(self, session, calls):
+        """Test that a failed call frees its reservation."""
+        ledger = BudgetLedger(session.budget)
+
+        async def failing(**params):
+            raise ValueError("Bad request")
+
+        with patch('orchestrator.litellm.acompletion', new=failing):
+            message = await Ray.speak(session.agents[0], session, 1, [], ledger=ledger)
+
+        assert message.content.startswith("[Error:")
+        assert session.budget.reserved == 0
+        assert session.budget.used == 0
+
+
+class TestBudgetCappedOutput:
+    """Test output caps and cut-offs near the end of the budget."""
+
+    @pytest.fixture
+    def prompt_tokens(self):
+        """Ray prompts count as 1000 tokens ($0.005 on gpt-4o)."""
+        with patch('budget_ledger.count_prompt_tokens', return_value=1000):
+            yield
+
+    def ledger(self, session, output_tokens: int) -> BudgetLedger:
+        """A ledger with room for the prompt and ``output_tokens`` tokens of gpt-4o output."""
+        total = 0.005 + output_tokens * 15.00 / 1_000_000
+        session.budget = BudgetInfo(total_budget=total, used=0.0, remaining=total)
+        return BudgetLedger(session.budget)
+
+    @pytest.mark.asyncio
+    async def test_cap_shrinks_with_the_budget(self, sample_agent_config, sample_session, prompt_tokens, mock_litellm_agent_response):
+        """Test that a Ray asks for no more output than the budget can pay for."""
+        sent = []
+
+        async def acompletion(**params):
+            sent.append(params)
+            return mock_litellm_agent_response
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.001):
+            message = await Ray.speak(sample_agent_config, sample_session, 1, [], ledger=self.ledger(sample_session, 200))
+            assert 190 <= sent[0]["max_tokens"] <= 200
+            assert not message.truncated
+
+            sample_session.budget = BudgetInfo(total_budget=10.0, used=0.0, remaining=10.0)
+            await Ray.speak(sample_agent_config, sample_session, 1, [], ledger=BudgetLedger(sample_session.budget))
+            assert sent[1]["max_tokens"] == 500
+
+    @pytest.mark.asyncio
+    async def test_too_little_left_to_say_anything(self, sample_agent_config, sample_session, prompt_tokens, mock_litellm_agent_response):
+        """Test that a Ray isn't called if the budget can't pay for the minimum output."""
+        with patch('orchestrator.litellm.acompletion', new=AsyncMock(return_value=mock_litellm_agent_response)) as acompletion:
+            message = await Ray.speak(sample_agent_config, sample_session, 1, [], ledger=self.ledger(sample_session, 50))
+
+        assert message.budget_rejected
+        acompletion.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_stream_cut_off_at_the_cap(self, sample_agent_config, sample_session, prompt_tokens, mock_litellm_stream):
+        """Test that a stream running past what the budget allows is stopped and kept as truncated."""
+        # The provider ignores the output cap and sends 400 tokens
+        fake = mock_litellm_stream(["abcdefgh"] * 200)
+        ledger = self.ledger(sample_session, 150)
+        deltas = []
+
+        with patch('orchestrator.litellm.acompletion', new=fake):
+            message = await Ray.speak(sample_agent_config, sample_session, 1, [], on_delta=deltas.append, ledger=ledger)
+
+        assert message.truncated
+        assert message.content == "".join(deltas)
+        assert 140 <= message.tokens_out <= 152
+        assert message.cost == pytest.approx(sample_session.budget.used)
+        assert sample_session.budget.used <= sample_session.budget.total_budget + 2 * 15.00 / 1_000_000
+        assert sample_session.budget.reserved == 0
+        assert sample_agent_config.tokens_out == message.tokens_out
+
+    @pytest.mark.asyncio
+    async def test_stream_within_budget_untouched(self, sample_agent_config, sample_session, prompt_tokens, mock_litellm_stream):
+        """Test that a stream the budget covers runs to the end and is charged its real cost."""
+        fake = mock_litellm_stream(["Micro", "services ", "add overhead."])
+
+        with patch('orchestrator.litellm.acompletion', new=fake), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.002):
+            message = await Ray.speak(
+                sample_agent_config, sample_session, 1, [], on_delta=lambda text: None, ledger=self.ledger(sample_session, 500)
+            )
+
+        assert message.content == "Microservices add overhead."
+        assert not message.truncated
+        assert sample_session.budget.used == pytest.approx(0.002)
+
+    @pytest.mark.asyncio
+    async def test_length_stop_marks_truncated(self, sample_agent_config, sample_session, mock_litellm_agent_response):
+        """Test that a response that ran into the output cap is marked truncated."""
+        mock_litellm_agent_response.choices[0].finish_reason = "length"
+
+        with patch('orchestrator.litellm.acompletion', new=AsyncMock(return_value=mock_litellm_agent_response)), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.001):
+            message = await Ray.speak(sample_agent_config, sample_session, 1, [])
+
+        assert message.truncated
@@ -0,0 +1,208 @@
+"""Tests for the disk-backed completion cache."""
+
+import time
+import litellm
+import pytest
+from unittest.mock import patch
+from completion_cache import CompletionCache, cache_key
+from orchestrator import Dana, Ray
+
+
+def params(content: str = "Should we adopt microservices?", **overrides) -> dict:
+    """Completion params for a one-message prompt."""
+    return {"model": "gpt-4o", "messages": [{"role": "user", "content": content}], "temperature": 0.7, **overrides}
+
+
+def response(content: str = "It depends on team size.") -> litellm.ModelResponse:
+    """A completion response with usage."""
+    return litellm.ModelResponse(
+        model="gpt-4o",
+        choices=[{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        usage={"prompt_tokens": 200, "completion_tokens": 50, "total_tokens": 250}
+    )
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """An empty completion cache in a temporary directory."""
+    cache = CompletionCache(str(tmp_path / "completions.db"))
+    yield cache
+    cache.close()
+
+
+class TestCompletionCache:
+    """Test cache keys, storage, expiry and eviction."""
+
+    def test_key_normalization(self):
+        """Test that keys ignore whitespace and transport params but not sampling params or credentials."""
+        assert cache_key(params()) == cache_key(params("  Should we adopt microservices?\n"))
+        assert cache_key(params()) == cache_key(params(api_key=None, stream=True, timeout=30))
+        assert cache_key(params(api_key="sk-mine")) == cache_key(params(api_key="sk-mine", stream=True))
+        assert cache_key(params(api_key="sk-mine")) != cache_key(params(api_key="sk-other"))
+        assert cache_key(params(api_key="sk-mine")) != cache_key(params())
+        assert cache_key(params()) != cache_key(params(temperature=0.2))
+        assert cache_key(params()) != cache_key(params(model="gpt-4o-mini"))
+        assert cache_key(params()) != cache_key(params("Should we adopt a monolith?"))
+
+    def test_entries_not_shared_across_keys(self, cache):
+        """Test that a completion cached under one user's key isn't served to another, or to a caller with none."""
+        assert cache.put(params(api_key="sk-mine"), response())
+
+        assert cache.get(params(api_key="sk-mine")) is not None
+        assert cache.get(params(api_key="sk-other")) is None
+        assert cache.get(params()) is None
+
+    def test_round_trip(self, cache):
+        """Test that a cached response comes back intact."""
+        assert cache.get(params()) is None
+        assert cache.put(params(), response())
+
+        hit = cache.get(params())
+        assert hit.choices[0].message.content == "It depends on team size."
+        assert hit.usage.prompt_tokens == 200
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_persists_on_disk(self, tmp_path, cache):
+        """Test that entries survive reopening the cache."""
+        cache.put(params(), response())
+        cache.close()
+
+        reopened = CompletionCache(str(tmp_path / "completions.db"))
+        try:
+            assert reopened.get(params()).choices[0].message.content == "It depends on team size."
+        finally:
+            reopened.close()
+
+    def test_ttl(self, tmp_path):
+        """Test that entries expire."""
+        cache = CompletionCache(str(tmp_path / "completions.db"), ttl=0.05)
+        try:
+            cache.put(params(), response())
+            time.sleep(0.1)
+            assert cache.get(params()) is None
+            assert cache.stats()["entries"] == 0
+        finally:
+            cache.close()
+
+    def test_lru_eviction(self, tmp_path):
+        """Test that the least recently used entry is evicted first."""
+        cache = CompletionCache(str(tmp_path / "completions.db"), max_entries=2)
+        try:
+            cache.put(params("a"), response("A"))
+            cache.put(params("b"), response("B"))
+            time.sleep(0.01)
+            cache.get(params("a"))
+            cache.put(params("c"), response("C"))
+
+            assert cache.get(params("b")) is None
+            assert cache.get(params("a")) is not None
+            assert cache.get(params("c")) is not None
+            assert cache.stats()["evictions"] == 1
+        finally:
+            cache.close()
+
+    def test_byte_bound(self, tmp_path):
+        """Test that the store is kept within its byte limit."""
+        entry_size = len(response().model_dump_json())
+        cache = CompletionCache(str(tmp_path / "completions.db"), max_bytes=int(entry_size * 2.5))
+        try:
+            for prompt in ["a", "b", "c", "d"]:
+                cache.put(params(prompt), response())
+
+            stats = cache.stats()
+            assert stats["entries"] == 2
+            assert stats["bytes"] <= stats["max_bytes"]
+        finally:
+            cache.close()
+
+    def test_unserializable_response_is_skipped(self, cache, mock_litellm_agent_response):
+        """Test that a response that can't be stored doesn't break the call."""
+        assert not cache.put(params(), mock_litellm_agent_response)
+        assert cache.get(params()) is None
+
+
+class TestCachedCalls:
+    """Test the cache in front of Ray and Dana's calls."""
+
+    @pytest.fixture(autouse=True)
+    def enabled(self, cache):
+        """Use the temporary cache for every call."""
+        with patch('orchestrator.get_completion_cache', return_value=cache), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.01):
+            yield
+
+    async def speak(self, agent, session, **kwargs):
+        """Have the agent speak once."""
+        return await Ray.speak(agent=agent, session=session, iteration_number=1, previous_messages=[], **kwargs)
+
+    @pytest.mark.asyncio
+    async def test_repeat_call_is_free(self, sample_agent_config, sample_session):
+        """Test that an identical second call is served from the cache at no cost."""
+        calls = []
+
+        async def acompletion(**params):
+            calls.append(params)
+            return response()
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            first = await self.speak(sample_agent_config, sample_session)
+            second = await self.speak(sample_agent_config, sample_session)
+
+        assert len(calls) == 1
+        assert not first.cached
+        assert first.cost == 0.01
+        assert second.cached
+        assert second.content == first.content
+        assert second.cost == 0.0
+        assert second.tokens_in == 0
+        assert sample_agent_config.cost_used == pytest.approx(0.01)
+
+    @pytest.mark.asyncio
+    async def test_bypass(self, sample_agent_config, sample_session):
+        """Test that use_cache=False always calls the model."""
+        calls = []
+
+        async def acompletion(**params):
+            calls.append(params)
+            return response()
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            await self.speak(sample_agent_config, sample_session)
+            message = await self.speak(sample_agent_config, sample_session, use_cache=False)
+
+        assert len(calls) == 2
+        assert not message.cached
+
+    @pytest.mark.asyncio
+    async def test_streamed_hit(self, sample_agent_config, sample_session, mock_litellm_stream):
+        """Test that a cached response is streamed in one piece."""
+        stream = mock_litellm_stream(["It depends ", "on team size."])
+
+        with patch('orchestrator.litellm.acompletion', new=stream):
+            await self.speak(sample_agent_config, sample_session, on_delta=lambda text: None)
+            deltas = []
+            message = await self.speak(sample_agent_config, sample_session, on_delta=deltas.append)
+
+        assert len(stream.calls) == 1
+        assert message.cached
+        assert deltas == ["It depends on team size."]
+
+    @pytest.mark.asyncio
+    async def test_cached_proposal(self, sample_api_keys):
+        """Test that re-proposing for the same issue is served from the cache."""
+        calls = []
+        proposal = '{"agents": [{"role": "Analyst", "style": "data-driven", "model": "gpt-4o"}], "rationale": "One view"}'
+
+        async def acompletion(**params):
+            calls.append(params)
+            return response(proposal)
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            first = await Dana.propose_agents("Should we adopt microservices?", 5.0, api_keys=sample_api_keys)
+            second = await Dana.propose_agents("Should we adopt microservices?", 5.0, api_keys=sample_api_keys)
+
+        assert len(calls) == 1
+        assert not first.cached
+        assert second.cached
+        assert second.proposed_agents == first.proposed_agents
@@ -0,0 +1,161 @@
+"""Tests for token-budgeted previous-iteration context."""
+
+from datetime import datetime
+import pytest
+from unittest.mock import AsyncMock, patch
+from config import get_settings
+from context_digest import context_budget, count_tokens, update_context_digest
+from models import Iteration, IterationSummary
+from orchestrator import Dana
+from prompts import build_ray_agent_messages
+from prompts.ray_agent import build_previous_context
+
+
+def iteration(number: int, words: int = 60) -> Iteration:
+    """A finished iteration whose summary is about ``words`` words long."""
+    filler = " ".join(f"point{number}x{i}" for i in range(words))
+    return Iteration(
+        iteration_number=number,
+        messages=[],
+        user_guidance=f"Focus on cost in round {number}",
+        summary=IterationSummary(
+            iteration_number=number,
+            summary=f"Round {number} weighed team size. {filler}.",
+            key_disagreements=[f"Disagreement {number}"],
+            total_cost=0.01,
+            timestamp=datetime.now()
+        )
+    )
+
+
+def settings(**overrides):
+    """The application settings with some context settings changed."""
+    return get_settings().model_copy(update=overrides)
+
+
+@pytest.fixture
+def context_settings():
+    """Keep two iterations verbatim and fold every four digest entries."""
+    with patch('context_digest.get_settings', return_value=settings(
+        context_recent_iterations=2, context_digest_fanout=4, context_digest_entry_tokens=100
+    )):
+        yield
+
+
+def grow(session, count: int) -> None:
+    """Add iterations to a session one at a time, updating the digest as each completes."""
+    for _ in range(count):
+        session.iterations.append(iteration(len(session.iterations) + 1))
+        update_context_digest(session)
+
+
+class TestContextDigest:
+    """Test maintaining the digest of older iterations."""
+
+    def test_rolls_in_iterations_once_no_longer_recent(self, sample_session, context_settings):
+        """Test that only iterations outside the recent window are digested, once each."""
+        grow(sample_session, 2)
+        assert sample_session.context_digest.entries == []
+
+        grow(sample_session, 1)
+        digest = sample_session.context_digest
+        assert digest.through_iteration == 1
+        assert len(digest.entries) == 1
+        assert "Round 1 weighed team size." in digest.entries[0].text
+        assert "Disagreement 1" in digest.entries[0].text
+
+        assert not update_context_digest(sample_session)
+        assert len(digest.entries) == 1
+
+    def test_folds_entries_hierarchically(self, sample_session, context_settings):
+        """Test that every four entries of a level fold into one of the level above."""
+        grow(sample_session, 9)  # Iterations 1-7 are digested
+        digest = sample_session.context_digest
+        assert [e.level for e in digest.entries] == [1, 0, 0, 0]
+        assert (digest.entries[0].first_iteration, digest.entries[0].last_iteration) == (1, 4)
+
+        grow(sample_session, 9)  # Iterations 1-16
+        assert [e.level for e in digest.entries] == [2]
+        assert (digest.entries[0].first_iteration, digest.entries[0].last_iteration) == (1, 16)
+
+    def test_entries_stay_small(self, sample_session, context_settings):
+        """Test that folded entries are no longer than single-iteration ones."""
+        grow(sample_session, 40)
+
+        for entry in sample_session.context_digest.entries:
+            assert count_tokens(entry.text) <= 150
+
+    def test_budget_per_model(self):
+        """Test that the budget is capped by a share of the model's context window."""
+        with patch('context_digest.get_settings', return_value=settings(context_max_tokens=6000, context_window_share=0.25)):
+            assert context_budget("gpt-4o") == 6000
+            assert context_budget("gpt-3.5-turbo") == 4096
+            assert context_budget("unknown-model") == 2048  # Assumed 8k window
+
+
+class TestBudgetedContext:
+    """Test fitting previous iterations into a Ray's prompt."""
+
+    def test_recent_iterations_verbatim(self, sample_session, context_settings):
+        """Test that recent iterations are shown in full and older ones condensed."""
+        grow(sample_session, 5)
+
+        context = build_previous_context(sample_session, max_tokens=6000, model="gpt-4o")
+
+        assert "--- Iteration 5 ---" in context
+        assert "--- Iteration 4 ---" in context
+        assert "--- Iteration 3 ---" not in context
+        assert "Iteration 3: " in context
+        assert context.index("EARLIER ITERATIONS") < context.index("PREVIOUS ITERATIONS CONTEXT")
+
+    def test_tight_budget_condenses_then_drops(self, sample_session, context_settings):
+        """Test that over-budget iterations are condensed and the oldest left out."""
+        grow(sample_session, 12)
+
+        context = build_previous_context(sample_session, max_tokens=250, model="gpt-4o")
+
+        assert count_tokens(context) <= 300
+        assert "left out for length" in context
+        assert "Iteration 12" in context
+
+    def test_prompt_size_stays_flat(self, sample_agent_config, sample_session, context_settings):
+        """Test that input tokens per turn level off however many iterations there are."""
+        def prompt_tokens():
+            messages = build_ray_agent_messages(
+                sample_agent_config, sample_session, len(sample_session.iterations) + 1, [], max_context_tokens=1500
+            )
+            return count_tokens(messages[0]["content"] + messages[1]["content"])
+
+        grow(sample_session, 10)
+        at_10 = prompt_tokens()
+        grow(sample_session, 30)
+        at_40 = prompt_tokens()
+        grow(sample_session, 60)
+        at_100 = prompt_tokens()
+
+        assert at_10 < at_40  # Still filling the budget
+        assert at_40 < 2000
+        assert abs(at_100 - at_40) <= at_40 * 0.1
+
+    def test_no_budget_keeps_everything(self, sample_session, context_settings):
+        """Test that without a budget every iteration appears, digested or not."""
+        grow(sample_session, 6)
+
+        context = build_previous_context(sample_session)
+
+        assert "left out" not in context
+        for number in range(1, 7):
+            assert f"Iteration {number}" in context
+
+    @pytest.mark.asyncio
+    async def test_run_iteration_updates_digest(self, sample_session, context_settings, mock_litellm_agent_response):
+        """Test that completing an iteration rolls older ones into the digest."""
+        grow(sample_session, 2)
+
+        with patch('orchestrator.litellm.acompletion', new=AsyncMock(return_value=mock_litellm_agent_response)), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.01):
+            async for _ in Dana.run_iteration(sample_session):
+                pass
+
+        assert len(sample_session.iterations) == 3
+        assert sample_session.context_digest.through_iteration == 1
@@ -1,9 +1,14 @@
 """Tests for Dana orchestrator functionality."""
 
+import asyncio
+import time
+import litellm
 import pytest
 from unittest.mock import AsyncMock, patch
 from orchestrator import Dana
-from models import ApiKeys
+from models import ApiKeys, TurnMode
+from config import CallLimits
+from scheduler import CallScheduler
 
 
 class TestDana:
@@ -132,3 +137,186 @@ class TestDana:
             assert summary.suggested_direction is not None
             assert summary.total_cost >= 0
 
+
+
+class TestRunIteration:
+    """Test running a whole iteration in each turn mode."""
+    
+    @pytest.fixture
+    def session(self, sample_session, sample_agent_config):
+        """A session with three agents whose models answer at different speeds."""
+        # Load the tokenizer up front so its one-off cost doesn't skew timings
+        litellm.token_counter(model="gpt-5.1", messages=[{"role": "user", "content": "Hi"}])
+        sample_session.agents = [
+            sample_agent_config.model_copy(update={"id": f"Ray-{idx}", "model": model})
+            for idx, model in enumerate(["slow-model", "fast-model", "medium-model"], 1)
+        ]
+        return sample_session
+    
+    @pytest.fixture
+    def fake_completion(self, mock_litellm_response, mock_litellm_agent_response):
+        """acompletion stand-in that records prompts and sleeps per model."""
+        delays = {"slow-model": 0.3, "medium-model": 0.2, "fast-model": 0.1}
+        prompts = {}
+        
+        async def acompletion(**params):
+            if params["model"] not in delays:
+                return mock_litellm_response  # Dana's summary
+            prompts[params["model"]] = params["messages"][-1]["content"]
+            await asyncio.sleep(delays[params["model"]])
+            return mock_litellm_agent_response
+        
+        acompletion.prompts = prompts
+        return acompletion
+    
+    async def run(self, session, turn_mode, stream_tokens=False):
+        """Run an iteration and collect its events."""
+        with patch('orchestrator.litellm.completion_cost', return_value=0.01):
+            iteration = Dana.run_iteration(session, "Go deeper", turn_mode=turn_mode, stream_tokens=stream_tokens)
+            return [event async for event in iteration]
+    
+    @pytest.mark.asyncio
+    async def test_parallel_mode_runs_rays_concurrently(self, session, fake_completion):
+        """Test that parallel turns overlap and report in completion order."""
+        with patch('orchestrator.litellm.acompletion', new=fake_completion):
+            started = time.monotonic()
+            events = await self.run(session, TurnMode.PARALLEL)
+            elapsed = time.monotonic() - started
+        
+        assert elapsed < 0.5  # Sequential would take 0.6s
+        responses = [e['message']['agent_id'] for e in events if e['type'] == 'agent_response']
+        assert responses == ["Ray-2", "Ray-3", "Ray-1"]
+        assert [m.agent_id for m in session.iterations[0].messages] == responses
+        
+        # Each Ray only saw previous iterations, not the others in this round
+        assert all("Conversation so far" not in p for p in fake_completion.prompts.values())
+        assert session.budget.used == pytest.approx(0.04)  # Three Rays and Dana's summary
+        assert session.budget.remaining == pytest.approx(session.budget.total_budget - 0.04)
+        assert session.budget.reserved == 0
+        assert session.iterations[0].user_guidance == "Go deeper"
+    
+    @pytest.mark.asyncio
+    async def test_sequential_mode_is_default(self, session, fake_completion):
+        """Test that sequential turns see earlier messages of the same iteration."""
+        with patch('orchestrator.litellm.acompletion', new=fake_completion), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.01):
+            events = [event async for event in Dana.run_iteration(session)]
+        
+        assert events[0]['turn_mode'] == "sequential"
+        assert sum("Conversation so far" in p for p in fake_completion.prompts.values()) == 2
+        assert events[-1]['type'] == 'summarizing'
+        assert len(session.iterations) == 1
+    
+    @pytest.mark.asyncio
+    async def test_parallel_mode_respects_exhausted_budget(self, session, fake_completion):
+        """Test that no Ray is called once the budget is spent."""
+        session.budget.used = session.budget.total_budget
+        with patch('orchestrator.litellm.acompletion', new=fake_completion):
+            events = await self.run(session, TurnMode.PARALLEL)
+        
+        assert events[1]['type'] == 'budget_exceeded'
+        assert fake_completion.prompts == {}
+
+    
+    @pytest.mark.asyncio
+    async def test_stream_tokens(self, session, mock_litellm_stream):
+        """Test that agent and summary text is streamed as deltas."""
+        summary_json = '{"summary": "Rays split on \\"cost\\"\\n\\u00e9", "key_disagreements": []}'
+        pieces = [summary_json[i:i + 7] for i in range(0, len(summary_json), 7)]
+        agent_stream = mock_litellm_stream(["Hello ", "there"])
+        summary_stream = mock_litellm_stream(pieces)
+        
+        async def acompletion(**params):
+            if params["model"] == "gpt-5.1":
+                return await summary_stream(**params)
+            return await agent_stream(**params)
+        
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            events = await self.run(session, TurnMode.PARALLEL, stream_tokens=True)
+        
+        agent_deltas = [e for e in events if e['type'] == 'agent_delta']
+        assert len(agent_deltas) == 6
+        assert "".join(e['delta'] for e in agent_deltas if e['agent_id'] == "Ray-1") == "Hello there"
+        
+        summary = "".join(e['delta'] for e in events if e['type'] == 'summary_delta')
+        assert summary == 'Rays split on "cost"\n\u00e9'
+        assert session.iterations[0].summary.summary == summary
+        assert all(m.content == "Hello there" for m in session.iterations[0].messages)
+    
+    @pytest.mark.asyncio
+    async def test_parallel_mode_reports_queued_calls(self, session, fake_completion):
+        """Test that Rays held back by a concurrency cap queue and say so."""
+        for agent in session.agents:
+            agent.model = "gpt-4o"
+        scheduler = CallScheduler(model_limits={"gpt-4o": CallLimits(concurrency=1)})
+        
+        async def acompletion(**params):
+            params["model"] = "fast-model" if params["model"] == "gpt-4o" else params["model"]
+            return await fake_completion(**params)
+        
+        with patch('orchestrator.litellm.acompletion', new=acompletion), \
+             patch('orchestrator.get_scheduler', return_value=scheduler):
+            events = await self.run(session, TurnMode.PARALLEL)
+        
+        queued = [e for e in events if e['type'] == 'queued']
+        dequeued = [e for e in events if e['type'] == 'dequeued']
+        assert len(queued) == 2
+        assert {e['agent_id'] for e in queued} == {e['agent_id'] for e in dequeued}
+        assert all(e['waited'] >= 0.05 for e in dequeued)
+        assert len(session.iterations[0].messages) == 3
+        assert scheduler.stats()["models"]["gpt-4o"]["calls"] == 3
+    
+    @pytest.mark.asyncio
+    async def test_agent_timeout_lets_round_go_on(self, session, fake_completion):
+        """Test that slow Rays are marked timed out while the rest of the round completes."""
+        with patch('orchestrator.litellm.acompletion', new=fake_completion), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.01):
+            started = time.monotonic()
+            events = [event async for event in Dana.run_iteration(session, turn_mode=TurnMode.PARALLEL, agent_timeout=0.15)]
+            elapsed = time.monotonic() - started
+        
+        assert elapsed < 0.3
+        assert {e['message']['agent_id'] for e in events if e['type'] == 'agent_timeout'} == {"Ray-1", "Ray-3"}
+        assert [e['message']['agent_id'] for e in events if e['type'] == 'agent_response'] == ["Ray-2"]
+        
+        iteration = session.iterations[0]
+        assert [m.timed_out for m in iteration.messages] == [False, True, True]
+        assert iteration.summary is not None
+        assert session.budget.used == pytest.approx(0.02)  # Ray-2 and Dana's summary
+    
+    @pytest.mark.asyncio
+    async def test_deadline_skips_rays_not_reached(self, session, fake_completion):
+        """Test that sequential Rays not reached before the deadline are skipped."""
+        with patch('orchestrator.litellm.acompletion', new=fake_completion), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.01), \
+             patch('orchestrator.random.shuffle'):  # Keep the slow Ray first
+            started = time.monotonic()
+            events = [event async for event in Dana.run_iteration(session, deadline=0.5)]
+            elapsed = time.monotonic() - started
+        
+        # Half the deadline is kept for the summary, so the slow Ray gets 0.25s
+        assert elapsed < 0.5
+        assert [e['message']['agent_id'] for e in events if e['type'] == 'agent_timeout'] == ["Ray-1"]
+        assert [e['agent_id'] for e in events if e['type'] == 'agent_skipped'] == ["Ray-2", "Ray-3"]
+        
+        iteration = session.iterations[0]
+        assert iteration.skipped_agents == ["Ray-2", "Ray-3"]
+        assert len(iteration.messages) == 1
+        assert iteration.summary is not None
+    
+    @pytest.mark.asyncio
+    async def test_summary_timeout_falls_back(self, sample_session):
+        """Test that a summary that misses its time falls back instead of hanging."""
+        from models import Iteration
+        
+        async def slow_completion(**params):
+            await asyncio.sleep(1.0)
+        
+        with patch('orchestrator.litellm.acompletion', new=slow_completion):
+            started = time.monotonic()
+            summary = await Dana.summarize_iteration(
+                sample_session, Iteration(iteration_number=1, messages=[]), timeout=0.05
+            )
+        
+        assert time.monotonic() - started < 0.5
+        assert summary.summary == "Error generating summary."
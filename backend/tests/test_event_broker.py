@@ -0,0 +1,159 @@
+"""Tests for fanning live iteration events out to viewers."""
+
+import asyncio
+import time
+import pytest
+from unittest.mock import patch
+from event_broker import EventBroker
+from iteration_jobs import IterationJobs
+from models import ContinueSessionRequest, Iteration
+from session_lock import SessionLocks
+from session_manager import SessionManager
+from session_store import FileSessionStore
+
+
+def delta(text: str) -> dict:
+    """A streamed text event."""
+    return {'type': 'agent_delta', 'agent_id': 'Ray-1', 'delta': text}
+
+
+def response(number: int) -> dict:
+    """A finished turn event."""
+    return {'type': 'agent_response', 'number': number}
+
+
+async def drain(subscription) -> list:
+    """Everything queued on a subscription."""
+    items = []
+    while (item := await subscription.get(timeout=0)) is not None:
+        items.append(item)
+    return items
+
+
+class TestEventBroker:
+    """Test subscriptions and their bounded queues."""
+
+    @pytest.mark.asyncio
+    async def test_every_subscriber_gets_every_event(self):
+        """Test that one publish reaches all of a topic's subscribers, in order, and no one else."""
+        broker = EventBroker(max_events=10)
+        first, second = broker.subscribe("anj-1"), broker.subscribe("anj-1")
+        other = broker.subscribe("anj-2")
+
+        for number in range(3):
+            broker.publish("anj-1", f"job:{number}", response(number))
+
+        expected = [(f"job:{number}", response(number)) for number in range(3)]
+        assert await drain(first) == expected
+        assert await drain(second) == expected
+        assert await drain(other) == []
+
+    @pytest.mark.asyncio
+    async def test_waits_for_the_next_event(self):
+        """Test that a subscriber is woken by a publish and times out without one."""
+        broker = EventBroker(max_events=10)
+        subscription = broker.subscribe("anj-1")
+
+        assert await subscription.get(timeout=0.01) is None
+
+        waiting = asyncio.create_task(subscription.get(timeout=1))
+        await asyncio.sleep(0)
+        broker.publish("anj-1", "job:0", response(0))
+        assert await waiting == ("job:0", response(0))
+
+    @pytest.mark.asyncio
+    async def test_deltas_dropped_first(self):
+        """Test that a full queue makes room by dropping text deltas, keeping whole turns."""
+        broker = EventBroker(max_events=4)
+        subscription = broker.subscribe("anj-1")
+
+        for event in [delta("a"), response(1), delta("b"), delta("c"), response(2), response(3)]:
+            broker.publish("anj-1", None, event)
+
+        assert [event for _, event in await drain(subscription)] == [response(1), delta("c"), response(2), response(3)]
+        assert subscription.dropped == 2
+        assert subscription.lagged == 0
+
+    @pytest.mark.asyncio
+    async def test_lagging_subscriber_skips_ahead(self):
+        """Test that a subscriber with a queue full of turns is told what it missed and goes on live."""
+        broker = EventBroker(max_events=3)
+        subscription = broker.subscribe("anj-1")
+
+        for number in range(4):
+            broker.publish("anj-1", f"job:{number}", response(number))
+
+        assert await drain(subscription) == [
+            (None, {'type': 'lagged', 'missed': 3}),
+            ("job:3", response(3))
+        ]
+        assert broker.stats()["lagging_subscribers"] == 1
+
+        # Falling behind again before reading adds to the count
+        for number in range(4, 10):
+            broker.publish("anj-1", f"job:{number}", response(number))
+        assert await drain(subscription) == [
+            (None, {'type': 'lagged', 'missed': 5}),  # 4-6, then 7-8
+            ("job:9", response(9))
+        ]
+
+    @pytest.mark.asyncio
+    async def test_slow_subscriber_does_not_slow_publishing(self):
+        """Test that publishing stays cheap and memory stays bounded with a subscriber that never reads."""
+        broker = EventBroker(max_events=100)
+        stalled = broker.subscribe("anj-1")
+
+        started = time.monotonic()
+        for number in range(20000):
+            broker.publish("anj-1", f"job:{number}", delta(str(number)) if number % 10 else response(number))
+        elapsed = time.monotonic() - started
+
+        assert elapsed < 1.0
+        assert len(stalled) <= 100
+        items = await drain(stalled)
+        assert items[0][1]['type'] == 'lagged'
+        assert broker.stats()["dropped"] == 20000 - len(items[1:])  # Every event delivered or counted as dropped
+
+    def test_unsubscribe(self):
+        """Test that unsubscribed viewers get nothing and topics without viewers are dropped."""
+        broker = EventBroker(max_events=10)
+        subscription = broker.subscribe("anj-1")
+        broker.unsubscribe(subscription)
+        broker.unsubscribe(subscription)
+
+        broker.publish("anj-1", "job:0", response(0))
+
+        assert len(subscription) == 0
+        assert broker.subscriber_count("anj-1") == 0
+        assert broker.stats()["topics"] == 0
+
+
+class TestSessionWatchers:
+    """Test that iteration jobs publish to the session's watchers."""
+
+    @pytest.mark.asyncio
+    async def test_job_events_reach_watchers(self, tmp_path, sample_session):
+        """Test that watchers see a job's events once each, tagged with the job and event number."""
+        manager = SessionManager(FileSessionStore(str(tmp_path / "sessions")), locks=SessionLocks(str(tmp_path / "locks")))
+        broker = EventBroker(max_events=100)
+        jobs = IterationJobs(manager, workers=1, broker=broker)
+        jobs.start()
+        watchers = [broker.subscribe(sample_session.session_id) for _ in range(3)]
+
+        async def iteration(session, *args, **kwargs):
+            yield {'type': 'start'}
+            yield response(1)
+            session.iterations.append(Iteration(iteration_number=1, messages=[]))
+
+        await manager.asave_session(sample_session, flush=True)
+        session = await manager.aacquire_session(sample_session.session_id)
+        with patch('iteration_jobs.Dana.run_iteration', new=iteration):
+            job = jobs.submit(session, ContinueSessionRequest(session_id=session.session_id))
+            await jobs.wait(job.job_id)
+        await jobs.aclose()
+        manager.close()
+
+        for watcher in watchers:
+            items = await drain(watcher)
+            assert [event_id for event_id, _ in items] == [f"{job.job_id}:{n}" for n in range(3)]
+            assert [event['type'] for _, event in items] == ['start', 'agent_response', 'complete']
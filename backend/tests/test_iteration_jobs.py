@@ -0,0 +1,288 @@
+"""Tests for running iterations as background jobs."""
+
+import asyncio
+import pytest
+from unittest.mock import patch
+from iteration_jobs import IterationJobs
+from models import ContinueSessionRequest, Iteration, JobStatus, SessionStatus
+from session_lock import SessionBusyError, SessionLocks
+from session_manager import SessionManager
+from session_store import FileSessionStore
+
+
+class TestIterationJobs:
+    """Test submitting, following and persisting iteration jobs."""
+
+    @pytest.fixture
+    async def jobs(self, tmp_path):
+        """A job runner with two workers over a file-backed session manager."""
+        manager = SessionManager(FileSessionStore(str(tmp_path / "sessions")), locks=SessionLocks(str(tmp_path / "locks")))
+        jobs = IterationJobs(manager, workers=2, history=3)
+        jobs.start()
+        yield jobs
+        await jobs.aclose()
+        manager.close()
+
+    @pytest.fixture
+    async def session(self, jobs, sample_session, sample_agent_config):
+        """A stored session with two agents, locked as the endpoints would before submitting."""
+        sample_session.agents = [sample_agent_config.model_copy(update={"id": f"Ray-{idx}"}) for idx in (1, 2)]
+        await jobs.session_manager.asave_session(sample_session, flush=True)
+        return await jobs.session_manager.aacquire_session(sample_session.session_id)
+
+    @pytest.fixture
+    def completion(self, mock_litellm_response, mock_litellm_agent_response):
+        """Rays take 0.1s each; ``gate`` can hold the second one back."""
+        gate = asyncio.Event()
+        gate.set()
+        calls = []
+
+        async def acompletion(**params):
+            if params["model"] == "gpt-5.1":
+                return mock_litellm_response  # Dana's summary
+            calls.append(params)
+            if len(calls) == 2:
+                await gate.wait()
+            await asyncio.sleep(0.1)
+            return mock_litellm_agent_response
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.01):
+            yield gate
+
+    def request(self, session) -> ContinueSessionRequest:
+        """A request for the next iteration."""
+        return ContinueSessionRequest(session_id=session.session_id, user_guidance="Go deeper")
+
+    @pytest.mark.asyncio
+    async def test_job_runs_in_background(self, jobs, session, completion):
+        """Test that submitting returns at once and the job completes on its own."""
+        job = jobs.submit(session, self.request(session), stream_tokens=False)
+        assert job.status == JobStatus.QUEUED
+
+        job = await asyncio.wait_for(jobs.wait(job.job_id), 5)
+
+        assert job.status == JobStatus.COMPLETED
+        assert job.turns_completed == 2
+        assert job.iteration.iteration_number == 1
+        assert jobs.latest_for_session(session.session_id).job_id == job.job_id
+
+        stored = jobs.session_manager.load_session(session.session_id)
+        assert len(stored.iterations) == 1
+        assert stored.current_iteration is None
+        assert not jobs.session_manager.locks.is_locked(session.session_id)
+
+    @pytest.mark.asyncio
+    async def test_turns_saved_as_they_land(self, jobs, session, completion):
+        """Test that a finished turn is in the store before the iteration completes."""
+        completion.clear()
+        job = jobs.submit(session, self.request(session), stream_tokens=False)
+
+        async for _, event in jobs.events(job.job_id):
+            if event['type'] == 'agent_response':
+                break
+
+        stored = jobs.session_manager.load_session(session.session_id)
+        assert len(stored.current_iteration.messages) == 1
+        assert stored.current_iteration.user_guidance == "Go deeper"
+        assert stored.budget.used == pytest.approx(0.01)
+        assert stored.iterations == []
+
+        completion.set()
+        await asyncio.wait_for(jobs.wait(job.job_id), 5)
+
+    @pytest.mark.asyncio
+    async def test_survives_disconnect_and_replays(self, jobs, session, completion):
+        """Test that a client leaving doesn't stop the job, and a late one gets every event."""
+        job = jobs.submit(session, self.request(session), stream_tokens=False)
+
+        follower = jobs.events(job.job_id)
+        first = await follower.__anext__()
+        await follower.aclose()  # The client disconnected
+
+        await asyncio.wait_for(jobs.wait(job.job_id), 5)
+        replayed = [item async for item in jobs.events(job.job_id)]
+
+        assert replayed[0] == first
+        assert replayed[0][1]['type'] == 'start'
+        assert replayed[-1][1]['type'] == 'complete'
+        assert [event_id for event_id, _ in replayed] == list(range(jobs.get(job.job_id).events))
+
+    @pytest.mark.asyncio
+    async def test_session_stays_locked_while_running(self, jobs, session, completion):
+        """Test that a second iteration can't start while a job holds the session."""
+        job = jobs.submit(session, self.request(session), stream_tokens=False)
+
+        with pytest.raises(SessionBusyError):
+            await jobs.session_manager.aacquire_session(session.session_id)
+
+        await asyncio.wait_for(jobs.wait(job.job_id), 5)
+        assert await jobs.session_manager.aacquire_session(session.session_id) is not None
+
+    @pytest.mark.asyncio
+    async def test_failed_job(self, jobs, session):
+        """Test that an error fails the job, is sent to followers and frees the session."""
+        async def broken(*args, **kwargs):
+            yield {'type': 'start'}
+            raise RuntimeError("Orchestration failed")
+
+        with patch('iteration_jobs.Dana.run_iteration', new=broken):
+            job = jobs.submit(session, self.request(session), stream_tokens=False)
+            job = await asyncio.wait_for(jobs.wait(job.job_id), 5)
+
+        assert job.status == JobStatus.FAILED
+        assert job.error == "Orchestration failed"
+        assert [event async for _, event in jobs.events(job.job_id)][-1]['type'] == 'error'
+        assert not jobs.session_manager.locks.is_locked(session.session_id)
+
+    @pytest.mark.asyncio
+    async def test_refused_for_budget(self, jobs, session, completion):
+        """Test that an iteration without room for its summary fails the job and adds nothing."""
+        session.budget.used = session.budget.total_budget - 0.0001
+        job = jobs.submit(session, self.request(session), stream_tokens=False)
+        job = await asyncio.wait_for(jobs.wait(job.job_id), 5)
+
+        assert job.status == JobStatus.FAILED
+        assert job.error.startswith("Budget exceeded")
+        events = [event['type'] async for _, event in jobs.events(job.job_id)]
+        assert events == ['start', 'budget_exceeded', 'error']
+
+        stored = jobs.session_manager.load_session(session.session_id)
+        assert stored.iterations == []
+        assert stored.current_iteration is None
+        assert stored.status == SessionStatus.PAUSED
+
+    @pytest.mark.asyncio
+    async def test_shutdown_keeps_finished_turns(self, jobs, session, completion):
+        """Test that stopping the workers cancels a running job but keeps the turns it paid for."""
+        completion.clear()
+        job = jobs.submit(session, self.request(session), stream_tokens=False)
+        async for _, event in jobs.events(job.job_id):
+            if event['type'] == 'agent_response':
+                break
+
+        await jobs.aclose()
+
+        assert jobs.get(job.job_id).status == JobStatus.CANCELLED
+        stored = jobs.session_manager.load_session(session.session_id)
+        assert stored.current_iteration is None
+        assert len(stored.iterations[0].messages) == 1
+        assert stored.iterations[0].summary.summary.startswith("Iteration interrupted")
+
+    @pytest.mark.asyncio
+    async def test_failure_keeps_paid_turns(self, jobs, session, completion):
+        """Test that turns paid for before a failure are kept, and the next iteration comes after them."""
+        with patch('orchestrator.Dana.summarize_iteration', side_effect=RuntimeError("Summary failed")):
+            job = jobs.submit(session, self.request(session), stream_tokens=False)
+            job = await asyncio.wait_for(jobs.wait(job.job_id), 5)
+        assert job.status == JobStatus.FAILED
+
+        stored = jobs.session_manager.load_session(session.session_id)
+        assert stored.current_iteration is None
+        assert len(stored.iterations) == 1
+        kept = stored.iterations[0]
+        assert len(kept.messages) == 2
+        assert kept.summary.summary == "Iteration interrupted before it was summarized: Summary failed"
+        assert kept.summary.total_cost == pytest.approx(0.02)
+        assert stored.budget.used == pytest.approx(0.02)
+
+        session = await jobs.session_manager.aacquire_session(session.session_id)
+        job = jobs.submit(session, self.request(session), stream_tokens=False)
+        job = await asyncio.wait_for(jobs.wait(job.job_id), 5)
+        assert job.iteration.iteration_number == 2
+        assert len(jobs.session_manager.load_session(session.session_id).iterations[0].messages) == 2
+
+    @pytest.mark.asyncio
+    async def test_old_jobs_forgotten(self, jobs, session):
+        """Test that only the newest finished jobs are kept."""
+        async def instant(*args, **kwargs):
+            yield {'type': 'start'}
+            raise RuntimeError("Done")
+
+        job_ids = []
+        with patch('iteration_jobs.Dana.run_iteration', new=instant):
+            for _ in range(5):
+                job = jobs.submit(session, self.request(session), stream_tokens=False)
+                job_ids.append(job.job_id)
+                await jobs.wait(job.job_id)
+                session = await jobs.session_manager.aacquire_session(session.session_id)
+
+        assert jobs.get(job_ids[0]) is None
+        assert jobs.get(job_ids[-1]) is not None
+        assert jobs.stats()["failed"] == 3
+
+
+class TestResumableEvents:
+    """Test resuming a job's event stream after the last event seen."""
+
+    @pytest.fixture
+    async def jobs(self, tmp_path):
+        """A job runner keeping only the last five events of each job."""
+        manager = SessionManager(FileSessionStore(str(tmp_path / "sessions")), locks=SessionLocks(str(tmp_path / "locks")))
+        jobs = IterationJobs(manager, workers=1, event_buffer=5)
+        jobs.start()
+        yield jobs
+        await jobs.aclose()
+        manager.close()
+
+    @pytest.fixture
+    def go(self):
+        """Iterations send a start event, wait for this, then send ``go.ticks`` tick events."""
+        go = asyncio.Event()
+        go.ticks = 2
+
+        async def ticking(session, *args, **kwargs):
+            yield {'type': 'start'}
+            await go.wait()
+            for number in range(go.ticks):
+                yield {'type': 'tick', 'number': number}
+            session.iterations.append(Iteration(iteration_number=1, messages=[]))
+
+        with patch('iteration_jobs.Dana.run_iteration', new=ticking):
+            yield go
+
+    @pytest.fixture
+    async def job_id(self, jobs, sample_session, go):
+        """A submitted job that has sent its start event (number 0)."""
+        await jobs.session_manager.asave_session(sample_session, flush=True)
+        session = await jobs.session_manager.aacquire_session(sample_session.session_id)
+        job = jobs.submit(session, ContinueSessionRequest(session_id=session.session_id))
+        async for _ in jobs.events(job.job_id):
+            break
+        return job.job_id
+
+    @pytest.mark.asyncio
+    async def test_resume_replays_only_what_was_missed(self, jobs, job_id, go):
+        """Test that resuming after an event replays just the later ones, then goes live."""
+        resumed = asyncio.create_task(self.collect(jobs.events(job_id, last_event_id=0)))
+        go.set()
+        await jobs.wait(job_id)
+        items = await resumed
+
+        assert [event_id for event_id, _ in items] == [1, 2, 3]
+        assert [event['type'] for _, event in items] == ['tick', 'tick', 'complete']
+
+    @pytest.mark.asyncio
+    async def test_gap_beyond_the_buffer_is_reported(self, jobs, job_id, go):
+        """Test that a client further behind than the buffer is told what it lost."""
+        go.ticks = 8
+        go.set()
+        await jobs.wait(job_id)
+
+        items = await self.collect(jobs.events(job_id, last_event_id=0))
+
+        assert jobs.get(job_id).events == 10
+        assert items[0] == (None, {'type': 'events_lost', 'missed': 4})
+        assert [event_id for event_id, _ in items[1:]] == [5, 6, 7, 8, 9]
+
+    @pytest.mark.asyncio
+    async def test_caught_up_client_gets_nothing_more(self, jobs, job_id, go):
+        """Test that resuming after the last event of a finished job ends straight away."""
+        go.set()
+        job = await jobs.wait(job_id)
+
+        assert await self.collect(jobs.events(job_id, last_event_id=job.events - 1)) == []
+
+    async def collect(self, follower) -> list:
+        """Everything a follower gets until the job is over."""
+        return [item async for item in follower]
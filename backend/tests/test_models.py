@@ -34,6 +34,15 @@ class TestModels:
         providers_none = keys_none.get_available_providers()
         assert len(providers_none) == 0
     
+    def test_api_keys_key_for_provider(self):
+        """Test looking up the key for a provider."""
+        
+        keys = ApiKeys(openai_api_key="sk-openai", google_api_key="google-key")
+        assert keys.key_for_provider("openai") == "sk-openai"
+        assert keys.key_for_provider("google") == "google-key"
+        assert keys.key_for_provider("anthropic") is None
+        assert keys.key_for_provider("unknown") is None
+    
     def test_budget_info_properties(self):
         """Test BudgetInfo calculated properties."""
         
@@ -0,0 +1,151 @@
+"""Tests for the pooled provider HTTP clients."""
+
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import AsyncMock, patch
+from orchestrator import Ray
+from providers import ProviderClients, provider_for_model
+
+
+class StandInProvider(BaseHTTPRequestHandler):
+    """Answers OpenAI-style chat completions, recording each connection and request."""
+
+    protocol_version = "HTTP/1.1"  # Keep connections alive
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes = b"") -> None:
+        self.server.connections.add(self.client_address)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._reply(404)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests.append((self.path, self.headers.get("Authorization")))
+        self._reply(200, json.dumps({
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-4o",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "Hello"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6}
+        }).encode())
+
+
+@pytest.fixture
+def stand_in_provider():
+    """A local HTTP server standing in for a provider API."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInProvider)
+    server.connections = set()
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestProviderClients:
+    """Test the shared provider client pools."""
+
+    @pytest.mark.asyncio
+    async def test_calls_reuse_pooled_connection(self, stand_in_provider):
+        """Test that calls share one kept-alive connection, each with its own key."""
+        base_url = f"http://127.0.0.1:{stand_in_provider.server_port}/v1"
+        clients = ProviderClients(base_urls={"openai": base_url})
+
+        try:
+            for key in ["sk-user-1", "sk-user-2", "sk-user-3"]:
+                response = await clients.acompletion(
+                    model="gpt-4o",
+                    messages=[{"role": "user", "content": "Hi"}],
+                    api_key=key
+                )
+                assert response.choices[0].message.content == "Hello"
+        finally:
+            await clients.aclose()
+
+        assert len(stand_in_provider.connections) == 1
+        assert stand_in_provider.requests == [
+            ("/v1/chat/completions", "Bearer sk-user-1"),
+            ("/v1/chat/completions", "Bearer sk-user-2"),
+            ("/v1/chat/completions", "Bearer sk-user-3"),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_warm_up_connects_ahead_of_first_call(self, stand_in_provider):
+        """Test that warm-up opens the connection the first real call then uses."""
+        base_url = f"http://127.0.0.1:{stand_in_provider.server_port}/v1"
+        clients = ProviderClients(base_urls={"openai": base_url})
+
+        try:
+            reached = await clients.warm_up(["openai"])
+            assert reached == ["openai"]
+            assert len(stand_in_provider.connections) == 1
+            assert stand_in_provider.requests == []
+
+            await clients.acompletion(model="gpt-4o", messages=[{"role": "user", "content": "Hi"}], api_key="sk-test")
+        finally:
+            await clients.aclose()
+
+        assert len(stand_in_provider.connections) == 1
+        assert len(stand_in_provider.requests) == 1
+
+    @pytest.mark.asyncio
+    async def test_warm_up_tolerates_unreachable_provider(self):
+        """Test that a provider that can't be reached is skipped, not raised."""
+        clients = ProviderClients(base_urls={"openai": "http://127.0.0.1:9/v1"})
+
+        try:
+            assert await clients.warm_up(["openai"], timeout=1.0) == []
+        finally:
+            await clients.aclose()
+
+    @pytest.mark.asyncio
+    async def test_one_pool_per_provider(self):
+        """Test that each provider gets its own long-lived pool, reused across calls."""
+        clients = ProviderClients()
+
+        try:
+            openai_params = clients.completion_params({"model": "gpt-4o", "messages": [], "api_key": "sk-a"})
+            anthropic_params = clients.completion_params({"model": "claude-3-haiku-20240307", "messages": []})
+            again = clients.completion_params({"model": "claude-3-opus-20240229", "messages": []})
+
+            assert openai_params["client"]._client is clients.http_client("openai")
+            assert anthropic_params["client"].client is clients.http_client("anthropic")
+            assert again["client"] is anthropic_params["client"]
+            assert clients.http_client("openai") is not clients.http_client("anthropic")
+            assert "api_base" not in anthropic_params
+        finally:
+            await clients.aclose()
+
+    def test_provider_for_model(self):
+        """Test provider detection from our model list."""
+        assert provider_for_model("gpt-4o") == "openai"
+        assert provider_for_model("claude-3-haiku-20240307") == "anthropic"
+        assert provider_for_model("command-r") == "cohere"
+
+    @pytest.mark.asyncio
+    async def test_ray_uses_shared_client(self, sample_agent_config, sample_session, sample_api_keys, mock_litellm_agent_response):
+        """Test that Ray's calls go out over the shared provider client."""
+
+        with patch('orchestrator.litellm.acompletion', new=AsyncMock(return_value=mock_litellm_agent_response)) as mock_call:
+            await Ray.speak(
+                agent=sample_agent_config,
+                session=sample_session,
+                iteration_number=1,
+                previous_messages=[],
+                api_keys=sample_api_keys
+            )
+
+            client = mock_call.call_args[1]["client"]
+            assert client.api_key == sample_api_keys.openai_api_key
@@ -1,9 +1,11 @@
 """Tests for Ray agent functionality."""
 
+import asyncio
+import os
 import pytest
 from unittest.mock import AsyncMock, patch
 from orchestrator import Ray
-from models import AgentMessage
+from models import AgentMessage, ApiKeys
 
 
 class TestRay:
@@ -105,6 +107,54 @@ class TestRay:
             # For GPT-5, should use max_completion_tokens
             assert "max_completion_tokens" in call_kwargs or "max_tokens" in call_kwargs
     
+    @pytest.mark.asyncio
+    async def test_ray_streams_tokens(self, sample_agent_config, sample_session, mock_litellm_stream):
+        """Test that a streamed response is forwarded as it arrives and reconciled at the end."""
+        
+        fake = mock_litellm_stream(["Micro", "services ", "add overhead."], prompt_tokens=120, completion_tokens=30)
+        deltas = []
+        
+        with patch('orchestrator.litellm.acompletion', new=fake), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.002):
+            message = await Ray.speak(
+                agent=sample_agent_config,
+                session=sample_session,
+                iteration_number=1,
+                previous_messages=[],
+                on_delta=deltas.append
+            )
+        
+        assert deltas == ["Micro", "services ", "add overhead."]
+        assert message.content == "Microservices add overhead."
+        assert (message.tokens_in, message.tokens_out) == (120, 30)
+        assert message.cost == 0.002
+        assert fake.calls[0]["stream"] is True
+        assert fake.calls[0]["stream_options"] == {"include_usage": True}
+    
+    @pytest.mark.asyncio
+    async def test_ray_uses_request_scoped_keys(self, sample_agent_config, sample_session, mock_litellm_agent_response, monkeypatch):
+        """Test that concurrent calls each get their own user's key without touching the environment."""
+        
+        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+        keys_seen = {}
+        
+        async def acompletion(**params):
+            await asyncio.sleep(0.01)
+            keys_seen[str(params["messages"][-1]["content"])] = params["api_key"]
+            return mock_litellm_agent_response
+        
+        claude_agent = sample_agent_config.model_copy(update={"id": "Ray-2", "model": "claude-sonnet-4-5-20250929"})
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            await asyncio.gather(
+                Ray.speak(sample_agent_config, sample_session, 1, [], ApiKeys(openai_api_key="sk-tenant-a")),
+                Ray.speak(sample_agent_config, sample_session, 2, [], ApiKeys(openai_api_key="sk-tenant-b")),
+                Ray.speak(claude_agent, sample_session, 1, [], ApiKeys(anthropic_api_key="sk-ant-c")),
+                Ray.speak(sample_agent_config, sample_session, 3, [], None),
+            )
+        
+        assert sorted(keys_seen.values(), key=str) == [None, "sk-ant-c", "sk-tenant-a", "sk-tenant-b"]
+        assert "OPENAI_API_KEY" not in os.environ
+    
     def test_ray_builds_prompt_with_context(self, sample_agent_config, sample_session):
         """Test that Ray builds prompts with proper context."""
         
@@ -121,3 +171,96 @@ class TestRay:
         assert sample_session.issue in prompt
         assert "Iteration" in prompt or "iteration" in prompt
 
+    
+    @pytest.mark.asyncio
+    async def test_ray_times_out(self, sample_agent_config, sample_session):
+        """Test that a Ray with no response in time is marked timed out rather than hanging."""
+        
+        async def hung_completion(**params):
+            await asyncio.sleep(10)
+        
+        with patch('orchestrator.litellm.acompletion', new=hung_completion):
+            message = await Ray.speak(
+                agent=sample_agent_config,
+                session=sample_session,
+                iteration_number=1,
+                previous_messages=[],
+                timeout=0.05
+            )
+        
+        assert message.timed_out
+        assert message.content.startswith("[Timed out:")
+        assert message.cost == 0.0
+        assert message.overhead_cost > 0  # The abandoned prompt
+    
+    def test_ray_prompts_share_a_prefix(self, sample_agent_config, sample_session):
+        """Test that agents and later turns repeat the earlier prompt as a prefix."""
+        from datetime import datetime
+        from models import AgentConfig
+        from prompts import build_ray_agent_messages
+        
+        critic = AgentConfig(id="Ray-2", role="Critic", model="gpt-4o")
+        said = AgentMessage(agent_id="Ray-1", agent_role="Analyst", content="Start small.", timestamp=datetime.now())
+        
+        first = build_ray_agent_messages(sample_agent_config, sample_session, 1, [])
+        second = build_ray_agent_messages(critic, sample_session, 1, [said])
+        
+        assert first[0] == second[0]  # The system message is the same for everyone
+        assert sample_session.issue in first[0]["content"]
+        assert sample_agent_config.role not in first[0]["content"]
+        assert second[1]["content"].startswith("This is Iteration 1.")
+        assert second[1]["content"].endswith("You are Ray-2, a Critic.\n\nProvide your analysis:")
+    
+    @pytest.mark.asyncio
+    async def test_ray_sets_cache_breakpoints_for_anthropic(self, sample_agent_config, sample_session, mock_litellm_agent_response):
+        """Test that Anthropic calls mark the shared prefixes for caching and others don't."""
+        from datetime import datetime
+        from models import AgentConfig
+        
+        claude_agent = AgentConfig(id="Ray-2", role="Critic", model="claude-3-haiku-20240307")
+        said = AgentMessage(agent_id="Ray-1", agent_role="Analyst", content="Start small.", timestamp=datetime.now())
+        seen = {}
+        
+        async def acompletion(**params):
+            seen[params["model"]] = params["messages"]
+            return mock_litellm_agent_response
+        
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            await Ray.speak(sample_agent_config, sample_session, 1, [said])
+            await Ray.speak(claude_agent, sample_session, 1, [said])
+        
+        assert "cache_control" not in str(seen["gpt-4o"])
+        system, user = seen["claude-3-haiku-20240307"]
+        assert system["content"][0]["cache_control"] == {"type": "ephemeral"}
+        assert user["content"][0]["cache_control"] == {"type": "ephemeral"}
+        assert "Start small." in user["content"][0]["text"]
+        assert "cache_control" not in user["content"][1]
+    
+    @pytest.mark.asyncio
+    async def test_ray_counts_prompt_cache_reads(self, sample_agent_config, sample_session):
+        """Test that prompt tokens read from the provider's cache are tallied and billed at the cached rate."""
+        import litellm
+        from orchestrator import Dana
+        
+        def response(cached_tokens):
+            return litellm.ModelResponse(
+                model="gpt-4o",
+                choices=[{"index": 0, "message": {"role": "assistant", "content": "Agreed."}, "finish_reason": "stop"}],
+                usage={
+                    "prompt_tokens": 10000, "completion_tokens": 100, "total_tokens": 10100,
+                    "prompt_tokens_details": {"cached_tokens": cached_tokens}
+                }
+            )
+        
+        with patch('orchestrator.litellm.acompletion', new=AsyncMock(return_value=response(0))):
+            cold = await Ray.speak(sample_agent_config, sample_session, 1, [])
+        with patch('orchestrator.litellm.acompletion', new=AsyncMock(return_value=response(8000))):
+            warm = await Ray.speak(sample_agent_config, sample_session, 1, [])
+        Dana._record_message(sample_session, warm)
+        
+        assert cold.tokens_cached == 0
+        assert warm.tokens_cached == 8000
+        assert warm.tokens_in == 10000
+        assert 0 < warm.cost < cold.cost
+        assert sample_agent_config.tokens_cached == 8000
+        assert sample_session.budget.cached_tokens == 8000
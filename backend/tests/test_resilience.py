@@ -0,0 +1,255 @@
+"""Tests for retrying and hedging LLM calls."""
+
+import asyncio
+import time
+from datetime import datetime
+import httpx
+import litellm
+import pytest
+from unittest.mock import patch
+from orchestrator import Dana, Ray
+from models import AgentMessage
+from resilience import HedgePolicy, LatencyTracker, RetryPolicy, is_transient
+
+
+def rate_limit_error(retry_after=None):
+    """A 429 from a provider, optionally with a Retry-After header."""
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://api.openai.com"))
+    return litellm.RateLimitError("Rate limited", llm_provider="openai", model="gpt-4o", response=response)
+
+
+def timeout_error():
+    """A provider call that timed out."""
+    return litellm.Timeout("Timed out", model="gpt-4o", llm_provider="openai")
+
+
+class TestRetryPolicy:
+    """Test which errors are retried and how long to wait."""
+
+    def test_transient_errors(self):
+        """Test that rate limits, server errors and timeouts are retried, bad requests aren't."""
+        assert is_transient(rate_limit_error())
+        assert is_transient(timeout_error())
+        assert is_transient(litellm.InternalServerError("Boom", llm_provider="openai", model="gpt-4o"))
+        assert is_transient(litellm.ServiceUnavailableError("Down", llm_provider="openai", model="gpt-4o"))
+        assert not is_transient(litellm.BadRequestError("Bad", model="gpt-4o", llm_provider="openai"))
+        assert not is_transient(ValueError("Not a provider error"))
+
+    def test_backoff_with_jitter(self):
+        """Test that waits grow exponentially, are jittered and capped."""
+        policy = RetryPolicy(max_retries=5, base_delay=1.0, max_delay=4.0)
+
+        delays = [policy.delay(3) for _ in range(200)]
+        assert all(0 <= d <= 4.0 for d in delays)
+        assert len(set(delays)) > 100
+        assert max(policy.delay(10) for _ in range(200)) <= 4.0
+        assert all(policy.delay(1) <= 1.0 for _ in range(50))
+
+    def test_retry_after_is_respected(self):
+        """Test that a provider's Retry-After is the minimum wait, within the cap."""
+        policy = RetryPolicy(base_delay=0.01, max_delay=5.0)
+
+        assert policy.delay(1, rate_limit_error(retry_after=2)) >= 2
+        assert policy.delay(1, rate_limit_error(retry_after=60)) == 5.0
+
+    def test_retry_limit(self):
+        """Test that retries stop after the configured count."""
+        policy = RetryPolicy(max_retries=2)
+
+        assert policy.should_retry(rate_limit_error(), 1)
+        assert not policy.should_retry(rate_limit_error(), 2)
+
+
+class TestHedgePolicy:
+    """Test the latency-derived hedging delay."""
+
+    def test_quantile(self):
+        """Test percentiles over recent latencies."""
+        tracker = LatencyTracker(window=100)
+        for ms in range(1, 101):
+            tracker.record("gpt-4o", ms / 1000)
+
+        assert tracker.quantile("gpt-4o", 0.95) == pytest.approx(0.096)
+        assert tracker.quantile("gpt-4o", 0.5) == pytest.approx(0.051)
+        assert tracker.quantile("claude", 0.95) is None
+
+    def test_no_hedging_until_enough_samples(self):
+        """Test that models are only hedged once their latency is known."""
+        policy = HedgePolicy(enabled=True, min_samples=3, min_delay=0.5)
+        policy.latencies.record("gpt-4o", 2.0)
+        policy.latencies.record("gpt-4o", 3.0)
+        assert policy.delay("gpt-4o") is None
+
+        policy.latencies.record("gpt-4o", 0.1)
+        assert policy.delay("gpt-4o") == 3.0
+
+        for _ in range(20):
+            policy.latencies.record("fast", 0.01)
+        assert policy.delay("fast") == 0.5  # Never below the floor
+
+    def test_disabled(self):
+        """Test that hedging is off unless enabled."""
+        policy = HedgePolicy(min_samples=1)
+        policy.latencies.record("gpt-4o", 1.0)
+        assert policy.delay("gpt-4o") is None
+
+
+class TestResilientCalls:
+    """Test retries and hedging on Ray's calls."""
+
+    @pytest.fixture(autouse=True)
+    def policies(self):
+        """Fast retries and hedging after 50ms for every test."""
+        # Load the tokenizer up front so its one-off cost doesn't skew timings
+        litellm.token_counter(model="gpt-4o", messages=[{"role": "user", "content": "Hi"}])
+        hedging = HedgePolicy(enabled=True, min_samples=1, min_delay=0.05)
+        hedging.latencies.record("gpt-4o:full", 0.05)
+        hedging.latencies.record("gpt-4o:stream", 0.05)
+        with patch('orchestrator.get_retry_policy', return_value=RetryPolicy(max_retries=2, base_delay=0.01)), \
+             patch('orchestrator.get_hedge_policy', return_value=hedging), \
+             patch('orchestrator.litellm.completion_cost', return_value=0.01):
+            yield hedging
+
+    async def speak(self, agent, session, **kwargs):
+        """Have the agent speak once."""
+        return await Ray.speak(agent=agent, session=session, iteration_number=1, previous_messages=[], **kwargs)
+
+    @pytest.mark.asyncio
+    async def test_transient_errors_are_retried(self, sample_agent_config, sample_session, mock_litellm_agent_response):
+        """Test that a call failing with 429 then 503 succeeds on the third try."""
+        errors = [rate_limit_error(), litellm.ServiceUnavailableError("Down", llm_provider="openai", model="gpt-4o")]
+
+        async def acompletion(**params):
+            if errors:
+                raise errors.pop(0)
+            return mock_litellm_agent_response
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            message = await self.speak(sample_agent_config, sample_session)
+
+        assert not message.content.startswith("[Error:")
+        assert message.retries == 2
+        assert message.overhead_cost == 0.0  # Rejected calls aren't billed
+
+    @pytest.mark.asyncio
+    async def test_retries_give_up(self, sample_agent_config, sample_session):
+        """Test that persistent errors still end as an error message, with the retries counted."""
+        async def acompletion(**params):
+            raise rate_limit_error()
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            message = await self.speak(sample_agent_config, sample_session)
+
+        assert message.content.startswith("[Error:")
+        assert message.retries == 2
+
+    @pytest.mark.asyncio
+    async def test_permanent_errors_are_not_retried(self, sample_agent_config, sample_session):
+        """Test that a bad request fails straight away."""
+        calls = []
+
+        async def acompletion(**params):
+            calls.append(params)
+            raise litellm.BadRequestError("Bad", model="gpt-4o", llm_provider="openai")
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            message = await self.speak(sample_agent_config, sample_session)
+
+        assert message.content.startswith("[Error:")
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_timeouts_are_charged(self, sample_agent_config, sample_session, mock_litellm_agent_response):
+        """Test that a timed-out attempt's prompt counts as overhead spend."""
+        errors = [timeout_error()]
+
+        async def acompletion(**params):
+            if errors:
+                raise errors.pop(0)
+            return mock_litellm_agent_response
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            message = await self.speak(sample_agent_config, sample_session)
+
+        assert message.retries == 1
+        assert message.overhead_cost > 0
+        assert sample_agent_config.cost_used == pytest.approx(0.01 + message.overhead_cost)
+
+    @pytest.mark.asyncio
+    async def test_slow_call_is_hedged(self, sample_agent_config, sample_session, mock_litellm_agent_response):
+        """Test that a duplicate fired after the hedging delay wins, and the slow call is cancelled."""
+        calls = []
+        cancelled = []
+
+        async def acompletion(**params):
+            calls.append(params)
+            try:
+                await asyncio.sleep(1.0 if len(calls) == 1 else 0.01)
+            except asyncio.CancelledError:
+                cancelled.append(len(calls))
+                raise
+            return mock_litellm_agent_response
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            started = time.monotonic()
+            message = await self.speak(sample_agent_config, sample_session)
+            elapsed = time.monotonic() - started
+
+        assert elapsed < 0.5
+        assert len(calls) == 2
+        await asyncio.sleep(0.01)  # Let the cancellation land
+        assert cancelled == [2]
+        assert message.hedged
+        assert message.overhead_cost > 0  # The cancelled call's prompt
+
+    @pytest.mark.asyncio
+    async def test_fast_call_is_not_hedged(self, sample_agent_config, sample_session, mock_litellm_agent_response):
+        """Test that calls finishing within the delay fire no duplicate."""
+        calls = []
+
+        async def acompletion(**params):
+            calls.append(params)
+            return mock_litellm_agent_response
+
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            message = await self.speak(sample_agent_config, sample_session)
+
+        assert len(calls) == 1
+        assert not message.hedged
+
+    @pytest.mark.asyncio
+    async def test_hedged_stream_passes_on_only_the_winner(self, sample_agent_config, sample_session, mock_litellm_stream):
+        """Test that when streaming, the first copy to produce text wins."""
+        slow = mock_litellm_stream(["Slow ", "answer"])
+        fast = mock_litellm_stream(["Fast ", "answer"])
+        calls = []
+
+        async def acompletion(**params):
+            calls.append(params)
+            if len(calls) == 1:
+                await asyncio.sleep(1.0)
+                return await slow(**params)
+            return await fast(**params)
+
+        deltas = []
+        with patch('orchestrator.litellm.acompletion', new=acompletion):
+            message = await self.speak(sample_agent_config, sample_session, on_delta=deltas.append)
+
+        assert "".join(deltas) == "Fast answer"
+        assert message.content == "Fast answer"
+        assert message.hedged
+
+    def test_budget_tracks_retries_and_hedges(self, sample_session):
+        """Test that abandoned spend is charged to the budget and tallied."""
+        Dana._record_message(sample_session, AgentMessage(
+            agent_id="Ray-1", agent_role="Analyst", content="Hi", timestamp=datetime.now(),
+            cost=0.02, retries=2, hedged=True, overhead_cost=0.005
+        ))
+
+        budget = sample_session.budget
+        assert budget.used == pytest.approx(0.025)
+        assert budget.remaining == pytest.approx(budget.total_budget - 0.025)
+        assert budget.retries == 2
+        assert budget.hedged_calls == 1
+        assert budget.overhead_cost == pytest.approx(0.005)
@@ -0,0 +1,171 @@
+"""Tests for LLM call scheduling."""
+
+import asyncio
+import time
+import pytest
+from config import CallLimits
+from scheduler import CallScheduler, TokenBucket
+
+
+def params(model: str = "gpt-4o", max_tokens: int = 100) -> dict:
+    """Completion params for a short prompt."""
+    return {"model": model, "messages": [{"role": "user", "content": "Hello there"}], "max_tokens": max_tokens}
+
+
+class Usage:
+    """Stand-in for a response's usage."""
+
+    def __init__(self, total_tokens: int):
+        self.total_tokens = total_tokens
+
+
+class Response:
+    """Stand-in for a completion response."""
+
+    def __init__(self, total_tokens: int):
+        self.usage = Usage(total_tokens)
+
+
+class TestTokenBucket:
+    """Test the rate limiting bucket."""
+
+    @pytest.mark.asyncio
+    async def test_takes_wait_for_refill(self):
+        """Test that takes beyond the capacity wait for the bucket to refill."""
+        bucket = TokenBucket(per_minute=600, capacity=1)  # One every 0.1s
+
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.take(1)
+        elapsed = time.monotonic() - started
+
+        assert 0.18 <= elapsed < 0.5
+
+    @pytest.mark.asyncio
+    async def test_oversized_take_leaves_debt(self):
+        """Test that a take larger than the capacity goes through but delays the next one."""
+        bucket = TokenBucket(per_minute=600, capacity=1)
+
+        await bucket.take(3)
+        assert bucket.available() < -1.5
+
+        started = time.monotonic()
+        await bucket.take(1)
+        assert time.monotonic() - started >= 0.25
+
+    def test_refund(self):
+        """Test that refunds go back up to the capacity and negative ones charge more."""
+        bucket = TokenBucket(per_minute=60, capacity=100)
+        bucket.level = 50
+        bucket.refund(20)
+        assert bucket.available() == pytest.approx(70, abs=1)
+        bucket.refund(-30)
+        assert bucket.available() == pytest.approx(40, abs=1)
+        bucket.refund(500)
+        assert bucket.available() == 100
+
+
+class TestCallScheduler:
+    """Test per-provider and per-model admission."""
+
+    async def run_calls(self, scheduler, models, duration=0.05):
+        """Run calls through the scheduler, tracking the most in flight and any wait events."""
+        state = {"running": 0, "peak": 0}
+        events = []
+
+        async def call(model):
+            async with scheduler.slot(params(model), events.append):
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+                await asyncio.sleep(duration)
+                state["running"] -= 1
+
+        await asyncio.gather(*(call(model) for model in models))
+        return state["peak"], events
+
+    @pytest.mark.asyncio
+    async def test_provider_concurrency_cap(self):
+        """Test that calls over a provider's cap queue instead of running."""
+        scheduler = CallScheduler(provider_limits={"openai": CallLimits(concurrency=2)})
+
+        peak, events = await self.run_calls(scheduler, ["gpt-4o"] * 5)
+
+        assert peak == 2
+        stats = scheduler.stats()["providers"]["openai"]
+        assert stats["calls"] == 5
+        assert stats["waited_calls"] == 3
+        assert stats["in_flight"] == 0
+        assert stats["queued"] == 0
+        assert stats["max_wait"] >= 0.05
+
+        queued = [e for e in events if e["type"] == "queued"]
+        dequeued = [e for e in events if e["type"] == "dequeued"]
+        assert [e["queue_depth"] for e in queued] == [1, 2, 3]
+        assert len(dequeued) == 3
+        assert all(e["waited"] > 0 for e in dequeued)
+
+    @pytest.mark.asyncio
+    async def test_model_cap_within_provider(self):
+        """Test that a model's own cap applies on top of its provider's."""
+        scheduler = CallScheduler(model_limits={"gpt-4o": CallLimits(concurrency=1)})
+
+        peak, _ = await self.run_calls(scheduler, ["gpt-4o", "gpt-4o", "gpt-4o-mini", "gpt-4o-mini"])
+
+        # Both mini calls run alongside one gpt-4o call
+        assert peak == 3
+        assert scheduler.stats()["models"]["gpt-4o"]["waited_calls"] == 1
+        assert "gpt-4o-mini" not in scheduler.stats()["models"]
+
+    @pytest.mark.asyncio
+    async def test_providers_are_independent(self):
+        """Test that a saturated provider doesn't hold up another."""
+        scheduler = CallScheduler(default_provider_concurrency=1)
+
+        peak, events = await self.run_calls(scheduler, ["gpt-4o", "claude-3-haiku-20240307"])
+
+        assert peak == 2
+        assert events == []
+
+    @pytest.mark.asyncio
+    async def test_requests_per_minute(self):
+        """Test that calls beyond the request rate wait for the bucket."""
+        scheduler = CallScheduler(provider_limits={"openai": CallLimits(rpm=600)})
+        scheduler._limiters("openai", "gpt-4o")[0].requests.capacity = 1
+        scheduler._limiters("openai", "gpt-4o")[0].requests.level = 1
+
+        started = time.monotonic()
+        await self.run_calls(scheduler, ["gpt-4o"] * 3, duration=0)
+
+        assert time.monotonic() - started >= 0.18
+
+    @pytest.mark.asyncio
+    async def test_tokens_per_minute_reconciled_with_usage(self):
+        """Test that the token bucket is charged the estimate, then corrected to real usage."""
+        scheduler = CallScheduler(provider_limits={"openai": CallLimits(tpm=10000)})
+        bucket = scheduler._limiters("openai", "gpt-4o")[0].tokens
+
+        async with scheduler.slot(params(max_tokens=500)) as ticket:
+            assert ticket.estimated_tokens > 500
+            assert bucket.available() == pytest.approx(10000 - ticket.estimated_tokens, abs=5)
+            ticket.record_usage(Response(total_tokens=120))
+
+        assert bucket.available() == pytest.approx(10000 - 120, abs=5)
+
+    @pytest.mark.asyncio
+    async def test_cancelled_wait_frees_nothing_it_did_not_take(self):
+        """Test that a call cancelled while queued leaves the limiter consistent."""
+        scheduler = CallScheduler(provider_limits={"openai": CallLimits(concurrency=1)})
+
+        async with scheduler.slot(params()):
+            waiter = asyncio.create_task(self.run_calls(scheduler, ["gpt-4o"]))
+            await asyncio.sleep(0.01)
+            assert scheduler.stats()["providers"]["openai"]["queued"] == 1
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+
+        stats = scheduler.stats()["providers"]["openai"]
+        assert stats["queued"] == 0
+        assert stats["in_flight"] == 0
+        peak, _ = await self.run_calls(scheduler, ["gpt-4o"] * 2)
+        assert peak == 1
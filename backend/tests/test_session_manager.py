@@ -0,0 +1,1043 @@
+"""Tests for session persistence."""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import pytest
+from datetime import datetime
+from session_manager import SessionManager
+from session_store import FileSessionStore
+from sqlite_store import SqliteSessionStore
+from session_cache import SessionCache, estimate_session_size
+from session_lock import SessionBusyError, SessionLocks
+from migrate_sessions import migrate
+from models import AgentMessage, Iteration, IterationSummary, SessionStatus, SessionQuery, SessionView
+from pagination import InvalidCursorError
+from search_index import build_match_query
+
+
+def make_iteration(number: int, num_messages: int = 2) -> Iteration:
+    """Build a summarized iteration with a few messages."""
+    messages = [
+        AgentMessage(
+            agent_id=f"Ray-{i + 1}",
+            agent_role="Analyst",
+            content=f"Message {i + 1} of iteration {number}",
+            timestamp=datetime.now(),
+            tokens_in=100,
+            tokens_out=50,
+            cost=0.001
+        )
+        for i in range(num_messages)
+    ]
+    return Iteration(
+        iteration_number=number,
+        messages=messages,
+        summary=IterationSummary(
+            iteration_number=number,
+            summary=f"Summary of iteration {number}",
+            total_cost=0.002,
+            timestamp=datetime.now()
+        )
+    )
+
+
+class TestFileSessionStore:
+    """Test file storage formats."""
+
+    def test_json_round_trip(self, tmp_path, sample_session):
+        """Test that the JSON format saves and loads a session."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "json"))
+        sample_session.iterations.append(make_iteration(1))
+        manager.save_session(sample_session)
+
+        loaded = manager.load_session(sample_session.session_id)
+        assert loaded.issue == sample_session.issue
+        assert len(loaded.iterations) == 1
+        assert (tmp_path / f"{sample_session.session_id}.json").exists()
+
+    def test_journal_appends_only_changes(self, tmp_path, sample_session):
+        """Test that journal saves append records instead of rewriting."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "journal"))
+        journal_path = tmp_path / f"{sample_session.session_id}.journal"
+
+        manager.save_session(sample_session)
+        assert len(journal_path.read_text().splitlines()) == 1
+
+        sample_session.iterations.append(make_iteration(1))
+        sample_session.budget.used += 0.002
+        manager.save_session(sample_session)
+
+        ops = [json.loads(line)['op'] for line in journal_path.read_text().splitlines()]
+        assert ops == ["snapshot", "iteration", "message", "message", "summary", "meta"]
+
+        sample_session.status = SessionStatus.COMPLETED
+        manager.save_session(sample_session)
+        last = json.loads(journal_path.read_text().splitlines()[-1])
+        assert last['op'] == "meta"
+        assert last['fields']['status'] == "completed"
+
+    def test_journal_replay_matches_session(self, tmp_path, sample_session):
+        """Test that replaying a journal rebuilds the saved session."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "journal"))
+        manager.save_session(sample_session)
+        for number in (1, 2):
+            sample_session.iterations.append(make_iteration(number))
+            manager.save_session(sample_session)
+
+        # A fresh manager has no in-memory journal state
+        loaded = SessionManager(FileSessionStore(str(tmp_path), "journal")).load_session(
+            sample_session.session_id
+        )
+        assert loaded.model_dump() == sample_session.model_dump()
+
+    def test_journal_compacts(self, tmp_path, sample_session):
+        """Test that a long journal is compacted back into a snapshot."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "journal"))
+        manager.store.journal_compact_threshold = 5
+        journal_path = tmp_path / f"{sample_session.session_id}.journal"
+
+        manager.save_session(sample_session)
+        for number in (1, 2):
+            sample_session.iterations.append(make_iteration(number))
+            manager.save_session(sample_session)
+
+        lines = journal_path.read_text().splitlines()
+        snapshot = json.loads(lines[0])
+        assert snapshot['op'] == "snapshot"
+        assert len(lines) - 1 - snapshot['base_records'] <= 5
+        loaded = SessionManager(FileSessionStore(str(tmp_path), "journal")).load_session(
+            sample_session.session_id
+        )
+        assert loaded.model_dump() == sample_session.model_dump()
+
+    def test_journal_ignores_torn_record(self, tmp_path, sample_session):
+        """Test that an interrupted append doesn't break loading."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "journal"))
+        manager.save_session(sample_session)
+        journal_path = tmp_path / f"{sample_session.session_id}.journal"
+        with open(journal_path, 'a') as f:
+            f.write('{"op": "message", "iter')
+
+        loaded = manager.load_session(sample_session.session_id)
+        assert loaded.session_id == sample_session.session_id
+
+    def test_journal_without_snapshot(self, tmp_path, sample_session):
+        """Test that a journal not starting with a snapshot fails with a clear error."""
+        store = FileSessionStore(str(tmp_path), "journal")
+        journal_path = tmp_path / f"{sample_session.session_id}.journal"
+        journal_path.write_text(json.dumps({"op": "iteration", "header": {"iteration_number": 1}}) + "\n")
+
+        with pytest.raises(ValueError, match="no snapshot"):
+            store.load_session(sample_session.session_id)
+
+    def test_journal_appends_each_turn_once(self, tmp_path, sample_session):
+        """Test that saves during an iteration append only the new turn, not the whole iteration."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "journal"))
+        journal_path = tmp_path / f"{sample_session.session_id}.journal"
+        manager.save_session(sample_session)
+
+        underway = make_iteration(1, num_messages=3)
+        turns, underway.messages, underway.summary = underway.messages, [], None
+        sample_session.current_iteration = underway
+        for turn in turns:
+            underway.messages.append(turn)
+            manager.save_session(sample_session)
+            records = [json.loads(line) for line in journal_path.read_text().splitlines()]
+            assert records[-2]['op'] == "current_message"
+            assert records[-1] == {"op": "meta", "fields": {"updated_at": records[-1]['fields']['updated_at']}}
+
+        ops = [record['op'] for record in records]
+        assert ops.count("current") == 1
+        assert ops.count("current_message") == 3
+        assert not any('current_iteration' in r.get('fields', {}) for r in records)
+        reopened = FileSessionStore(str(tmp_path), "journal")
+        assert reopened.load_session(sample_session.session_id).model_dump() == sample_session.model_dump()
+
+        # Finishing the iteration clears it
+        sample_session.iterations.append(make_iteration(1, num_messages=3))
+        sample_session.current_iteration = None
+        manager.save_session(sample_session)
+        assert {"op": "current", "header": None} in [json.loads(l) for l in journal_path.read_text().splitlines()]
+        reopened = FileSessionStore(str(tmp_path), "journal")
+        assert reopened.load_session(sample_session.session_id).model_dump() == sample_session.model_dump()
+
+    def test_journal_compacts_iteration_underway(self, tmp_path, sample_session):
+        """Test that a compacted journal keeps the turns of the iteration underway."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "journal"))
+        manager.store.journal_compact_threshold = 2
+        sample_session.current_iteration = make_iteration(1, num_messages=0)
+        sample_session.current_iteration.summary = None
+        for turn in make_iteration(1, num_messages=4).messages:
+            sample_session.current_iteration.messages.append(turn)
+            manager.save_session(sample_session)
+
+        reopened = FileSessionStore(str(tmp_path), "journal")
+        assert reopened.load_session(sample_session.session_id).model_dump() == sample_session.model_dump()
+
+    def test_list_and_delete_both_formats(self, tmp_path, sample_session):
+        """Test listing and deleting sessions stored in either format."""
+        SessionManager(FileSessionStore(str(tmp_path), "json")).save_session(sample_session)
+        other = sample_session.model_copy(update={"session_id": "test-session-002"})
+        manager = SessionManager(FileSessionStore(str(tmp_path), "journal"))
+        manager.save_session(other)
+
+        assert {s.session_id for s in manager.list_sessions()} == {"test-session-001", "test-session-002"}
+        assert manager.delete_session("test-session-001")
+        assert manager.delete_session("test-session-002")
+        assert manager.list_sessions() == []
+        assert not manager.delete_session("test-session-002")
+
+
+class TestSessionCatalog:
+    """Test the session list catalog."""
+
+    def test_listing_does_not_reopen_sessions(self, tmp_path, sample_session):
+        """Test that listing is served from the catalog once it's built."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "json"))
+        manager.save_session(sample_session)
+
+        def fail(path):
+            raise AssertionError(f"Unexpected read of {path}")
+
+        manager.store.catalog._read_session_data = fail
+        items = manager.list_sessions()
+        assert len(items) == 1
+        assert items[0].issue == sample_session.issue
+
+    def test_catalog_survives_restart(self, tmp_path, sample_session):
+        """Test that a new manager reuses the persisted catalog."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "journal"))
+        sample_session.iterations.append(make_iteration(1))
+        manager.save_session(sample_session)
+
+        reopened = SessionManager(FileSessionStore(str(tmp_path), "journal"))
+        assert reopened.store.catalog._entries[sample_session.session_id]['iteration_count'] == 1
+
+    def test_catalog_tracks_out_of_band_changes(self, tmp_path, sample_session):
+        """Test that a refresh picks up files edited or removed behind the catalog."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "json"))
+        manager.save_session(sample_session)
+        session_path = tmp_path / f"{sample_session.session_id}.json"
+
+        data = json.loads(session_path.read_text())
+        data['status'] = "completed"
+        data['budget']['used'] = 1.25
+        session_path.write_text(json.dumps(data, indent=4))
+
+        assert manager.list_sessions()[0].status == SessionStatus.ACTIVE  # Not until the next refresh
+        manager.refresh_catalog()
+        item = manager.list_sessions()[0]
+        assert item.status == SessionStatus.COMPLETED
+        assert item.total_cost == 1.25
+
+        session_path.unlink()
+        manager.refresh_catalog()
+        assert manager.list_sessions() == []
+
+    def test_pages_served_without_touching_files(self, tmp_path, sample_session, monkeypatch):
+        """Test that listing and paging don't scan or stat the sessions directory."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "json"))
+        manager.save_session(sample_session)
+
+        def fail(*args):
+            raise AssertionError("Sessions directory scanned")
+
+        monkeypatch.setattr("session_catalog.os.scandir", fail)
+        assert len(manager.list_sessions()) == 1
+        assert len(manager.query_sessions(SessionQuery(limit=10, status=SessionStatus.ACTIVE)).items) == 1
+
+    def test_log_compacted_while_running(self, tmp_path, sample_session):
+        """Test that repeated saves don't grow the catalog log without bound."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "json"))
+        log_path = tmp_path / ".index" / "catalog.jsonl"
+        for _ in range(300):
+            manager.save_session(sample_session)
+
+        assert len(log_path.read_text().splitlines()) <= 2 + 100 + 1
+        reopened = SessionManager(FileSessionStore(str(tmp_path), "json"))
+        assert [item.session_id for item in reopened.list_sessions()] == [sample_session.session_id]
+
+    def test_compaction_keeps_other_workers_records(self, tmp_path, sample_session):
+        """Test that compacting the shared log keeps entries another worker appended."""
+        first = FileSessionStore(str(tmp_path), "json")
+        second = FileSessionStore(str(tmp_path), "json")
+        other = sample_session.model_copy(update={"session_id": "test-session-002"})
+        second.save_session(other)  # Unknown to the first worker's catalog
+
+        for _ in range(150):
+            first.save_session(sample_session)
+
+        records = [json.loads(line) for line in (tmp_path / ".index" / "catalog.jsonl").read_text().splitlines()]
+        assert len(records) < 150
+        assert {r['entry']['session_id'] for r in records if r['op'] == 'put'} == {"test-session-001", "test-session-002"}
+
+    @pytest.mark.asyncio
+    async def test_catalog_refreshed_on_a_timer(self, tmp_path, sample_session):
+        """Test that the manager's background task picks up out-of-band files."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "json"))
+        manager.catalog_refresh_interval = 0.01
+        manager.start()
+        (tmp_path / f"{sample_session.session_id}.json").write_text(sample_session.model_dump_json())
+
+        for _ in range(100):
+            if await manager.alist_sessions():
+                break
+            await asyncio.sleep(0.01)
+
+        assert [item.session_id for item in await manager.alist_sessions()] == [sample_session.session_id]
+        await manager.aclose()
+
+
+class TestSqliteSessionStore:
+    """Test the SQLite storage backend."""
+
+    @pytest.fixture
+    def manager(self, tmp_path):
+        store = SqliteSessionStore(str(tmp_path / "anjoman.db"))
+        yield SessionManager(store)
+        store.close()
+
+    def test_round_trip(self, manager, sample_session):
+        """Test that a saved session loads back unchanged."""
+        manager.save_session(sample_session)
+        for number in (1, 2):
+            sample_session.iterations.append(make_iteration(number))
+            sample_session.agents[0].cost_used += 0.002
+            manager.save_session(sample_session)
+
+        loaded = manager.load_session(sample_session.session_id)
+        assert loaded.model_dump() == sample_session.model_dump()
+        assert manager.load_session("missing") is None
+
+    def test_appends_new_messages_only(self, manager, sample_session):
+        """Test that saving again doesn't duplicate stored rows."""
+        sample_session.iterations.append(make_iteration(1))
+        manager.save_session(sample_session)
+        manager.save_session(sample_session)
+
+        conn = manager.store._connect()
+        assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 2
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    def test_list_and_delete(self, manager, sample_session):
+        """Test listing and cascading deletes."""
+        sample_session.iterations.append(make_iteration(1))
+        manager.save_session(sample_session)
+
+        items = manager.list_sessions()
+        assert [item.session_id for item in items] == [sample_session.session_id]
+        assert items[0].iteration_count == 1
+
+        assert manager.delete_session(sample_session.session_id)
+        assert not manager.delete_session(sample_session.session_id)
+        conn = manager.store._connect()
+        assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 0
+
+    def test_migrate_from_files(self, tmp_path, sample_session):
+        """Test importing a sessions directory into SQLite."""
+        sessions_dir = tmp_path / "sessions"
+        file_manager = SessionManager(FileSessionStore(str(sessions_dir), "journal"))
+        sample_session.iterations.append(make_iteration(1))
+        file_manager.save_session(sample_session)
+
+        db_path = tmp_path / "anjoman.db"
+        assert migrate(str(sessions_dir), str(db_path)) == 1
+
+        store = SqliteSessionStore(str(db_path))
+        loaded = store.load_session(sample_session.session_id)
+        store.close()
+        assert loaded.model_dump() == sample_session.model_dump()
+
+    def test_migrate_leaves_source_untouched(self, tmp_path, sample_session):
+        """Test that migrating only reads the sessions directory."""
+        sessions_dir = tmp_path / "sessions"
+        sessions_dir.mkdir()
+        (sessions_dir / f"{sample_session.session_id}.json").write_text(sample_session.model_dump_json())
+
+        assert migrate(str(sessions_dir), str(tmp_path / "anjoman.db")) == 1
+
+        assert [path.name for path in sessions_dir.iterdir()] == [f"{sample_session.session_id}.json"]
+        with pytest.raises(PermissionError):
+            FileSessionStore(str(sessions_dir), read_only=True).save_session(sample_session)
+
+
+class TestAsyncSessionManager:
+    """Test the non-blocking SessionManager API."""
+
+    @pytest.mark.asyncio
+    async def test_async_round_trip(self, tmp_path, sample_session):
+        """Test that the async API saves, lists, loads and deletes."""
+        manager = SessionManager(FileSessionStore(str(tmp_path / "sessions"), "journal"), locks=SessionLocks(str(tmp_path / "locks")))
+        await manager.asave_session(sample_session)
+
+        assert [s.session_id for s in await manager.alist_sessions()] == [sample_session.session_id]
+        loaded = await manager.aload_session(sample_session.session_id)
+        assert loaded.issue == sample_session.issue
+
+        await manager.aupdate_session_status(sample_session.session_id, SessionStatus.COMPLETED)
+        loaded = await manager.aload_session(sample_session.session_id)
+        assert loaded.status == SessionStatus.COMPLETED
+
+        assert await manager.adelete_session(sample_session.session_id)
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_slow_save_does_not_block_loop(self, tmp_path, sample_session):
+        """Test that store work runs off the event loop thread."""
+        store = FileSessionStore(str(tmp_path))
+        manager = SessionManager(store)
+        loop_thread = threading.get_ident()
+        save_threads = []
+        original_save = store.save_session
+
+        def slow_save(session):
+            save_threads.append(threading.get_ident())
+            time.sleep(0.2)
+            original_save(session)
+
+        store.save_session = slow_save
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker_task = asyncio.create_task(ticker())
+        await manager.asave_session(sample_session, flush=True)
+        ticker_task.cancel()
+
+        assert save_threads and save_threads[0] != loop_thread
+        assert ticks > 5
+        manager.close()
+
+
+class TestSessionCache:
+    """Test the LRU session cache and write-behind flushing."""
+
+    @pytest.mark.asyncio
+    async def test_hot_reads_skip_the_store(self, tmp_path, sample_session):
+        """Test that a cached session is returned without a store load."""
+        store = FileSessionStore(str(tmp_path))
+        manager = SessionManager(store, SessionCache(max_entries=8, max_bytes=1 << 20))
+        store.save_session(sample_session)
+
+        first = await manager.aload_session(sample_session.session_id)
+        store.load_session = lambda session_id: pytest.fail("Store read on a cache hit")
+        second = await manager.aload_session(sample_session.session_id)
+
+        assert first is second
+        assert manager.cache.stats()["hits"] == 1
+        assert manager.cache.stats()["misses"] == 1
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_writes_are_deferred_until_flush(self, tmp_path, sample_session):
+        """Test that saves coalesce in the cache until flushed."""
+        store = FileSessionStore(str(tmp_path))
+        manager = SessionManager(store, SessionCache(max_entries=8, max_bytes=1 << 20))
+        writes = []
+        original_save = store.save_session
+        store.save_session = lambda session: (writes.append(session.session_id), original_save(session))
+
+        await manager.asave_session(sample_session)
+        sample_session.iterations.append(make_iteration(1))
+        await manager.asave_session(sample_session)
+        assert writes == []
+
+        await manager.aflush()
+        assert writes == [sample_session.session_id]
+        assert len(store.load_session(sample_session.session_id).iterations) == 1
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_eviction_writes_dirty_sessions(self, tmp_path, sample_session):
+        """Test that evicting a dirty session writes it instead of losing it."""
+        store = FileSessionStore(str(tmp_path))
+        manager = SessionManager(store, SessionCache(max_entries=1, max_bytes=1 << 20))
+
+        await manager.asave_session(sample_session)
+        other = sample_session.model_copy(update={"session_id": "test-session-002"})
+        await manager.asave_session(other)
+
+        assert store.load_session(sample_session.session_id) is not None
+        assert manager.cache.stats()["evictions"] == 1
+        assert manager.cache.stats()["entries"] == 1
+        await manager.aclose()
+        assert store.load_session("test-session-002") is not None
+
+    @pytest.mark.asyncio
+    async def test_failed_write_keeps_the_rest_of_the_batch(self, tmp_path, sample_session):
+        """Test that one failing save doesn't lose the other dirty sessions in a flush."""
+        store = FileSessionStore(str(tmp_path))
+        manager = SessionManager(store, SessionCache(max_entries=8, max_bytes=1 << 20))
+        original_save = store.save_session
+
+        def flaky_save(session):
+            if session.session_id == "s-0":
+                raise OSError("Disk full")
+            original_save(session)
+
+        store.save_session = flaky_save
+        for idx in range(3):
+            await manager.asave_session(sample_session.model_copy(update={"session_id": f"s-{idx}"}))
+
+        with pytest.raises(OSError):
+            await manager.aflush()
+
+        assert store.load_session("s-0") is None
+        assert store.load_session("s-1") is not None
+        assert store.load_session("s-2") is not None
+        assert manager.cache.stats()["dirty"] == 1
+
+        store.save_session = original_save
+        await manager.aflush()
+        assert store.load_session("s-0") is not None
+        manager.close()
+
+    def test_byte_cap(self, sample_session):
+        """Test that the byte cap evicts least recently used sessions."""
+        size = estimate_session_size(sample_session)
+        cache = SessionCache(max_entries=10, max_bytes=size * 2)
+        for idx in range(3):
+            cache.put(sample_session.model_copy(update={"session_id": f"s-{idx}"}))
+
+        assert cache.peek("s-0") is None
+        assert cache.peek("s-2") is not None
+        assert cache.stats()["bytes"] <= size * 2
+
+
+class TestArchive:
+    """Test the compressed archive tier."""
+
+    def test_completed_sessions_are_archived(self, tmp_path, sample_session):
+        """Test that completed sessions are compressed and still load and list."""
+        manager = SessionManager(FileSessionStore(str(tmp_path), "journal"))
+        sample_session.iterations.append(make_iteration(1))
+        sample_session.status = SessionStatus.COMPLETED
+        manager.save_session(sample_session)
+        active = sample_session.model_copy(update={"session_id": "test-session-002", "status": SessionStatus.ACTIVE})
+        manager.save_session(active)
+
+        report = manager.archive_sessions(older_than_days=30)
+        assert report.archived == 1
+        assert report.bytes_saved == report.bytes_before - report.bytes_after
+        assert (tmp_path / "archive" / f"{sample_session.session_id}.json.gz").exists()
+        assert not (tmp_path / f"{sample_session.session_id}.journal").exists()
+
+        loaded = manager.load_session(sample_session.session_id)
+        assert loaded.model_dump() == sample_session.model_dump()
+
+        # A fresh catalog finds archived sessions too
+        reopened = SessionManager(FileSessionStore(str(tmp_path), "journal"))
+        assert {s.session_id for s in reopened.list_sessions()} == {"test-session-001", "test-session-002"}
+        assert manager.archive_sessions(older_than_days=30).archived == 0
+
+    def test_stale_sessions_are_archived(self, tmp_path, sample_session):
+        """Test that sessions untouched for N days are archived."""
+        manager = SessionManager(FileSessionStore(str(tmp_path)))
+        manager.save_session(sample_session)
+
+        assert manager.archive_sessions(older_than_days=1).archived == 0
+        assert manager.archive_sessions(older_than_days=0).archived == 1
+
+    def test_saving_restores_live_copy(self, tmp_path, sample_session):
+        """Test that saving an archived session moves it back out of the archive."""
+        manager = SessionManager(FileSessionStore(str(tmp_path)))
+        sample_session.status = SessionStatus.COMPLETED
+        manager.save_session(sample_session)
+        manager.archive_sessions()
+
+        session = manager.load_session(sample_session.session_id)
+        session.status = SessionStatus.ACTIVE
+        manager.save_session(session)
+
+        assert not (tmp_path / "archive" / f"{sample_session.session_id}.json.gz").exists()
+        assert manager.list_sessions()[0].status == SessionStatus.ACTIVE
+        assert manager.delete_session(sample_session.session_id)
+
+    def test_archived_by_another_process(self, tmp_path, sample_session):
+        """Test that a journal archived out from under a server is rewritten whole on its next save."""
+        locks_dir = str(tmp_path / "locks")
+        server = SessionManager(FileSessionStore(str(tmp_path / "sessions"), "journal"), locks=SessionLocks(locks_dir))
+        sample_session.iterations.append(make_iteration(1))
+        server.save_session(sample_session)
+
+        # e.g. archive_sessions.py, with its own store and locks
+        other = SessionManager(FileSessionStore(str(tmp_path / "sessions"), "journal"), locks=SessionLocks(locks_dir))
+        assert other.archive_sessions(older_than_days=0).archived == 1
+
+        sample_session.iterations.append(make_iteration(2))
+        server.save_session(sample_session)
+
+        reopened = FileSessionStore(str(tmp_path / "sessions"), "journal")
+        assert reopened.load_session(sample_session.session_id).model_dump() == sample_session.model_dump()
+        assert not (tmp_path / "sessions" / "archive" / f"{sample_session.session_id}.json.gz").exists()
+
+    def test_locked_sessions_are_skipped(self, tmp_path, sample_session):
+        """Test that a session locked by a request in another worker isn't archived."""
+        locks_dir = str(tmp_path / "locks")
+        server = SessionManager(FileSessionStore(str(tmp_path / "sessions")), locks=SessionLocks(locks_dir))
+        sample_session.status = SessionStatus.COMPLETED
+        server.save_session(sample_session)
+        other = SessionManager(FileSessionStore(str(tmp_path / "sessions")), locks=SessionLocks(locks_dir))
+
+        server.locks.acquire(sample_session.session_id)
+        report = other.archive_sessions()
+        assert (report.archived, report.skipped) == (0, 1)
+
+        server.locks.release(sample_session.session_id)
+        report = other.archive_sessions()
+        assert (report.archived, report.skipped) == (1, 0)
+
+
+class TestSessionQuery:
+    """Test filtered, sorted and paginated listing on both backends."""
+
+    @pytest.fixture(params=["file", "sqlite"])
+    def manager(self, request, tmp_path, sample_session):
+        if request.param == "file":
+            store = FileSessionStore(str(tmp_path / "sessions"))
+        else:
+            store = SqliteSessionStore(str(tmp_path / "anjoman.db"))
+        manager = SessionManager(store)
+
+        for idx in range(7):
+            session = sample_session.model_copy(deep=True, update={
+                "session_id": f"s-{idx}",
+                "created_at": datetime(2025, 1, 1 + idx, 12, 0),
+                "issue": "Pick a database" if idx % 2 else "Hire a designer",
+                "status": SessionStatus.COMPLETED if idx < 3 else SessionStatus.ACTIVE,
+            })
+            session.budget.used = round(0.5 * (7 - idx), 2)
+            manager.save_session(session)
+
+        yield manager
+        manager.close()
+
+    def page_through(self, manager, **filters) -> list[str]:
+        """Collect session IDs across all pages of a query."""
+        ids = []
+        cursor = None
+        while True:
+            page = manager.query_sessions(SessionQuery(limit=3, cursor=cursor, **filters))
+            ids.extend(item.session_id for item in page.items)
+            if not page.next_cursor:
+                return ids
+            cursor = page.next_cursor
+
+    def test_pages_cover_everything_in_order(self, manager):
+        """Test that following cursors visits each session once, newest first."""
+        assert self.page_through(manager) == [f"s-{idx}" for idx in range(6, -1, -1)]
+        assert self.page_through(manager, sort="total_cost", order="asc") == [f"s-{idx}" for idx in range(6, -1, -1)]
+        assert self.page_through(manager, order="asc") == [f"s-{idx}" for idx in range(7)]
+
+    def test_filters(self, manager):
+        """Test status, date, cost and issue filters."""
+        assert self.page_through(manager, status=SessionStatus.COMPLETED) == ["s-2", "s-1", "s-0"]
+        assert self.page_through(
+            manager,
+            created_from=datetime(2025, 1, 3),
+            created_to=datetime(2025, 1, 5, 23, 59)
+        ) == ["s-4", "s-3", "s-2"]
+        assert self.page_through(manager, min_cost=1.0, max_cost=2.0) == ["s-5", "s-4", "s-3"]
+        assert self.page_through(manager, issue="DATABASE") == ["s-5", "s-3", "s-1"]
+
+    def test_filters_on_the_sort_key(self, manager):
+        """Test that status and cost filters combine with sorting, cursors and both orders."""
+        assert self.page_through(manager, sort="total_cost", min_cost=1.0, max_cost=2.5) == ["s-2", "s-3", "s-4", "s-5"]
+        assert self.page_through(
+            manager, sort="total_cost", order="asc", min_cost=1.0, max_cost=2.5
+        ) == ["s-5", "s-4", "s-3", "s-2"]
+        assert self.page_through(
+            manager, sort="total_cost", order="asc", status=SessionStatus.ACTIVE, max_cost=1.5
+        ) == ["s-6", "s-5", "s-4"]
+        assert self.page_through(manager, order="asc", status=SessionStatus.ACTIVE) == ["s-3", "s-4", "s-5", "s-6"]
+        assert self.page_through(manager, sort="total_cost", min_cost=5.0) == []
+
+    def test_unpaginated_query_returns_all(self, manager):
+        """Test that omitting limit returns every match with no cursor."""
+        page = manager.query_sessions(SessionQuery())
+        assert len(page.items) == 7
+        assert page.next_cursor is None
+
+    def test_cursor_must_match_sort(self, manager):
+        """Test that a cursor can't be reused with a different sort."""
+        page = manager.query_sessions(SessionQuery(limit=2))
+        with pytest.raises(InvalidCursorError):
+            manager.query_sessions(SessionQuery(limit=2, sort="total_cost", cursor=page.next_cursor))
+        with pytest.raises(InvalidCursorError):
+            manager.query_sessions(SessionQuery(limit=2, cursor="not-a-cursor"))
+
+
+class TestIterationFields:
+    """Test that every iteration field survives a save and reload on every backend."""
+
+    @pytest.fixture(params=["json", "journal", "sqlite"])
+    def make_store(self, request, tmp_path):
+        """Opens (or reopens) the same store."""
+        stores = []
+
+        def make_store():
+            if request.param == "sqlite":
+                store = SqliteSessionStore(str(tmp_path / "anjoman.db"))
+            else:
+                store = FileSessionStore(str(tmp_path / "sessions"), request.param)
+            stores.append(store)
+            return store
+
+        yield make_store
+        for store in stores:
+            store.close()
+
+    def test_fields_round_trip(self, make_store, sample_session):
+        """Test that skipped agents and fields changed after the first save are reloaded."""
+        store = make_store()
+        iteration = make_iteration(1)
+        iteration.skipped_agents = ["Ray-2", "Ray-3"]
+        sample_session.iterations.append(iteration)
+        store.save_session(sample_session)
+
+        iteration.user_guidance = "Focus on costs"
+        iteration.skipped_agents = ["Ray-3"]
+        sample_session.iterations.append(make_iteration(2))
+        store.save_session(sample_session)
+
+        for loaded in (store.load_session(sample_session.session_id), make_store().load_session(sample_session.session_id)):
+            assert loaded.iterations[0].skipped_agents == ["Ray-3"]
+            assert loaded.iterations[0].user_guidance == "Focus on costs"
+            assert loaded.model_dump() == sample_session.model_dump()
+
+    def test_journal_replays_older_iteration_records(self, tmp_path, sample_session):
+        """Test that journals written before headers were recorded still load."""
+        store = FileSessionStore(str(tmp_path), "journal")
+        store.save_session(sample_session)
+        journal_path = tmp_path / f"{sample_session.session_id}.journal"
+        with open(journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "iteration", "iteration_number": 1, "user_guidance": "Go on"}) + "\n")
+
+        iteration = store.load_session(sample_session.session_id).iterations[0]
+        assert (iteration.iteration_number, iteration.user_guidance, iteration.skipped_agents) == (1, "Go on", [])
+
+    def test_sqlite_adds_header_column(self, tmp_path, sample_session):
+        """Test that a database from before the iteration data column is upgraded and still loads."""
+        db_path = tmp_path / "anjoman.db"
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            "CREATE TABLE iterations (session_id TEXT NOT NULL, position INTEGER NOT NULL, "
+            "iteration_number INTEGER NOT NULL, user_guidance TEXT, summary TEXT, PRIMARY KEY (session_id, position))"
+        )
+        conn.close()
+
+        store = SqliteSessionStore(str(db_path))
+        sample_session.iterations.append(make_iteration(1))
+        store.save_session(sample_session)
+        with store._connect() as conn:
+            conn.execute("UPDATE iterations SET data = NULL")
+        assert store.load_session(sample_session.session_id).iterations[0].iteration_number == 1
+        store.close()
+
+
+class TestSessionView:
+    """Test partial session loads on every backend."""
+
+    @pytest.fixture(params=["json", "journal", "sqlite"])
+    def manager(self, request, tmp_path, sample_session):
+        if request.param == "sqlite":
+            store = SqliteSessionStore(str(tmp_path / "anjoman.db"))
+        else:
+            store = FileSessionStore(str(tmp_path / "sessions"), request.param)
+        manager = SessionManager(store)
+
+        for number in range(1, 6):
+            sample_session.iterations.append(make_iteration(number, num_messages=3))
+            manager.save_session(sample_session)
+
+        yield manager
+        manager.close()
+
+    def test_full_view_matches_load(self, manager, sample_session):
+        """Test that the default view loads the whole session."""
+        full = manager.load_session(sample_session.session_id)
+        viewed = manager.load_session_view(sample_session.session_id, SessionView())
+        assert viewed.model_dump() == full.model_dump()
+
+    def test_latest_iteration(self, manager, sample_session):
+        """Test that negative bounds count from the end."""
+        session = manager.load_session_view(
+            sample_session.session_id, SessionView(iteration_from=-1, iteration_to=-1)
+        )
+        assert [it.iteration_number for it in session.iterations] == [5]
+        assert len(session.iterations[0].messages) == 3
+        assert session.issue == sample_session.issue
+        assert len(session.agents) == len(sample_session.agents)
+
+    def test_summaries_only(self, manager, sample_session):
+        """Test that messages can be left out while keeping summaries."""
+        session = manager.load_session_view(
+            sample_session.session_id,
+            SessionView(include_messages=False, iteration_from=2, iteration_to=3)
+        )
+        assert [it.iteration_number for it in session.iterations] == [2, 3]
+        assert all(not it.messages for it in session.iterations)
+        assert session.iterations[1].summary.summary == "Summary of iteration 3"
+
+    def test_iteration_underway(self, manager, sample_session):
+        """Test that the iteration underway loads with its turns, unless messages are left out."""
+        sample_session.current_iteration = make_iteration(6, num_messages=2)
+        manager.save_session(sample_session)
+
+        session = manager.load_session_view(sample_session.session_id, SessionView(iteration_from=-1))
+        assert len(session.current_iteration.messages) == 2
+        session = manager.load_session_view(sample_session.session_id, SessionView(include_messages=False))
+        assert session.current_iteration.iteration_number == 6
+        assert session.current_iteration.messages == []
+
+    def test_header_only(self, manager, sample_session):
+        """Test that the header view skips iterations entirely."""
+        session = manager.load_session_view(
+            sample_session.session_id, SessionView(include_iterations=False)
+        )
+        assert session.iterations == []
+        assert session.budget.total_budget == sample_session.budget.total_budget
+
+    def test_load_iteration(self, manager, sample_session):
+        """Test fetching a single iteration by number."""
+        iteration = manager.load_iteration(sample_session.session_id, 4)
+        assert iteration.iteration_number == 4
+        assert iteration.messages[0].content == "Message 1 of iteration 4"
+        assert manager.load_iteration(sample_session.session_id, 9) is None
+        assert manager.load_iteration("missing", 1) is None
+
+    @pytest.mark.asyncio
+    async def test_async_view_uses_cache(self, manager, sample_session):
+        """Test that cached sessions are projected without hitting the store."""
+        await manager.aload_session(sample_session.session_id)
+        manager.store.load_session_view = None  # would fail if called
+
+        session = await manager.aload_session_view(
+            sample_session.session_id, SessionView(iteration_from=-2)
+        )
+        assert [it.iteration_number for it in session.iterations] == [4, 5]
+        iteration = await manager.aload_iteration(sample_session.session_id, 2)
+        assert iteration.iteration_number == 2
+
+
+def test_journal_view_skips_out_of_range_messages(tmp_path, sample_session):
+    """Test that journal loads don't decode messages outside the view."""
+    store = FileSessionStore(str(tmp_path), "journal")
+    for number in range(1, 4):
+        sample_session.iterations.append(make_iteration(number))
+        store.save_session(sample_session)
+
+    # Corrupt a message in iteration 1; loads that skip it must still work
+    path = tmp_path / f"{sample_session.session_id}.journal"
+    lines = path.read_text().splitlines()
+    idx = next(i for i, line in enumerate(lines) if line.startswith('{"op": "message", "iteration": 1,'))
+    lines[idx] = lines[idx][:60]
+    path.write_text("\n".join(lines) + "\n")
+
+    session = store.load_session_view(sample_session.session_id, SessionView(iteration_from=2))
+    assert [it.iteration_number for it in session.iterations] == [2, 3]
+
+
+class TestSessionLocks:
+    """Test per-session locking within and across workers."""
+
+    def make_manager(self, tmp_path) -> SessionManager:
+        """Build a manager sharing the session and lock directories under tmp_path."""
+        return SessionManager(
+            FileSessionStore(str(tmp_path / "sessions")),
+            locks=SessionLocks(str(tmp_path / "locks"))
+        )
+
+    @pytest.mark.asyncio
+    async def test_second_request_is_rejected(self, tmp_path, sample_session):
+        """Test that a locked session can't be acquired again in the same worker."""
+        manager = self.make_manager(tmp_path)
+        manager.save_session(sample_session)
+
+        async with manager.alocked_session(sample_session.session_id) as session:
+            assert session.session_id == sample_session.session_id
+            with pytest.raises(SessionBusyError):
+                await manager.aacquire_session(sample_session.session_id)
+
+        # Released once the block exits
+        async with manager.alocked_session(sample_session.session_id) as session:
+            assert session is not None
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_delete_and_status_wait_for_the_lock(self, tmp_path, sample_session):
+        """Test that a locked session can't be deleted or have its status changed under its holder."""
+        manager = self.make_manager(tmp_path)
+        manager.save_session(sample_session)
+
+        async with manager.alocked_session(sample_session.session_id) as session:
+            with pytest.raises(SessionBusyError):
+                await manager.adelete_session(sample_session.session_id)
+            with pytest.raises(SessionBusyError):
+                await manager.aupdate_session_status(sample_session.session_id, SessionStatus.COMPLETED)
+            session.iterations.append(make_iteration(1))
+            await manager.asave_session(session)
+
+        stored = manager.load_session(sample_session.session_id)
+        assert stored.status == SessionStatus.ACTIVE
+        assert len(stored.iterations) == 1
+
+        assert await manager.adelete_session(sample_session.session_id)
+        assert not manager.locks.is_locked(sample_session.session_id)
+        assert manager.load_session(sample_session.session_id) is None
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_lock_holds_across_workers(self, tmp_path, sample_session):
+        """Test that another worker's lock file blocks this one."""
+        worker_a = self.make_manager(tmp_path)
+        worker_b = self.make_manager(tmp_path)
+        worker_a.save_session(sample_session)
+
+        await worker_a.aacquire_session(sample_session.session_id)
+        with pytest.raises(SessionBusyError):
+            await worker_b.aacquire_session(sample_session.session_id)
+        await worker_a.arelease_session(sample_session.session_id)
+
+        assert await worker_b.aacquire_session(sample_session.session_id) is not None
+        await worker_b.arelease_session(sample_session.session_id)
+        worker_a.close()
+        worker_b.close()
+
+    @pytest.mark.asyncio
+    async def test_acquire_reloads_past_stale_cache(self, tmp_path, sample_session):
+        """Test that a worker sees iterations another worker saved under the lock."""
+        worker_a = self.make_manager(tmp_path)
+        worker_b = self.make_manager(tmp_path)
+        worker_a.save_session(sample_session)
+        await worker_a.aload_session(sample_session.session_id)  # now cached in A
+
+        async with worker_b.alocked_session(sample_session.session_id) as session:
+            session.iterations.append(make_iteration(1))
+            await worker_b.asave_session(session)
+
+        async with worker_a.alocked_session(sample_session.session_id) as session:
+            assert len(session.iterations) == 1
+        assert len((await worker_a.aload_session(sample_session.session_id)).iterations) == 1
+        worker_a.close()
+        worker_b.close()
+
+    @pytest.mark.asyncio
+    async def test_missing_session_is_not_held(self, tmp_path):
+        """Test that acquiring a missing session returns None without locking it."""
+        manager = self.make_manager(tmp_path)
+        assert await manager.aacquire_session("missing") is None
+        assert not manager.locks.is_locked("missing")
+        manager.close()
+
+
+class TestSearch:
+    """Test the full-text search index on both backends."""
+
+    @pytest.fixture(params=["file", "sqlite"])
+    def manager(self, request, tmp_path, sample_session):
+        if request.param == "file":
+            store = FileSessionStore(str(tmp_path / "sessions"), "journal")
+        else:
+            store = SqliteSessionStore(str(tmp_path / "anjoman.db"))
+        manager = SessionManager(store)
+
+        iteration = make_iteration(1)
+        iteration.messages[1].content = "Postgres handles the replication lag better than MySQL"
+        iteration.summary.key_disagreements = ["Whether sharding is needed this year"]
+        sample_session.iterations.append(iteration)
+        manager.save_session(sample_session)
+
+        other = sample_session.model_copy(deep=True, update={
+            "session_id": "other",
+            "issue": "Should we adopt Postgres everywhere?",
+            "iterations": []
+        })
+        manager.save_session(other)
+
+        yield manager
+        manager.close()
+
+    def test_hits_point_into_sessions(self, manager, sample_session):
+        """Test that hits carry session, iteration and message pointers."""
+        hits = manager.search_sessions("replication lag")
+        assert len(hits) == 1
+        hit = hits[0]
+        assert hit.session_id == sample_session.session_id
+        assert (hit.kind, hit.iteration_number, hit.position) == ("message", 1, 1)
+        assert hit.agent_id == "Ray-2"
+        assert "**replication**" in hit.snippet
+
+        hits = manager.search_sessions("sharding")
+        assert [(h.kind, h.iteration_number, h.position) for h in hits] == [("disagreement", 1, 0)]
+        assert manager.search_sessions("Summary of iteration")[0].kind == "summary"
+
+    def test_ranking_and_query_syntax(self, manager, sample_session):
+        """Test that every document matching is ranked, with prefix and phrase queries."""
+        hits = manager.search_sessions("postgres")
+        assert {h.session_id for h in hits} == {sample_session.session_id, "other"}
+        assert hits[0].score >= hits[1].score
+
+        assert manager.search_sessions("replic")  # prefix of the last word
+        assert not manager.search_sessions('"lag replication"')
+        assert manager.search_sessions('"replication lag"')
+        assert manager.search_sessions("Postgres OR nonsense") == []
+
+    def test_index_is_incremental(self, manager, sample_session):
+        """Test that saves index new content once and deletes drop it."""
+        sample_session.iterations.append(make_iteration(2))
+        sample_session.iterations[1].messages[0].content = "Consider a managed Kafka cluster"
+        manager.save_session(sample_session)
+        manager.save_session(sample_session)
+
+        assert [h.iteration_number for h in manager.search_sessions("kafka")] == [2]
+        assert len(manager.search_sessions('"Message 2 of iteration 2"')) == 1
+
+        assert manager.delete_session(sample_session.session_id)
+        assert manager.search_sessions("kafka") == []
+        assert [h.session_id for h in manager.search_sessions("postgres")] == ["other"]
+
+    def test_rebuild(self, manager, sample_session):
+        """Test that the index can be rebuilt from the stored sessions."""
+        manager.store.search_index.clear()
+        assert manager.search_sessions("replication") == []
+        assert manager.rebuild_search_index() == 2
+        assert len(manager.search_sessions("replication")) == 1
+
+    @pytest.mark.asyncio
+    async def test_async_search_sees_pending_writes(self, manager, sample_session):
+        """Test that dirty cached sessions are flushed before searching."""
+        session = await manager.aload_session(sample_session.session_id)
+        session.iterations[0].messages[0].content = "Evaluate CockroachDB too"
+        session.iterations.append(make_iteration(2))
+        session.iterations[1].messages[0].content = "CockroachDB costs more"
+        await manager.asave_session(session)
+
+        hits = await manager.asearch_sessions("cockroachdb")
+        assert [h.iteration_number for h in hits] == [2]
+
+
+def test_search_index_built_for_existing_sessions(tmp_path, sample_session):
+    """Test that a store without an index indexes the sessions already on disk."""
+    store = FileSessionStore(str(tmp_path))
+    store.save_session(sample_session)
+    store.close()
+    (tmp_path / ".index" / "search.db").unlink()
+
+    store = FileSessionStore(str(tmp_path))
+    assert store.search_sessions(sample_session.issue.split()[0])
+    store.close()
+
+
+def test_match_query_escapes_operators():
+    """Test that user input can't inject FTS5 syntax."""
+    assert build_match_query('NEAR(foo bar) AND "baz qux"') == '"NEAR" "foo" "bar" "AND" "baz qux"'
+    assert build_match_query("postgr") == '"postgr"*'
+    assert build_match_query('*** ""') is None